@@ -0,0 +1,115 @@
+# fake_openai.py
+# Server giả lập API OpenAI (chat.completions) cho benchmark/load test offline:
+# trả câu trả lời soạn sẵn, có độ trễ cấu hình được, hỗ trợ stream=True.
+#
+# Cách dùng:
+#   python -m benchmarks.fake_openai --port 8099 --delay-ms 300
+#   OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=fake uvicorn main:app
+import argparse
+import asyncio
+import json
+import re
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+CANNED_ANSWER = (
+    "Dựa trên thông tin khóa học, đây là khóa học phù hợp với bạn. "
+    "Khóa học gồm các bài học từ cơ bản đến nâng cao, có ví dụ thực hành và bài tập sau mỗi chương."
+)
+
+# Prompt tiền xử lý query (preprocess_query_with_llm) yêu cầu trả JSON
+_PREPROCESS_QUESTION = re.compile(r'Câu hỏi:\s*"(.*)"', re.S)
+
+
+def _answer_for(messages) -> str:
+    prompt = messages[-1].get("content", "") if messages else ""
+    if "Trả về JSON duy nhất" in prompt:
+        match = _PREPROCESS_QUESTION.search(prompt)
+        query = match.group(1).strip() if match else ""
+        lesson = any(k in query.lower() for k in ["bài học", "bài", "chương", "nội dung"])
+        return json.dumps({"query": query, "type": "lesson" if lesson else "course"}, ensure_ascii=False)
+    return CANNED_ANSWER
+
+
+def create_app(delay_ms: float = 200, token_delay_ms: float = 10, tokens_per_chunk: int = 3):
+    """
+    delay_ms: thời gian chờ trước khi trả lời (hoặc trước token đầu khi stream)
+    token_delay_ms: thời gian giữa các chunk khi stream
+    """
+    app = FastAPI()
+    app.state.calls = 0
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.calls += 1
+        answer = _answer_for(body.get("messages", []))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "gpt-4o-mini")
+
+        await asyncio.sleep(delay_ms / 1000)
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+
+        words = answer.split(" ")
+
+        async def events():
+            for i in range(0, len(words), tokens_per_chunk):
+                piece = " ".join(words[i:i + tokens_per_chunk]) + " "
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(token_delay_ms / 1000)
+            done = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "owned_by": "fake"}]}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server cho benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--delay-ms", type=float, default=200)
+    parser.add_argument("--token-delay-ms", type=float, default=10)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.delay_ms, args.token_delay_ms), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
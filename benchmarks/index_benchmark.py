@@ -0,0 +1,186 @@
+# index_benchmark.py
+# So sánh recall@k, độ trễ và bộ nhớ của các loại index Milvus trên dữ liệu thật.
+#
+# Cách dùng (chạy từ thư mục gốc):
+#   python -m benchmarks.index_benchmark --corpus courses.ndjson --save-vectors data/bench_vectors.npy
+#   python -m benchmarks.index_benchmark --vectors data/bench_vectors.npy --uri http://localhost:19530
+#   python -m benchmarks.index_benchmark --synthetic 50000 --configs my_configs.json
+#
+# Milvus Lite (--uri ./bench.db) chỉ hỗ trợ FLAT/IVF_FLAT/AUTOINDEX,
+# muốn đo IVF_SQ8/HNSW cần Milvus standalone.
+import argparse
+import json
+import time
+import numpy as np
+from pymilvus import connections, utility, FieldSchema, CollectionSchema, DataType, Collection
+
+ALIAS = "bench"
+
+# Mỗi config: index_params khi build + danh sách search_params cần đo
+DEFAULT_CONFIGS = [
+    {"index_type": "FLAT", "params": {}, "search": [{}]},
+    {"index_type": "IVF_FLAT", "params": {"nlist": 128}, "search": [{"nprobe": 8}, {"nprobe": 16}, {"nprobe": 32}]},
+    {"index_type": "IVF_SQ8", "params": {"nlist": 128}, "search": [{"nprobe": 8}, {"nprobe": 16}, {"nprobe": 32}]},
+    {"index_type": "HNSW", "params": {"M": 16, "efConstruction": 200}, "search": [{"ef": 32}, {"ef": 64}, {"ef": 128}]},
+]
+
+
+def load_vectors(args):
+    """
+    Lấy ma trận vector corpus:
+    - --vectors: file .npy đã lưu
+    - --corpus: NDJSON InsertPayload → prepare_records (embed thật)
+    - --synthetic: vector ngẫu nhiên đã chuẩn hóa (chỉ để thử nhanh)
+    """
+    if args.vectors:
+        return np.load(args.vectors).astype(np.float32)
+    if args.corpus:
+        from modules.course_rag_pipeline import prepare_records
+
+        courses = []
+        with open(args.corpus, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    courses.append(json.loads(line))
+        records = prepare_records(courses)
+        vectors = np.asarray([r["embedding"] for r in records], dtype=np.float32)
+        if args.save_vectors:
+            np.save(args.save_vectors, vectors)
+            print(f"💾 Đã lưu {len(vectors)} vectors → {args.save_vectors}")
+        return vectors
+    rng = np.random.default_rng(args.seed)
+    vectors = rng.normal(size=(args.synthetic, 768)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(vectors, n_queries, noise, seed):
+    # Query = vector corpus + nhiễu nhỏ (gần với câu hỏi thật về 1 bài học)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[picks] + rng.normal(scale=noise, size=(len(picks), vectors.shape[1])).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_topk(vectors, queries, k):
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+
+def build_collection(name, vectors, config, insert_chunk):
+    if utility.has_collection(name, using=ALIAS):
+        utility.drop_collection(name, using=ALIAS)
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=vectors.shape[1]),
+    ]
+    collection = Collection(name, CollectionSchema(fields), using=ALIAS)
+    for start in range(0, len(vectors), insert_chunk):
+        chunk = vectors[start:start + insert_chunk]
+        collection.insert([list(range(start, start + len(chunk))), chunk.tolist()])
+    collection.flush()
+
+    started = time.perf_counter()
+    collection.create_index(
+        field_name="embedding",
+        index_params={"index_type": config["index_type"], "metric_type": "IP", "params": config["params"]},
+    )
+    utility.wait_for_index_building_complete(name, using=ALIAS)
+    build_seconds = time.perf_counter() - started
+    collection.load()
+    return collection, build_seconds
+
+
+def memory_bytes(name):
+    try:
+        segments = utility.get_query_segment_info(name, using=ALIAS)
+        return sum(getattr(s, "mem_size", 0) for s in segments)
+    except Exception:
+        return None
+
+
+def run_searches(collection, queries, k, search_params):
+    latencies = []
+    found = []
+    for q in queries:
+        started = time.perf_counter()
+        results = collection.search(
+            data=[q.tolist()], anns_field="embedding",
+            param={"metric_type": "IP", "params": search_params}, limit=k,
+        )
+        latencies.append((time.perf_counter() - started) * 1000)
+        found.append({hit.id for hit in results[0]})
+    return latencies, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark index Milvus: recall@k, latency, memory")
+    parser.add_argument("--uri", default="http://localhost:19530", help="Milvus standalone URI hoặc file Milvus Lite")
+    parser.add_argument("--corpus", help="NDJSON InsertPayload")
+    parser.add_argument("--vectors", help="File .npy vector đã lưu")
+    parser.add_argument("--save-vectors", help="Lưu vector corpus ra .npy để chạy lại")
+    parser.add_argument("--synthetic", type=int, default=20000)
+    parser.add_argument("--configs", help="File JSON danh sách config (mặc định: FLAT, IVF_FLAT, IVF_SQ8, HNSW)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.02)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--insert-chunk", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="index_benchmark.json")
+    parser.add_argument("--keep", action="store_true", help="Không drop collection benchmark sau khi đo")
+    args = parser.parse_args()
+
+    configs = DEFAULT_CONFIGS
+    if args.configs:
+        with open(args.configs, encoding="utf-8") as f:
+            configs = json.load(f)
+
+    vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries, args.noise, args.seed)
+    k = min(args.k, len(vectors))
+    truth = exact_topk(vectors, queries, k)
+    print(f"📚 Corpus: {len(vectors)} vectors | {len(queries)} queries | k={k}")
+
+    connections.connect(ALIAS, uri=args.uri)
+    report = {"uri": args.uri, "vectors": len(vectors), "queries": len(queries), "k": k, "results": []}
+
+    for i, config in enumerate(configs):
+        name = f"bench_{config['index_type'].lower()}_{i}"
+        try:
+            collection, build_seconds = build_collection(name, vectors, config, args.insert_chunk)
+        except Exception as e:
+            print(f"⚠️ {config['index_type']} {config['params']}: build thất bại: {e}")
+            continue
+        mem = memory_bytes(name)
+
+        for search_params in config["search"]:
+            # Warmup trước khi đo
+            run_searches(collection, queries[:10], k, search_params)
+            latencies, found = run_searches(collection, queries, k, search_params)
+            recall = float(np.mean([len(f & t) / k for f, t in zip(found, truth)]))
+            row = {
+                "index_type": config["index_type"],
+                "index_params": config["params"],
+                "search_params": search_params,
+                f"recall@{k}": round(recall, 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+                "build_seconds": round(build_seconds, 2),
+                "memory_bytes": mem,
+            }
+            report["results"].append(row)
+            print(f"{config['index_type']:<9} {json.dumps(config['params']):<36} {json.dumps(search_params):<16} "
+                  f"recall@{k}={row[f'recall@{k}']:.4f}  p50={row['p50_ms']:.2f}ms  p99={row['p99_ms']:.2f}ms  "
+                  f"mem={mem if mem is not None else 'n/a'}")
+
+        if not args.keep:
+            utility.drop_collection(name, using=ALIAS)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"✅ Đã lưu kết quả → {args.output}")
+    print("👉 Áp dụng: MILVUS_INDEX_TYPE, MILVUS_INDEX_PARAMS, MILVUS_SEARCH_PARAMS (JSON)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+# load_test.py
+# Load test offline cho /search, /search/batch, /ask, /ask/stream, /insert:
+# - OpenAI được thay bằng fake server (benchmarks/fake_openai.py), có độ trễ cấu hình được
+# - Store chạy trong process (VECTOR_STORE=memory), seed từ catalogue sinh ngẫu nhiên
+# - App (uvicorn main:app --workers N) và fake OpenAI chạy ở process riêng,
+#   process này chỉ sinh tải (httpx) nên không tranh CPU/GIL với app
+# - Tăng dần concurrency, đo p50/p95/p99 + throughput từng endpoint
+# - Lưu kết quả JSON làm baseline và so sánh với lần chạy trước
+#
+# Cách dùng (chạy từ thư mục gốc):
+#   python -m benchmarks.load_test --synthetic 500 --concurrency 1,4,16,32 --output load_test.json
+#   python -m benchmarks.load_test --workers 4 --endpoints search,ask
+#   python -m benchmarks.load_test --baseline load_test_main.json --fail-on-regression
+#   python -m benchmarks.load_test --compare load_test_main.json load_test.json
+#
+# Model embedding vẫn là model thật (tải lần đầu), nên số đo phản ánh đúng chi phí encode.
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+ENDPOINTS = ["search", "search_batch", "ask", "ask_stream", "insert"]
+
+TOPICS = [
+    "SEO", "Python", "JavaScript", "ReactJS", "Docker", "Kubernetes", "Excel", "Photoshop",
+    "Marketing Facebook", "Quản trị dự án", "Tiếng Anh giao tiếp", "Phân tích dữ liệu",
+    "Machine Learning", "SQL", "Thiết kế UI/UX", "Kế toán", "Bán hàng online", "Nhiếp ảnh",
+]
+LEVELS = ["cơ bản", "nâng cao", "cho người mới", "thực chiến", "từ A đến Z"]
+AUTHORS = ["Nguyễn Minh", "Trần Huy", "Lê Lan", "Phạm Quang", "Võ Thảo", "Đặng Khoa"]
+SENTENCES = [
+    "Bài học hướng dẫn chi tiết từng bước với ví dụ thực tế.",
+    "Học viên thực hành ngay trên dự án mẫu sau mỗi phần.",
+    "Giải thích khái niệm nền tảng và các lỗi thường gặp.",
+    "Tổng hợp mẹo tối ưu hiệu quả công việc hằng ngày.",
+    "Cuối bài có bài tập và đáp án để tự kiểm tra.",
+    "So sánh các cách làm phổ biến và khi nào nên dùng.",
+]
+QUERY_TEMPLATES = [
+    "Khóa học {topic} {level}",
+    "Có khóa nào dạy {topic} không?",
+    "Bài học về {topic} có nội dung gì?",
+    "Ai dạy khóa {topic}?",
+    "Tôi muốn học {topic} thì nên bắt đầu từ đâu",
+]
+
+
+def synthetic_courses(n, lessons_per_course, seed, prefix="S"):
+    """
+    Sinh catalogue khóa học giả (cấu trúc giống InsertPayload).
+    """
+    rng = random.Random(seed)
+    catalogue = []
+    for i in range(n):
+        topic = rng.choice(TOPICS)
+        level = rng.choice(LEVELS)
+        lessons = []
+        for j in range(lessons_per_course):
+            content = " ".join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 12)))
+            lessons.append({
+                "lesson_id": f"{prefix}{i:05d}-L{j:02d}",
+                "title": f"{topic}: phần {j + 1}",
+                "content": f"{topic} {level}. {content}",
+            })
+        catalogue.append({
+            "course_id": f"{prefix}{i:05d}",
+            "title": f"Khóa học {topic} {level}",
+            "author": rng.choice(AUTHORS),
+            "category": topic,
+            "description": f"Khóa học {topic} {level}, {rng.choice(SENTENCES).lower()}",
+            "url": f"https://example.com/{prefix.lower()}{i:05d}",
+            "lessons": lessons,
+        })
+    return catalogue
+
+
+def query_pool(catalogue, size, seed):
+    # Trộn câu hỏi tự nhiên với tiêu đề/tác giả khớp chính xác (đi lexical fast path)
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(size):
+        if catalogue and rng.random() < 0.15:
+            course = rng.choice(catalogue)
+            pool.append(rng.choice([course["title"], course["author"]]))
+        else:
+            pool.append(rng.choice(QUERY_TEMPLATES).format(topic=rng.choice(TOPICS), level=rng.choice(LEVELS)))
+    return pool
+
+
+def app_env(args, store_dir):
+    """
+    Env cho process app (các module đọc env lúc import).
+    """
+    env = dict(os.environ)
+    env["VECTOR_STORE"] = "memory"
+    env["MEMORY_STORE_DIR"] = store_dir
+    env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.openai_port}/v1"
+    env["OPENAI_API_KEY"] = "fake"
+    env.setdefault("LOG_LEVEL", "WARNING")
+    if not args.with_cache:
+        # Mặc định tắt cache để mỗi request đều đi hết pipeline
+        env["RESPONSE_CACHE_SIZE"] = "0"
+        env["QUERY_EMBED_CACHE_SIZE"] = "0"
+        env["SEMANTIC_CACHE"] = "false"
+    return env
+
+
+def start_fake_openai(args):
+    return subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_openai", "--port", str(args.openai_port),
+        "--delay-ms", str(args.llm_delay_ms), "--token-delay-ms", str(args.llm_token_delay_ms),
+    ])
+
+
+def start_app(args, env, workers):
+    return subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+        "--workers", str(workers), "--log-level", "warning",
+    ], env=env)
+
+
+def stop(process):
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def wait_ready(client, timeout, workers=1, process=None):
+    """
+    Chờ /ready trả 200 liên tiếp đủ nhiều lần (request được chia cho các worker,
+    worker nào chưa warmup xong sẽ trả 503).
+    """
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process app đã thoát (exit code {process.returncode})")
+        try:
+            response = await client.get("/ready")
+            streak = streak + 1 if response.status_code == 200 else 0
+            if streak >= 4 * workers:
+                return
+        except Exception:
+            streak = 0
+        await asyncio.sleep(0.1 if streak else 0.5)
+    raise RuntimeError("App không sẵn sàng (/ready) trong thời gian chờ")
+
+
+async def seed(client, catalogue):
+    # Seed qua /insert/bulk để đi đúng đường ghi của service
+    body = "\n".join(json.dumps(c, ensure_ascii=False) for c in catalogue).encode("utf-8")
+    response = await client.post("/insert/bulk", content=body, timeout=None)
+    result = response.json()
+    if result.get("status") != "ok":
+        raise RuntimeError(f"Seed thất bại: {result}")
+    return result
+
+
+class RequestFactory:
+    """
+    Sinh request cho từng endpoint. Trả về coroutine (client) → (ok, bytes).
+    """
+
+    def __init__(self, queries, top_k, batch_size, seed):
+        self.queries = queries
+        self.top_k = top_k
+        self.batch_size = batch_size
+        self.rng = random.Random(seed)
+        self.insert_counter = 0
+
+    def _query(self):
+        return self.rng.choice(self.queries)
+
+    def make(self, endpoint):
+        if endpoint == "search":
+            return self._post_json("/search", {"query": self._query(), "top_k": self.top_k})
+        if endpoint == "search_batch":
+            items = [{"query": self._query(), "top_k": self.top_k, "type": self.rng.choice(["course", "lesson"])}
+                     for _ in range(self.batch_size)]
+            return self._post_json("/search/batch", {"queries": items})
+        if endpoint == "ask":
+            return self._post_json("/ask", {"query": self._query(), "top_k": self.top_k})
+        if endpoint == "ask_stream":
+            return self._stream("/ask/stream", {"query": self._query(), "top_k": self.top_k})
+        if endpoint == "insert":
+            self.insert_counter += 1
+            course = synthetic_courses(1, 3, seed=self.insert_counter, prefix=f"LT{self.insert_counter:06d}-")[0]
+            return self._post_json("/insert", course)
+        raise ValueError(f"Endpoint không hỗ trợ: {endpoint}")
+
+    @staticmethod
+    def _post_json(path, payload):
+        async def call(client):
+            response = await client.post(path, json=payload)
+            ok = response.status_code == 200 and response.json().get("status") == "ok"
+            return ok, len(response.content)
+        return call
+
+    @staticmethod
+    def _stream(path, payload):
+        async def call(client):
+            size = 0
+            ok = True
+            async with client.stream("POST", path, json=payload) as response:
+                async for line in response.aiter_lines():
+                    size += len(line)
+                    if line.startswith("event: error"):
+                        ok = False
+            return ok and response.status_code == 200, size
+        return call
+
+
+async def run_level(client, factory, endpoint, concurrency, n_requests):
+    """
+    Chạy n_requests request với `concurrency` worker song song, trả về thống kê.
+    """
+    latencies = []
+    errors = 0
+    sizes = []
+    remaining = n_requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            call = factory.make(endpoint)
+            started = time.perf_counter()
+            try:
+                ok, size = await call(client)
+            except Exception:
+                ok, size = False, 0
+            latencies.append((time.perf_counter() - started) * 1000)
+            sizes.append(size)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        "mean_ms": round(float(np.mean(latencies)), 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "avg_response_bytes": int(np.mean(sizes)) if sizes else 0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+# So sánh với baseline: latency tăng / throughput giảm quá ngưỡng → regression
+COMPARE_METRICS = [("p50_ms", 1), ("p95_ms", 1), ("p99_ms", 1), ("throughput_rps", -1)]
+
+
+def compare_reports(baseline, current, threshold):
+    """
+    In bảng chênh lệch theo (endpoint, concurrency), trả về list regression.
+    threshold: tỉ lệ cho phép (0.1 = 10%).
+    """
+    base_rows = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n📊 So sánh với baseline {baseline['meta'].get('git_commit')} ({baseline['meta'].get('timestamp')})")
+    for row in current["results"]:
+        base = base_rows.get((row["endpoint"], row["concurrency"]))
+        if base is None:
+            continue
+        parts = []
+        for metric, direction in COMPARE_METRICS:
+            old, new = base[metric], row[metric]
+            delta = (new - old) / old if old else 0.0
+            flag = ""
+            if direction * delta > threshold:
+                flag = " ⚠️"
+                regressions.append({"endpoint": row["endpoint"], "concurrency": row["concurrency"],
+                                    "metric": metric, "baseline": old, "current": new, "delta": round(delta, 4)})
+            parts.append(f"{metric}={new} ({delta:+.1%}){flag}")
+        print(f"{row['endpoint']:<13} c={row['concurrency']:<4} " + "  ".join(parts))
+    if regressions:
+        print(f"❌ {len(regressions)} chỉ số vượt ngưỡng {threshold:.0%}")
+    else:
+        print(f"✅ Không có regression vượt ngưỡng {threshold:.0%}")
+    return regressions
+
+
+def _client(args, levels):
+    import httpx
+
+    limits = httpx.Limits(max_connections=max(levels) * 2, max_keepalive_connections=max(levels) * 2)
+    return httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout, limits=limits)
+
+
+async def run_seed(args, env, catalogue):
+    """
+    Seed bằng app 1 worker (bulk ingest flush store ra đĩa) rồi tắt app:
+    store memory nằm trong từng worker, các worker của lần chạy đo load lại từ đĩa.
+    """
+    process = start_app(args, env, workers=1)
+    try:
+        async with _client(args, [1]) as client:
+            await wait_ready(client, args.ready_timeout, process=process)
+            started = time.perf_counter()
+            seeded = await seed(client, catalogue)
+            seed_seconds = time.perf_counter() - started
+    finally:
+        stop(process)
+    print(f"🌱 Seed: {seeded['courses_ok']} khóa học, {seeded['records_count']} records ({seed_seconds:.1f}s)")
+    return seeded, seed_seconds
+
+
+async def run_benchmark(args, env):
+    catalogue = synthetic_courses(args.synthetic, args.lessons, args.seed)
+    queries = query_pool(catalogue, args.query_pool, args.seed)
+    factory = RequestFactory(queries, args.top_k, args.batch_size, args.seed)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    if args.workers > 1 and "insert" in endpoints:
+        # Mỗi worker giữ store memory riêng và cùng flush vào 1 thư mục → không đo /insert
+        print("⚠️ Bỏ qua endpoint insert khi --workers > 1 (store memory không chia sẻ giữa các worker)")
+        endpoints.remove("insert")
+
+    seeded, seed_seconds = await run_seed(args, env, catalogue)
+
+    process = start_app(args, env, args.workers)
+    print(f"🚀 App: http://127.0.0.1:{args.port} ({args.workers} worker) | fake OpenAI: :{args.openai_port} "
+          f"(delay {args.llm_delay_ms}ms)")
+    try:
+        async with _client(args, levels) as client:
+            await wait_ready(client, args.ready_timeout, args.workers, process)
+            report = {
+                "meta": {
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "git_commit": git_commit(),
+                    "args": vars(args),
+                    "courses": seeded["courses_ok"],
+                    "records": seeded["records_count"],
+                    "seed_seconds": round(seed_seconds, 2),
+                },
+                "results": [],
+            }
+            await _run_endpoints(client, factory, endpoints, levels, args, report)
+    finally:
+        stop(process)
+    return report
+
+
+async def _run_endpoints(client, factory, endpoints, levels, args, report):
+    for endpoint in endpoints:
+        # Warmup từng endpoint trước khi đo
+        await run_level(client, factory, endpoint, 1, args.warmup)
+        for concurrency in levels:
+            row = await run_level(client, factory, endpoint, concurrency, max(args.requests, concurrency))
+            report["results"].append(row)
+            print(f"{endpoint:<13} c={concurrency:<4} p50={row['p50_ms']:>8.1f}ms  p95={row['p95_ms']:>8.1f}ms  "
+                  f"p99={row['p99_ms']:>8.1f}ms  {row['throughput_rps']:>7.1f} req/s  errors={row['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test offline: p50/p95/p99 + throughput theo concurrency")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,4,16,32", help="Các mức concurrency, cách nhau bởi dấu phẩy")
+    parser.add_argument("--requests", type=int, default=200, help="Số request mỗi mức concurrency")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--synthetic", type=int, default=300, help="Số khóa học sinh thêm ngoài `courses`")
+    parser.add_argument("--lessons", type=int, default=6, help="Số bài học mỗi khóa sinh thêm")
+    parser.add_argument("--query-pool", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=10, help="Số query mỗi request /search/batch")
+    parser.add_argument("--llm-delay-ms", type=float, default=300)
+    parser.add_argument("--llm-token-delay-ms", type=float, default=10)
+    parser.add_argument("--with-cache", action="store_true", help="Giữ cache response/embedding/semantic")
+    parser.add_argument("--workers", type=int, default=1, help="Số worker uvicorn của app")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--openai-port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--ready-timeout", type=float, default=600, help="Thời gian chờ load model + warmup")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="load_test.json")
+    parser.add_argument("--baseline", help="File JSON lần chạy trước để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Ngưỡng regression (0.1 = 10%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit code 1 nếu có regression")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Chỉ so sánh 2 file kết quả")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            current = json.load(f)
+        regressions = compare_reports(baseline, current, args.threshold)
+        sys.exit(1 if regressions and args.fail_on_regression else 0)
+
+    store_dir = tempfile.mkdtemp(prefix="load_test_store_")
+    fake_openai = start_fake_openai(args)
+    try:
+        report = asyncio.run(run_benchmark(args, app_env(args, store_dir)))
+    finally:
+        stop(fake_openai)
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"✅ Đã lưu kết quả → {args.output}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_reports(json.load(f), report, args.threshold)
+    sys.exit(1 if regressions and args.fail_on_regression else 0)
+
+
+if __name__ == "__main__":
+    main()
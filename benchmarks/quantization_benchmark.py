@@ -0,0 +1,93 @@
+# quantization_benchmark.py
+# Đo ảnh hưởng của vector nén (sq8 / binary) + re-rank lên recall@k, độ trễ và bộ nhớ,
+# chạy trên MemoryVectorStore (không cần Milvus).
+#
+# Cách dùng (chạy từ thư mục gốc):
+#   python -m benchmarks.quantization_benchmark --vectors data/bench_vectors.npy
+#   python -m benchmarks.quantization_benchmark --corpus courses.ndjson --oversample 1,2,4,8
+#   python -m benchmarks.quantization_benchmark --synthetic 100000
+#
+# Phía Milvus: sq8 tương ứng index IVF_SQ8 (đo được bằng benchmarks/index_benchmark.py),
+# recall sau re-rank thì xem theo số của MemoryVectorStore ở đây.
+import argparse
+import json
+import time
+import numpy as np
+from benchmarks.index_benchmark import load_vectors, make_queries, exact_topk
+from modules.vector_stores import MemoryVectorStore
+
+
+def build_store(vectors, quantization):
+    store = MemoryVectorStore(f"bench_{quantization}", path=None, dim=vectors.shape[1], quantization=quantization)
+    for start in range(0, len(vectors), 10000):
+        chunk = vectors[start:start + 10000]
+        store.upsert([
+            {"id": str(start + i), "type": "course", "embedding": vec}
+            for i, vec in enumerate(chunk)
+        ])
+    return store
+
+
+def run_searches(store, queries, k):
+    latencies = []
+    found = []
+    for q in queries:
+        started = time.perf_counter()
+        hits = store.search([q], "course", k, output_fields=[])[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        found.append({int(h["id"]) for h in hits})
+    return latencies, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vector nén + re-rank: recall@k, latency, memory")
+    parser.add_argument("--corpus", help="NDJSON InsertPayload")
+    parser.add_argument("--vectors", help="File .npy vector đã lưu")
+    parser.add_argument("--save-vectors", help="Lưu vector corpus ra .npy để chạy lại")
+    parser.add_argument("--synthetic", type=int, default=20000)
+    parser.add_argument("--modes", default="none,sq8,binary")
+    parser.add_argument("--oversample", default="1,2,4,8,16", help="Các hệ số RERANK_OVERSAMPLE cần đo")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.02)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="quantization_benchmark.json")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries, args.noise, args.seed)
+    k = min(args.k, len(vectors))
+    truth = exact_topk(vectors, queries, k)
+    print(f"📚 Corpus: {len(vectors)} vectors | {len(queries)} queries | k={k}")
+
+    report = {"vectors": len(vectors), "queries": len(queries), "k": k, "results": []}
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        store = build_store(vectors, mode)
+        memory = store.memory_usage()
+        factors = [1] if mode == "none" else [int(f) for f in args.oversample.split(",")]
+        for factor in factors:
+            store.rerank_oversample = factor
+            run_searches(store, queries[:10], k)  # warmup
+            latencies, found = run_searches(store, queries, k)
+            recall = float(np.mean([len(f & t) / k for f, t in zip(found, truth)]))
+            row = {
+                "quantization": mode,
+                "oversample": factor if mode != "none" else None,
+                f"recall@{k}": round(recall, 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+                **memory,
+            }
+            report["results"].append(row)
+            print(f"{mode:<7} oversample={str(row['oversample']):<5} recall@{k}={row[f'recall@{k}']:.4f}  "
+                  f"p50={row['p50_ms']:.2f}ms  p99={row['p99_ms']:.2f}ms  "
+                  f"codes={memory['codes_bytes'] / 2**20:.1f}MiB  vectors={memory['vectors_bytes'] / 2**20:.1f}MiB")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"✅ Đã lưu kết quả → {args.output}")
+    print("👉 Áp dụng: VECTOR_QUANTIZATION=sq8|binary, RERANK_OVERSAMPLE=<hệ số>")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# bluegreen.py
+# Re-index không downtime: build course_rag_vN cạnh collection đang chạy rồi chuyển alias.
+#
+#   python bluegreen.py status                          # alias đang trỏ tới đâu + các version
+#   python bluegreen.py build --workers 8 --threads 4   # build version mới, catch-up, warmup, chuyển alias
+#   python bluegreen.py build --no-switch               # build xong để đó, chuyển sau
+#   python bluegreen.py switch course_rag_v3
+#   python bluegreen.py rollback                        # về version trước (hoặc --to course_rag_v1)
+#   python bluegreen.py prune --keep 2                  # xóa version cũ (không xóa version đang chạy)
+#
+# Service (main.py) tự đổi sang collection mới sau tối đa ALIAS_REFRESH_SECONDS.
+# Import nặng để trong main(): process worker (spawn) import lại file này.
+import argparse
+import json
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Blue/green re-index course_rag bằng alias Milvus")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("status", help="Alias + danh sách version")
+
+    build = sub.add_parser("build", help="Build version mới từ collection đang chạy")
+    build.add_argument("--workers", type=int, help="Số process embed (mặc định: core / threads)")
+    build.add_argument("--threads", type=int, help="Số thread torch mỗi process")
+    build.add_argument("--chunk", type=int, help="Số record mỗi lần insert")
+    build.add_argument("--batch", type=int, help="Số text mỗi task của worker")
+    build.add_argument("--no-switch", action="store_true", help="Không chuyển alias sau khi build")
+
+    switch = sub.add_parser("switch", help="Chuyển alias sang collection đã build")
+    switch.add_argument("name")
+
+    rollback = sub.add_parser("rollback", help="Chuyển alias về version trước")
+    rollback.add_argument("--to", help="Collection cụ thể (mặc định: version liền trước)")
+
+    prune = sub.add_parser("prune", help="Xóa version cũ")
+    prune.add_argument("--keep", type=int, default=2, help="Số version mới nhất giữ lại")
+    args = parser.parse_args()
+
+    from modules import collection_versions as versions
+
+    if args.command == "build":
+        versions.build_version(workers=args.workers, threads=args.threads, chunk_size=args.chunk,
+                               batch_size=args.batch, switch=not args.no_switch)
+    elif args.command == "switch":
+        versions.switch_alias(args.name)
+    elif args.command == "rollback":
+        versions.rollback(args.to)
+    elif args.command == "prune":
+        versions.prune(args.keep)
+    print(json.dumps(versions.status(), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
-from sentence_transformers import SentenceTransformer
+from modules.model_registry import get_model
 
-# Load model (chỉ load 1 lần khi khởi động server)
-model = SentenceTransformer("intfloat/multilingual-e5-small")
+# Model legacy (course_chunks): chỉ load khi endpoint legacy thực sự được gọi
+LEGACY_MODEL_NAME = "intfloat/multilingual-e5-small"
 
 def get_embedding(text: str, is_query: bool = False):
     """
@@ -15,4 +15,4 @@ def get_embedding(text: str, is_query: bool = False):
     else:
         text = "passage: " + text
 
-    return model.encode(text, normalize_embeddings=True).tolist()
+    return get_model(LEGACY_MODEL_NAME).encode(text, normalize_embeddings=True).tolist()
@@ -0,0 +1,90 @@
+# embedding_parity.py
+# So sánh vector của backend ONNX (có/không quantize) với PyTorch trên 1 corpus mẫu.
+#
+# Cách dùng:
+#   python embedding_parity.py                                   # corpus mẫu có sẵn
+#   python embedding_parity.py --corpus courses.ndjson           # NDJSON InsertPayload
+#   python embedding_parity.py --model intfloat/multilingual-e5-small --no-quantize
+import argparse
+import json
+import time
+import numpy as np
+from modules.embedding_backends import load_sentence_model
+from modules.query_classifier import course_examples, lesson_examples
+
+
+def load_corpus(path):
+    """
+    Đọc NDJSON InsertPayload → danh sách text giống lúc indexing.
+    Không có file thì dùng các câu hỏi mẫu của classifier.
+    """
+    if not path:
+        return course_examples + lesson_examples
+    texts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            course = json.loads(line)
+            texts.append(f"Khóa học: {course['title']}. Tác giả: {course['author']}. "
+                         f"Danh mục: {course.get('category')}. Nội dung: {course.get('description')}")
+            for lesson in course.get("lessons", []):
+                texts.append(f"Bài học: {lesson['title']}. Thuộc khóa học: {course['title']}. "
+                             f"Tác giả: {course['author']}. Nội dung: {lesson['content']}")
+    return texts
+
+
+def encode_timed(model, texts, batch_size):
+    started = time.perf_counter()
+    vectors = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+    return np.asarray(vectors, dtype=np.float32), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra độ khớp ONNX vs PyTorch")
+    parser.add_argument("--model", default="intfloat/multilingual-e5-base")
+    parser.add_argument("--corpus", default=None, help="File NDJSON InsertPayload")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--no-quantize", action="store_true", help="So sánh ONNX fp32 thay vì int8")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Ngưỡng cosine tối thiểu để PASS")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpus)
+    print(f"📚 Corpus: {len(texts)} texts")
+
+    torch_model = load_sentence_model(args.model, backend="torch")
+    onnx_model = load_sentence_model(args.model, backend="onnx", quantize=not args.no_quantize)
+
+    # Chạy 1 lần để warmup trước khi đo
+    torch_model.encode(texts[:2])
+    onnx_model.encode(texts[:2])
+
+    torch_vecs, torch_secs = encode_timed(torch_model, texts, args.batch_size)
+    onnx_vecs, onnx_secs = encode_timed(onnx_model, texts, args.batch_size)
+
+    cosines = np.sum(torch_vecs * onnx_vecs, axis=1)
+    # Top-1 neighbour của mỗi text trong corpus có giữ nguyên không
+    torch_nn = np.argsort(-(torch_vecs @ torch_vecs.T), axis=1)[:, 1]
+    onnx_nn = np.argsort(-(onnx_vecs @ onnx_vecs.T), axis=1)[:, 1]
+
+    report = {
+        "model": args.model,
+        "onnx_variant": "fp32" if args.no_quantize else "qint8",
+        "texts": len(texts),
+        "cosine_mean": round(float(cosines.mean()), 5),
+        "cosine_min": round(float(cosines.min()), 5),
+        "cosine_p5": round(float(np.percentile(cosines, 5)), 5),
+        "top1_neighbor_agreement": round(float(np.mean(torch_nn == onnx_nn)), 4),
+        "torch_seconds": round(torch_secs, 3),
+        "onnx_seconds": round(onnx_secs, 3),
+        "speedup": round(torch_secs / onnx_secs, 2) if onnx_secs else None,
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+    passed = report["cosine_min"] >= args.min_cosine
+    print("✅ PASS" if passed else f"❌ FAIL (cosine_min < {args.min_cosine})")
+    raise SystemExit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
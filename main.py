@@ -1,18 +1,38 @@
 
 # main.py
-from fastapi import FastAPI
+import os
+import time
+import logging
+import threading
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from rag_service import rag_answer_v2
+from rag_service import rag_answer_stream
 from rag_service import rag_search
+from rag_service import rag_search_batch
 from models.requests.InsertPayload import InsertPayload
 from models.requests.AskPayload import AskPayload
-
+from models.requests.BatchSearchPayload import BatchSearchPayload
+
+from modules.executors import run_embedding, run_milvus
+from modules.bulk_ingest import ingest_ndjson
+from modules.response_cache import response_cache
+from modules.semantic_cache import semantic_cache
+from modules.metrics import observe_request, register_cache_stats
+from modules.collection_registry import get_store, warmup_until_ready, watch_alias, is_ready, readiness
 from modules.course_rag_pipeline import (
-    create_course_rag_collection,
-    prepare_records,
-    insert_data,
-    query_rag,
-    courses  # nếu muốn dùng dataset mẫu
+    plan_course_sync_async,
+    embed_plan,
+    apply_course_sync,
+    query_embedding_cache,
+)
+
+# LOG_LEVEL=DEBUG để xem log từng hit khi search (mặc định INFO: tắt)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
 )
 
 app = FastAPI()
@@ -33,8 +53,41 @@ app.add_middleware(
     allow_headers=["*"],        # Authorization, Content-Type, v.v.
 )
 
-# 1️⃣ Khởi tạo collection (chỉ chạy 1 lần)
-collection = create_course_rag_collection()
+# Metrics cho mọi request: thời gian, status, kích thước request/response
+# (response streaming không có Content-Length → chỉ đo tới lúc gửi header)
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    response = None
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        if path != "/metrics":
+            request_size = request.headers.get("content-length")
+            response_size = response.headers.get("content-length") if response is not None else None
+            observe_request(
+                request.method, path, status, time.perf_counter() - started,
+                int(request_size) if request_size else None,
+                int(response_size) if response_size else None,
+            )
+
+register_cache_stats({
+    "query_embedding": query_embedding_cache.stats,
+    "response": response_cache.stats,
+    "semantic_answer": semantic_cache.stats,
+})
+
+# 1️⃣ Khởi tạo collection + warmup model (chạy nền lúc startup, /ready báo khi xong)
+@app.on_event("startup")
+def startup():
+    threading.Thread(target=warmup_until_ready, name="warmup", daemon=True).start()
+    # Theo dõi alias course_rag: chuyển version (blue/green) không cần restart service
+    threading.Thread(target=watch_alias, name="alias-watch", daemon=True).start()
 
 # # 2️⃣ Chuẩn bị dữ liệu mẫu (hoặc load từ DB)
 # records = prepare_records(courses)
@@ -61,10 +114,35 @@ collection = create_course_rag_collection()
 def root():
     return {"status": "ok", "message": "RAG API is running"}
 
+@app.get("/health")
+def health():
+    # Liveness: process còn sống và phục vụ được request
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    # Readiness: model + collection đã load và warmup xong
+    state = readiness()
+    return JSONResponse(status_code=200 if is_ready() else 503, content=state)
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape: latency từng stage, request/response, cache
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "status": "ok",
+        "query_embedding": query_embedding_cache.stats(),
+        "response": response_cache.stats(),
+        "semantic_answer": semantic_cache.stats(),
+    }
+
 @app.post("/search")
-def search(payload: AskPayload):
+async def search(payload: AskPayload):
     try:
-        result = rag_search(payload.query, top_k=payload.top_k)
+        result = await rag_search(payload.query, top_k=payload.top_k, fields=payload.fields)
         return {
             "status": "ok",
             "query": result["query"],
@@ -74,31 +152,58 @@ def search(payload: AskPayload):
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
+@app.post("/search/batch")
+async def search_batch(payload: BatchSearchPayload):
+    # Nhiều query trong 1 request: 1 lần encode, 1 lần search nhiều vector cho mỗi type
+    try:
+        results = await rag_search_batch([q.dict() for q in payload.queries], fields=payload.fields)
+        return {
+            "status": "ok",
+            "results": results,
+        }
+    except Exception as e:
+        return {"status": "error", "detail": str(e)}
+
 @app.post("/insert")
-def insert(payload: InsertPayload):
+async def insert(payload: InsertPayload):
     try:
         # 1️⃣ Convert payload sang dict
         course_dict = payload.dict()
 
-        # 2️⃣ Chuẩn bị dữ liệu embedding (pipeline)
-        records = prepare_records([course_dict]) 
+        # 2️⃣ So sánh với dữ liệu đã lưu: chỉ giữ record mới/thay đổi
+        collection = await run_milvus(get_store)
+        plan = await plan_course_sync_async(collection, [course_dict])
+
+        # 3️⃣ Embed các record thay đổi (pipeline)
+        await run_embedding(embed_plan, plan)
 
-        # 3️⃣ Insert vào Milvus
-        insert_data(collection, records)
+        # 4️⃣ Upsert vào Milvus + xóa bài học đã bị bỏ
+        stats = await run_milvus(apply_course_sync, collection, plan)
 
         return {
             "status": "ok",
             "course_id": payload.course_id,
-            "chunks_count": len(records)
+            "chunks_count": plan["per_course"][payload.course_id]["chunks_count"],
+            **stats
         }
 
     except Exception as e:
         return {"status": "error", "detail": str(e)}
 
+@app.post("/insert/bulk")
+async def insert_bulk(request: Request):
+    # Body NDJSON: mỗi dòng là 1 InsertPayload, đọc dạng stream
+    try:
+        collection = await run_milvus(get_store)
+        result = await ingest_ndjson(collection, request.stream())
+        return {"status": "ok", **result}
+    except Exception as e:
+        return {"status": "error", "detail": str(e)}
+
 @app.post("/ask")
-def ask_question(payload: AskPayload):
+async def ask_question(payload: AskPayload):
     try:
-        result = rag_answer_v2(payload.query, top_k=payload.top_k)
+        result = await rag_answer_v2(payload.query, top_k=payload.top_k)
         return {
             "status": "ok",
             "query": result["query"],
@@ -108,4 +213,13 @@ def ask_question(payload: AskPayload):
             "contexts": result["contexts"]
         }
     except Exception as e:
-        return {"status": "error", "detail": str(e)}
\ No newline at end of file
+        return {"status": "error", "detail": str(e)}
+
+@app.post("/ask/stream")
+async def ask_question_stream(payload: AskPayload):
+    # Server-Sent Events: contexts → token... → done
+    return StreamingResponse(
+        rag_answer_stream(payload.query, top_k=payload.top_k),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
\ No newline at end of file
@@ -0,0 +1,7 @@
+# migrate_partitions.py
+# Chuyển dữ liệu cũ của course_rag (partition _default) sang partition course/lesson
+from modules.course_rag_pipeline import create_course_rag_collection, migrate_to_type_partitions
+
+if __name__ == "__main__":
+    collection = create_course_rag_collection()
+    migrate_to_type_partitions(collection)
@@ -1,5 +1,8 @@
+from typing import List, Optional
 from pydantic import BaseModel
 
 class AskPayload(BaseModel):
     query: str
-    top_k: int = 3
\ No newline at end of file
+    top_k: int = 3
+    # Chỉ dùng cho /search: field trả về cho mỗi hit (vd: ["course_title", "url"])
+    fields: Optional[List[str]] = None
@@ -0,0 +1,12 @@
+from typing import List, Literal, Optional
+from pydantic import BaseModel
+
+class BatchSearchQuery(BaseModel):
+    query: str
+    top_k: int = 3
+    type: Literal["course", "lesson"] = "course"
+
+class BatchSearchPayload(BaseModel):
+    queries: List[BatchSearchQuery]
+    # Field trả về cho mỗi hit (None → đầy đủ)
+    fields: Optional[List[str]] = None
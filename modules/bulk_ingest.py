@@ -0,0 +1,177 @@
+# bulk_ingest.py
+import os
+import json
+import logging
+from dotenv import load_dotenv
+from models.requests.InsertPayload import InsertPayload
+from modules.course_rag_pipeline import plan_course_sync_async, embed_plan, upsert_data, delete_records
+from modules.executors import run_embedding, run_milvus
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Số khóa học embed cùng lúc và số record mỗi lần insert vào Milvus
+BULK_COURSE_BATCH = int(os.getenv("BULK_COURSE_BATCH", "16"))
+BULK_INSERT_CHUNK = int(os.getenv("BULK_INSERT_CHUNK", "1000"))
+
+
+async def iter_ndjson(byte_stream):
+    """
+    Đọc body dạng NDJSON theo từng dòng từ async stream bytes.
+    Trả về (số dòng, dict | Exception) cho từng dòng không rỗng.
+    """
+    buffer = b""
+    line_no = 0
+    async for chunk in byte_stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, _parse_line(line)
+    if buffer.strip():
+        yield line_no + 1, _parse_line(buffer)
+
+
+def _parse_line(line: bytes):
+    try:
+        return InsertPayload(**json.loads(line))
+    except Exception as e:
+        return e
+
+
+class _PendingWrites:
+    """
+    Record đã embed chờ upsert, gom qua nhiều batch khóa học để mỗi lần upsert ~BULK_INSERT_CHUNK records.
+    Chunk cắt theo ranh giới khóa học (khóa học lớn hơn chunk thì đi riêng 1 chunk),
+    nên upsert lỗi không để lại khóa học nửa trong chunk lỗi, nửa trong chunk khác.
+    Record cũ (bài học bị bỏ) chỉ bị xóa sau khi upsert của khóa học đó thành công.
+    """
+
+    def __init__(self, collection, results):
+        self.collection = collection
+        self.results = results
+        self.courses = []   # (line_no, course_id, stats, records, stale_ids)
+        self.size = 0
+
+    async def add(self, line_no, course_id, stats, records, stale_ids):
+        self.courses.append((line_no, course_id, stats, records, stale_ids))
+        self.size += len(records)
+        if self.size >= BULK_INSERT_CHUNK:
+            await self.flush(final=False)
+
+    def _groups(self):
+        group, size = [], 0
+        for course in self.courses:
+            if group and size + len(course[3]) > BULK_INSERT_CHUNK:
+                yield group
+                group, size = [], 0
+            group.append(course)
+            size += len(course[3])
+        if group:
+            yield group
+
+    async def flush(self, final=True):
+        groups = list(self._groups())
+        keep = []
+        if not final and groups and sum(len(c[3]) for c in groups[-1]) < BULK_INSERT_CHUNK:
+            # Nhóm cuối chưa đủ chunk → chờ batch sau
+            keep = groups.pop()
+        for group in groups:
+            records = [r for course in group for r in course[3]]
+            try:
+                if records:
+                    await run_milvus(upsert_data, self.collection, records, flush=False)
+            except Exception as e:
+                # Upsert idempotent: gửi lại các khóa học này sẽ ghi nốt phần còn thiếu (theo content_hash)
+                for line_no, course_id, _, _, _ in group:
+                    self.results.append({"line": line_no, "course_id": course_id, "status": "error", "detail": str(e)})
+                continue
+
+            stale_ids = [rid for course in group for rid in course[4]]
+            try:
+                await run_milvus(delete_records, self.collection, stale_ids)
+            except Exception as e:
+                logger.warning(f"⚠️ Xóa record cũ thất bại: {e}")
+            for line_no, course_id, stats, _, _ in group:
+                self.results.append({"line": line_no, "course_id": course_id, "status": "ok", **stats})
+        self.courses = keep
+        self.size = sum(len(c[3]) for c in keep)
+
+
+def _dedupe_batch(batch, results):
+    """
+    Cùng course_id nhiều lần trong 1 batch: dòng sau cùng thắng (như gửi /insert lần lượt),
+    các dòng trước được đánh dấu skipped. Không dedupe thì plan sinh trùng primary key
+    và tập record cũ bị gộp từ nhiều phiên bản.
+    """
+    last = {payload.course_id: i for i, (_, payload) in enumerate(batch)}
+    kept = []
+    for i, (line_no, payload) in enumerate(batch):
+        winner = last[payload.course_id]
+        if winner == i:
+            kept.append((line_no, payload))
+        else:
+            results.append({"line": line_no, "course_id": payload.course_id, "status": "skipped",
+                            "detail": f"Bị thay bởi dòng {batch[winner][0]} cùng course_id"})
+    return kept
+
+
+async def _ingest_batch(batch, pending):
+    """
+    Chunk + embed 1 batch khóa học (chỉ record thay đổi) rồi đưa vào hàng chờ upsert.
+    """
+    batch = _dedupe_batch(batch, pending.results)
+    courses = [payload.dict() for _, payload in batch]
+    try:
+        plan = await plan_course_sync_async(pending.collection, courses)
+        await run_embedding(embed_plan, plan)
+    except Exception as e:
+        for line_no, payload in batch:
+            pending.results.append({"line": line_no, "course_id": payload.course_id, "status": "error", "detail": str(e)})
+        return
+
+    by_course = {}
+    for record in plan["records"]:
+        by_course.setdefault(record["course_id"], []).append(record)
+    for line_no, payload in batch:
+        stats = plan["per_course"].get(payload.course_id, {"chunks_count": 0, "upserted": 0})
+        records = by_course.get(payload.course_id, [])
+        stale_ids = plan["stale_by_course"].get(payload.course_id, [])
+        await pending.add(line_no, payload.course_id, stats, records, stale_ids)
+
+
+async def ingest_ndjson(collection, byte_stream):
+    """
+    Ingest nhiều khóa học từ NDJSON (mỗi dòng 1 InsertPayload):
+    - Embed theo batch BULK_COURSE_BATCH khóa học (chỉ record mới/thay đổi)
+    - Upsert theo chunk ~BULK_INSERT_CHUNK records (gom qua nhiều batch, không cắt ngang khóa học)
+    - Chỉ flush 1 lần ở cuối
+    Bộ nhớ chỉ giữ 1 batch + 1 chunk chờ ghi tại 1 thời điểm, không phụ thuộc kích thước upload.
+    """
+    results = []
+    pending = _PendingWrites(collection, results)
+    batch = []
+    async for line_no, payload in iter_ndjson(byte_stream):
+        if isinstance(payload, Exception):
+            results.append({"line": line_no, "status": "error", "detail": str(payload)})
+            continue
+        batch.append((line_no, payload))
+        if len(batch) >= BULK_COURSE_BATCH:
+            await _ingest_batch(batch, pending)
+            batch = []
+    if batch:
+        await _ingest_batch(batch, pending)
+    await pending.flush()
+
+    await run_milvus(collection.flush)
+
+    return {
+        "courses_ok": sum(1 for r in results if r["status"] == "ok"),
+        "courses_failed": sum(1 for r in results if r["status"] == "error"),
+        "courses_skipped": sum(1 for r in results if r["status"] == "skipped"),
+        "records_count": sum(r.get("chunks_count", 0) for r in results),
+        "records_upserted": sum(r.get("upserted", 0) for r in results),
+        "results": results,
+    }
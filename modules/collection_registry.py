@@ -0,0 +1,168 @@
+# collection_registry.py
+import os
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+from pymilvus import Collection
+from modules.milvus_connection import ensure_connection
+from modules.vector_stores import open_vector_store
+from modules.course_rag_pipeline import embed_text, search_by_vector, rebuild_lexical_index, start_lexical_rebuild, drop_lexical_index
+from modules.vector_stores import VECTOR_STORE
+from modules.collection_versions import open_live_store, alias_target, COURSE_RAG_ALIAS, ALIAS_REFRESH_SECONDS
+from modules.response_cache import response_cache
+from modules.semantic_cache import semantic_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+COURSE_RAG_COLLECTION = "course_rag"
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+
+# Store (VectorStore) và handle Collection Milvus dùng chung, tạo 1 lần cho cả process
+_stores = {}
+_collections = {}
+_lock = threading.Lock()
+
+# Trạng thái readiness của service
+_state = {
+    "models_loaded": False,
+    "collection_loaded": False,
+    "warmed_up": False,
+    "last_error": None,
+    "live_collection": None,
+}
+
+
+def get_store(name: str = COURSE_RAG_COLLECTION):
+    """
+    Lấy VectorStore đã cache (Milvus hoặc memory theo VECTOR_STORE),
+    chỉ mở/tạo ở lần gọi đầu tiên.
+    course_rag mở qua alias nếu có (watch_alias mở lại khi alias chuyển để đọc schema mới).
+    """
+    store = _stores.get(name)
+    if store is not None:
+        return store
+    with _lock:
+        if name not in _stores:
+            if name == COURSE_RAG_COLLECTION:
+                _stores[name], _state["live_collection"] = open_live_store()
+            else:
+                _stores[name] = open_vector_store(name)
+        return _stores[name]
+
+
+def get_collection(name: str):
+    """
+    Lấy handle Collection Milvus thô đã cache (dùng cho các collection legacy như course_chunks).
+    """
+    collection = _collections.get(name)
+    if collection is not None:
+        return collection
+    ensure_connection()
+    with _lock:
+        if name not in _collections:
+            _collections[name] = Collection(name)
+        return _collections[name]
+
+
+def warmup():
+    """
+    Tạo/load collection, chạy 1 lần encode và 1 lần search giả
+    để request thật đầu tiên không phải trả chi phí cold-start.
+    """
+    vector = embed_text("warmup")
+    _state["models_loaded"] = True
+
+    collection = get_store(COURSE_RAG_COLLECTION)
+    _state["collection_loaded"] = True
+
+    search_by_vector(collection, vector, search_type="course", limit=1)
+    _state["warmed_up"] = True
+    _state["last_error"] = None
+    logger.info("✅ Warmup xong, service sẵn sàng.")
+    # BM25 dựng nền sau khi ready (catalogue lớn mất hàng chục giây), trong lúc đó hybrid = vector
+    start_lexical_rebuild(collection)
+
+
+def warmup_until_ready():
+    """
+    Chạy warmup, thử lại cho tới khi thành công (vd: Milvus khởi động chậm hơn app).
+    """
+    while not is_ready():
+        try:
+            warmup()
+        except Exception as e:
+            _state["last_error"] = str(e)
+            logger.warning(f"⚠️ Warmup thất bại, thử lại sau {WARMUP_RETRY_SECONDS}s: {e}")
+            time.sleep(WARMUP_RETRY_SECONDS)
+
+
+def refresh_live_store():
+    """
+    Alias đã chuyển: search/insert qua alias đã tự sang collection mới (phía Milvus),
+    ở đây chỉ mở lại store để đọc schema/index của collection mới, bỏ cache kết quả
+    của collection cũ, rồi dựng lại BM25 (index cũ phục vụ tới khi dựng xong).
+    """
+    store, target = open_live_store()
+    search_by_vector(store, embed_text("warmup"), search_type="course", limit=1)
+
+    with _lock:
+        previous = _stores.get(COURSE_RAG_COLLECTION)
+        _stores[COURSE_RAG_COLLECTION] = store
+        previous_target, _state["live_collection"] = _state["live_collection"], target
+    response_cache.bump_version()
+    semantic_cache.clear()
+    logger.info(f"🔀 course_rag: {previous_target} → {target}")
+    rebuild_lexical_index(store)
+    if previous is not None and previous.name != store.name:
+        drop_lexical_index(previous)
+
+
+def _check_alias():
+    # Alias chuyển sang collection khác, hoặc alias vừa được tạo lần đầu (trỏ vào chính course_rag)
+    # trong khi store còn mở bằng tên collection → mở lại qua alias để ghi đi theo alias
+    target = alias_target()
+    if target is None:
+        return
+    store = _stores.get(COURSE_RAG_COLLECTION)
+    if target != _state["live_collection"] or (store is not None and store.name != COURSE_RAG_ALIAS):
+        refresh_live_store()
+
+
+def _check_legacy_rows():
+    # migrate_partitions.py chạy trong lúc service đang chạy → tắt lọc theo type khi _default đã trống
+    store = _stores.get(COURSE_RAG_COLLECTION)
+    if store is None or not store.legacy_type_filter:
+        return
+    store.detect_legacy_rows(warn=False)
+    if not store.legacy_type_filter:
+        logger.info(f"✅ {store.name}: partition _default đã trống, search theo partition course/lesson")
+
+
+def watch_alias():
+    """
+    Chạy nền (Milvus): theo dõi alias course_rag (bluegreen.py build/switch/rollback)
+    và dữ liệu cũ trong partition _default (migrate_partitions.py).
+    """
+    while ALIAS_REFRESH_SECONDS > 0 and VECTOR_STORE == "milvus":
+        time.sleep(ALIAS_REFRESH_SECONDS)
+        if not is_ready():
+            continue
+        try:
+            _check_alias()
+        except Exception as e:
+            logger.warning(f"⚠️ Kiểm tra alias thất bại: {e}")
+        try:
+            _check_legacy_rows()
+        except Exception as e:
+            logger.warning(f"⚠️ Kiểm tra partition _default thất bại: {e}")
+
+
+def is_ready() -> bool:
+    return _state["models_loaded"] and _state["collection_loaded"] and _state["warmed_up"]
+
+
+def readiness() -> dict:
+    return {"ready": is_ready(), **_state}
@@ -0,0 +1,258 @@
+# collection_versions.py
+# Blue/green re-index cho course_rag bằng alias Milvus:
+# - mỗi lần build tạo collection mới course_rag_vN cạnh collection đang chạy
+# - service đọc/ghi qua alias COURSE_RAG_ALIAS, chuyển alias là chuyển version (atomic)
+# - rollback = trỏ alias về version trước (collection cũ được giữ lại tới khi prune)
+import os
+import re
+import time
+from dotenv import load_dotenv
+from modules.vector_stores import VECTOR_STORE
+
+load_dotenv()
+
+# Collection gốc (trước khi có version). Alias không được trùng tên collection đang tồn tại,
+# nên alias mặc định là course_rag_live thay vì course_rag.
+LEGACY_COLLECTION = "course_rag"
+COURSE_RAG_ALIAS = os.getenv("COURSE_RAG_ALIAS", "course_rag_live")
+VERSION_PREFIX = f"{LEGACY_COLLECTION}_v"
+_VERSION_NAME = re.compile(rf"^{re.escape(VERSION_PREFIX)}(\d+)$")
+
+# Chu kỳ service kiểm tra alias course_rag (watch_alias), 0 = tắt
+ALIAS_REFRESH_SECONDS = float(os.getenv("ALIAS_REFRESH_SECONDS", "10"))
+
+# Số lượt catch-up tối đa trước khi chuyển alias (dừng sớm khi 1 lượt không còn thay đổi)
+CATCH_UP_PASSES = int(os.getenv("CATCH_UP_PASSES", "3"))
+
+# Số lần search thử (mỗi type) để warmup version mới trước khi chuyển alias
+WARMUP_SEARCHES = 3
+
+
+def _utility():
+    from pymilvus import utility
+    from modules.milvus_connection import ensure_connection
+
+    ensure_connection()
+    return utility
+
+
+def alias_target(alias: str = COURSE_RAG_ALIAS):
+    """
+    Tên collection mà alias đang trỏ tới (None nếu chưa có alias).
+    """
+    utility = _utility()
+    for name in utility.list_collections():
+        if alias in utility.list_aliases(name):
+            return name
+    return None
+
+
+def resolve_collection_name() -> str:
+    """
+    Collection course_rag đang phục vụ: theo alias nếu có, không thì collection gốc.
+    Store memory không có alias → luôn là course_rag.
+    """
+    if VECTOR_STORE != "milvus":
+        return LEGACY_COLLECTION
+    return alias_target() or LEGACY_COLLECTION
+
+
+def open_live_store():
+    """
+    Mở store course_rag cho service. Có alias → mở bằng tên alias: Milvus resolve alias
+    ở mỗi lần search/insert/delete, nên khi alias chuyển mọi replica đọc/ghi collection mới
+    cùng lúc. Trả về (store, collection thật đang được trỏ tới).
+    """
+    from modules.vector_stores import open_vector_store, MilvusVectorStore
+
+    target = alias_target() if VECTOR_STORE == "milvus" else None
+    if target is None:
+        return open_vector_store(LEGACY_COLLECTION), LEGACY_COLLECTION
+    return MilvusVectorStore.from_alias(COURSE_RAG_ALIAS), target
+
+
+def list_versions():
+    """
+    Các collection của course_rag theo thứ tự version: course_rag (0), course_rag_v1, v2...
+    """
+    versions = []
+    for name in _utility().list_collections():
+        if name == LEGACY_COLLECTION:
+            versions.append((0, name))
+            continue
+        match = _VERSION_NAME.match(name)
+        if match:
+            versions.append((int(match.group(1)), name))
+    return [name for _, name in sorted(versions)]
+
+
+def next_version_name() -> str:
+    numbers = [int(m.group(1)) for m in map(_VERSION_NAME.match, list_versions()) if m]
+    return f"{VERSION_PREFIX}{max(numbers, default=0) + 1}"
+
+
+def status() -> dict:
+    return {"alias": COURSE_RAG_ALIAS, "live": resolve_collection_name(), "versions": list_versions()}
+
+
+def catch_up(source, target, batch_size=1000, pool=None, workers=None, threads=None):
+    """
+    Đồng bộ phần thay đổi trên source (vd: /insert) trong lúc build:
+    so content_hash (tính lại theo model hiện tại) của source với target,
+    embed lại record mới/đổi bằng pool worker (như reindex) rồi upsert, xóa record không còn trong source.
+    pool: EmbedPool dùng lại giữa các lượt (không phải load lại model mỗi lượt).
+    """
+    from modules.reindex_pool import reindex, iter_store_items
+
+    target_hashes = {}
+    for batch in target.iter_rows(output_fields=["content_hash"], batch_size=batch_size):
+        target_hashes.update((row["id"], row.get("content_hash")) for row in batch)
+
+    changed = []
+    seen = set()
+    for record, text in iter_store_items(source, batch_size):
+        seen.add(record["id"])
+        if target_hashes.get(record["id"]) != record["content_hash"]:
+            changed.append((record, text))
+    stale = [rid for rid in target_hashes if rid not in seen]
+
+    if changed:
+        reindex(changed, target, upsert=True, total=len(changed), workers=workers, threads=threads,
+                chunk_size=min(batch_size, len(changed)), pool=pool)
+    if stale:
+        target.delete(stale)
+    target.flush()
+    print(f"🔁 Catch-up: {len(changed)} record mới/đổi, {len(stale)} record bị xóa")
+    return {"upserted": len(changed), "deleted": len(stale)}
+
+
+def wait_for_indexes(store):
+    """
+    Chờ build xong từng index vector (embedding, và embedding_bin khi dùng binary):
+    collection có nhiều index thì Milvus bắt buộc truyền index_name.
+    """
+    from modules.vector_stores import BINARY_FIELD
+
+    utility = _utility()
+    fields = [f for f in ("embedding", BINARY_FIELD) if f in store.field_names()]
+    for index in store.collection.indexes:
+        if index.field_name in fields:
+            utility.wait_for_index_building_complete(store.name, index_name=index.index_name)
+
+
+def warmup_version(store):
+    """
+    Chờ index build xong rồi search thử trên cả 2 type, dùng vector có sẵn trong collection
+    (process cha không load model, embed chỉ chạy trong pool worker).
+    """
+    from modules.course_rag_pipeline import search_by_vector
+
+    wait_for_indexes(store)
+    store.collection.load()
+    rows = next(iter(store.iter_rows(output_fields=["embedding"], batch_size=WARMUP_SEARCHES)), [])
+    for row in rows[:WARMUP_SEARCHES]:
+        for search_type in ("course", "lesson"):
+            search_by_vector(store, row["embedding"], search_type=search_type, limit=5)
+    print(f"✅ Warmup xong {store.name}")
+
+
+def switch_alias(name: str):
+    """
+    Trỏ alias sang collection `name` (atomic phía Milvus: service mở store bằng alias
+    nên search/ghi của mọi replica sang collection mới cùng lúc).
+    """
+    utility = _utility()
+    if name not in utility.list_collections():
+        raise ValueError(f"Collection không tồn tại: {name}")
+    previous = alias_target()
+    if previous is None:
+        utility.create_alias(name, COURSE_RAG_ALIAS)
+    elif previous != name:
+        utility.alter_alias(name, COURSE_RAG_ALIAS)
+    print(f"🔀 Alias {COURSE_RAG_ALIAS}: {previous or '(chưa có)'} → {name}")
+    return previous
+
+
+def build_version(workers=None, threads=None, chunk_size=None, batch_size=None, switch=True):
+    """
+    Build version mới từ collection đang chạy:
+    tạo collection (schema/index theo cấu hình hiện tại) → stream + embed lại bằng pool worker
+    → chờ index + warmup → catch-up thay đổi trong lúc build → chuyển alias ngay sau catch-up.
+    Collection đang chạy chỉ bị đọc, search vẫn phục vụ bình thường trong suốt quá trình.
+    """
+    from modules.vector_stores import MilvusVectorStore
+    from modules.reindex_pool import EmbedPool, reindex, iter_store_items, REINDEX_CHUNK, REINDEX_BATCH
+
+    if VECTOR_STORE != "milvus":
+        raise ValueError("Blue/green re-index chỉ hỗ trợ VECTOR_STORE=milvus")
+
+    source_name = resolve_collection_name()
+    alias_created = None
+    if alias_target() is None:
+        # Lần đầu: tạo alias trỏ vào collection hiện tại để service chuyển sang đọc/ghi qua alias
+        # (watch_alias) trong lúc build, tới lúc chuyển version thì mọi ghi đều đi theo alias
+        switch_alias(source_name)
+        alias_created = time.monotonic()
+    source = MilvusVectorStore.open(source_name)
+    name = next_version_name()
+    print(f"🏗️ Build {name} từ {source.name} ({source.count()} records)")
+    target = MilvusVectorStore.open(name)
+
+    started = time.perf_counter()
+    chunk_size = chunk_size or REINDEX_CHUNK
+    # 1 pool cho cả build lẫn các lượt catch-up: model chỉ load 1 lần mỗi worker
+    with EmbedPool(workers, threads) as pool:
+        reindex(
+            iter_store_items(source, chunk_size), target, total=source.count(),
+            chunk_size=chunk_size, batch_size=batch_size or REINDEX_BATCH, pool=pool,
+        )
+        warmup_version(target)
+
+        if alias_created is not None:
+            # Alias mới tạo: chờ mọi replica kịp mở lại store qua alias (watch_alias),
+            # nếu không ghi của replica còn đi thẳng vào source sau khi chuyển alias
+            remaining = 2 * ALIAS_REFRESH_SECONDS - (time.monotonic() - alias_created)
+            if remaining > 0:
+                print(f"⏳ Chờ {remaining:.0f}s để service chuyển sang đọc/ghi qua alias {COURSE_RAG_ALIAS}")
+                time.sleep(remaining)
+
+        # Catch-up sau warmup để khoảng hở tới lúc chuyển alias chỉ còn 1 lượt quét cuối
+        for _ in range(max(1, CATCH_UP_PASSES)):
+            changes = catch_up(source, target, pool=pool)
+            if not changes["upserted"] and not changes["deleted"]:
+                break
+    print(f"✅ {name} sẵn sàng sau {time.perf_counter() - started:.1f}s")
+
+    if switch:
+        switch_alias(name)
+    return name
+
+
+def rollback(to: str = None):
+    """
+    Trỏ alias về version trước version đang chạy (hoặc về `to`).
+    """
+    live = resolve_collection_name()
+    if to is None:
+        versions = list_versions()
+        if live not in versions or versions.index(live) == 0:
+            raise ValueError(f"Không có version nào trước {live} để rollback")
+        to = versions[versions.index(live) - 1]
+    return switch_alias(to)
+
+
+def prune(keep: int = 2):
+    """
+    Xóa các version cũ, giữ lại `keep` version mới nhất và version alias đang trỏ tới.
+    """
+    utility = _utility()
+    live = resolve_collection_name()
+    versions = list_versions()
+    dropped = []
+    for name in versions[:-keep] if keep > 0 else versions:
+        if name == live:
+            continue
+        utility.drop_collection(name)
+        dropped.append(name)
+        print(f"🗑️ Đã xóa {name}")
+    return dropped
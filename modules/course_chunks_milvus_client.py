@@ -1,6 +1,7 @@
 # milvus_client.py
-from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
+from pymilvus import Collection, FieldSchema, CollectionSchema, DataType, utility
 from embedding import get_embedding
+from modules.milvus_connection import ensure_connection
 import os
 from dotenv import load_dotenv
 
@@ -12,13 +13,13 @@ load_dotenv()
 COLLECTION_NAME = "course_chunks"
 DIM = 384  # intfloat/multilingual-e5-small có dim=384
 
-# Kết nối Milvus
-connections.connect("default", host=os.getenv("DB_HOST"), port="19530")
+# Kết nối Milvus: lazy qua ensure_connection()
 
 # =====================
 # Tạo Collection
 # =====================
 def create_collection():
+    ensure_connection()
     if utility.has_collection(COLLECTION_NAME):
         collection = Collection(COLLECTION_NAME)
         collection.load()
@@ -48,6 +49,7 @@ def create_collection():
 # Insert dữ liệu
 # =====================
 def insert_course_chunks(course_id: int, chunks: list[str], course_name: str):
+    ensure_connection()
     collection = Collection(COLLECTION_NAME)
 
     # Dữ liệu chỉ gửi 5 field, bỏ id auto
@@ -83,6 +85,7 @@ def search(query: str, top_k=5):
     """
     Tìm kiếm các chunks gần nhất với query, trả về context đầy đủ cho AI.
     """
+    ensure_connection()
     collection = Collection(COLLECTION_NAME)
     embedding = get_embedding(query, is_query=True)
 
@@ -1,60 +1,145 @@
 # course_rag_pipeline.py
 import os
+import asyncio
+import threading
+import logging
 from dotenv import load_dotenv
-from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection, utility
-from sentence_transformers import SentenceTransformer
+from modules.model_registry import get_model, get_tokenizer
+from modules.embedding_backends import embedding_variant
+from modules.vector_stores import MilvusVectorStore, EMBED_DIM
+from modules.text_chunker import chunk_by_tokens, count_tokens
 import uuid
+import json
+import hashlib
+import numpy as np
+from modules.embedding_cache import EmbeddingLRUCache, normalize_query, size_for_budget
+from modules.embedding_batcher import EmbeddingBatcher
+from modules.executors import run_embedding, run_milvus, embed_executor
+from modules.lexical_index import BM25Index, reciprocal_rank_fusion
+from modules.response_cache import response_cache
+from modules.semantic_cache import semantic_cache
+from modules.metrics import stage_timer, SEARCH_HITS
 
 load_dotenv()
 
-# 1️⃣ Kết nối Milvus
-#connections.connect("default", host="localhost", port="19530")
-connections.connect("default", host=os.getenv("MILVUS_HOST"), port=os.getenv("MILVUS_PORT"))
+# Log từng hit ở mức DEBUG (tắt mặc định, bật bằng LOG_LEVEL=DEBUG)
+logger = logging.getLogger(__name__)
+
+# 1️⃣ Nơi lưu vector: Milvus hoặc store trong process (VECTOR_STORE, modules/vector_stores.py)
 
 # 2️⃣ Tạo schema unified cho cả khóa học & bài học
 def create_course_rag_collection():
-    collection_name = "course_rag"
-    if utility.has_collection(collection_name):
-        print("Collection đã tồn tại, skip tạo.")
-        collection = Collection(collection_name)
-    else:
-        fields = [
-            FieldSchema(name="id", dtype=DataType.VARCHAR, is_primary=True, max_length=64),
-            FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=768),
-            FieldSchema(name="type", dtype=DataType.VARCHAR, max_length=10),
-            FieldSchema(name="course_id", dtype=DataType.VARCHAR, max_length=64),
-            FieldSchema(name="course_title", dtype=DataType.VARCHAR, max_length=256),
-            FieldSchema(name="lesson_id", dtype=DataType.VARCHAR, max_length=64),
-            FieldSchema(name="lesson_title", dtype=DataType.VARCHAR, max_length=256),
-            FieldSchema(name="author", dtype=DataType.VARCHAR, max_length=128),
-            FieldSchema(name="category", dtype=DataType.VARCHAR, max_length=128),
-            FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=65535),
-            FieldSchema(name="url", dtype=DataType.VARCHAR, max_length=512),
-        ]
-        schema = CollectionSchema(fields, description="Unified RAG schema for courses and lessons")
-        collection = Collection(name=collection_name, schema=schema)
-
-        index_params = {"index_type": "IVF_FLAT", "metric_type": "IP", "params": {"nlist": 128}}
-        collection.create_index(field_name="embedding", index_params=index_params)
-        print("✅ Collection created:", collection_name)
-
-    # 🔥 Load collection vào RAM để có thể search
-    try:
-        collection.load()
-        print("✅ Collection loaded vào RAM.")
-    except Exception as e:
-        print("⚠️ Load collection thất bại:", e)
+    """
+    Mở (tạo nếu chưa có) store course_rag — collection alias COURSE_RAG_ALIAS đang trỏ tới
+    (blue/green re-index, modules/collection_versions.py). Trả về VectorStore,
+    các hàm insert_data / query_rag bên dưới đều làm việc qua interface này.
+    """
+    from modules.collection_versions import open_live_store
 
-    return collection
+    return open_live_store()[0]
 
 #embed_query = SentenceTransformer("intfloat/multilingual-e5-small")  # dùng cho truy vấn
 #embed_corpus = SentenceTransformer("intfloat/multilingual-e5-base")  # dùng cho indexing nội dung
 
 # 3️⃣ Sinh embedding model (Việt hóa hoặc đa ngôn ngữ)
-embed_model = SentenceTransformer("intfloat/multilingual-e5-base")
+EMBED_MODEL_NAME = "intfloat/multilingual-e5-base"
+# Model load lazy ở lần encode đầu tiên (model_registry)
+def embed_model():
+    return get_model(EMBED_MODEL_NAME)
+
+# Batch size cho mỗi lần forward khi embed nhiều text (ingestion)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
 
 def embed_text(text):
-    return embed_model.encode(text).tolist()
+    return embed_model().encode(text).tolist()
+
+def _encode_query(text):
+    return np.asarray(embed_model().encode(text), dtype=np.float32)
+
+def _encode_batch(texts):
+    # Copy từng dòng (float32): vector được cache riêng, không giữ cả ma trận của batch
+    return [np.array(vec, dtype=np.float32) for vec in embed_model().encode(texts, batch_size=len(texts))]
+
+# Micro-batching: gom các query đồng thời thành 1 lần encode.
+# Encode chạy trên embed_executor (cùng pool với ingest) nên tổng thread encode <= EMBED_WORKERS
+EMBED_MICRO_BATCHING = os.getenv("EMBED_MICRO_BATCHING", "true").lower() in ("1", "true", "yes")
+query_batcher = EmbeddingBatcher(
+    _encode_batch,
+    max_batch_size=int(os.getenv("EMBED_MICRO_BATCH_SIZE", "32")),
+    max_wait_ms=float(os.getenv("EMBED_MICRO_BATCH_WAIT_MS", "5")),
+    executor=embed_executor,
+)
+
+def _embed_query_uncached(query):
+    if EMBED_MICRO_BATCHING:
+        return query_batcher.encode(query)
+    return _encode_query(query)
+
+# Cache LRU cho embedding của query (/search, /ask), mặc định theo budget bộ nhớ
+# (QUERY_EMBED_CACHE_MB, vector float32); QUERY_EMBED_CACHE_SIZE đặt thẳng số entry
+QUERY_EMBED_CACHE_MB = float(os.getenv("QUERY_EMBED_CACHE_MB", "32"))
+query_embedding_cache = EmbeddingLRUCache(max_size=int(
+    os.getenv("QUERY_EMBED_CACHE_SIZE") or size_for_budget(QUERY_EMBED_CACHE_MB, EMBED_DIM)
+))
+
+def embed_query(query):
+    """
+    Embed query có qua cache LRU (key = model + query đã chuẩn hóa).
+    Cache miss sẽ đi qua micro-batcher nếu được bật.
+    """
+    return query_embedding_cache.get_or_compute(EMBED_MODEL_NAME, query, _embed_query_uncached)
+
+async def embed_query_async(query):
+    """
+    Bản async của embed_query: cache hit trả về ngay,
+    cache miss chờ micro-batcher (hoặc encode trên pool embedding).
+    """
+    vector = query_embedding_cache.get(EMBED_MODEL_NAME, query)
+    if vector is not None:
+        return vector
+    # Embed query đã chuẩn hóa (chính là key cache), giống embed_query
+    normalized = normalize_query(query)
+    if EMBED_MICRO_BATCHING:
+        vector = await asyncio.wrap_future(query_batcher.submit(normalized))
+    else:
+        vector = await run_embedding(_encode_query, normalized)
+    query_embedding_cache.put(EMBED_MODEL_NAME, query, vector)
+    return vector
+
+def embed_queries(queries):
+    """
+    Embed nhiều query (batch search): lấy từ cache LRU trước,
+    các query còn thiếu được encode chung trong 1 lần forward.
+    """
+    vectors = [query_embedding_cache.get(EMBED_MODEL_NAME, q) for q in queries]
+    missing = list(dict.fromkeys(normalize_query(q) for q, v in zip(queries, vectors) if v is None))
+    if missing:
+        encoded = dict(zip(missing, _encode_batch(missing)))
+        for q, vector in encoded.items():
+            query_embedding_cache.put(EMBED_MODEL_NAME, q, vector)
+        vectors = [v if v is not None else encoded[normalize_query(q)] for q, v in zip(queries, vectors)]
+    return vectors
+
+def embed_texts(texts, batch_size=EMBED_BATCH_SIZE):
+    """
+    Embed nhiều text cùng lúc theo batch.
+    - Sắp xếp text theo độ dài để mỗi batch có độ dài gần nhau (giảm padding).
+    - Encode từng batch với kích thước cấu hình được.
+    - Trả về list vector đúng thứ tự đầu vào.
+    """
+    if not texts:
+        return []
+
+    # Bucket theo độ dài: các text dài/ngắn gần nhau sẽ nằm cùng batch
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+    vectors = [None] * len(texts)
+    for start in range(0, len(order), batch_size):
+        batch_idx = order[start:start + batch_size]
+        batch_vecs = embed_model().encode([texts[i] for i in batch_idx], batch_size=len(batch_idx))
+        for i, vec in zip(batch_idx, batch_vecs):
+            vectors[i] = vec.tolist()
+    return vectors
 
 # 4️⃣ Chuẩn bị dữ liệu mẫu
 courses = [
@@ -87,15 +172,82 @@ courses = [
 
 
 # 5️⃣ Chuyển dữ liệu thành các bản ghi embedding
-def prepare_records(courses):
+# Namespace cố định để sinh ID record từ course_id/lesson_id (uuid5)
+RECORD_ID_NAMESPACE = uuid.UUID("5b0e6f3c-3c1e-4d7a-9a52-6f1d3f8e2a41")
+
+def record_id(course_id, lesson_id="", chunk_index=0):
+    """
+    ID xác định (deterministic) cho record: cùng course/lesson/chunk luôn ra cùng ID,
+    nên insert lại 1 khóa học sẽ ghi đè thay vì nhân bản.
+    Chunk 0 giữ nguyên ID của bài học để bài ngắn (1 chunk) không đổi ID.
+    """
+    key = f"lesson:{course_id}:{lesson_id}" if lesson_id else f"course:{course_id}"
+    if chunk_index:
+        key += f"#{chunk_index}"
+    return str(uuid.uuid5(RECORD_ID_NAMESPACE, key))
+
+# Chunk bài học theo token: 0 = dùng giới hạn của model (max_seq_length)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "0"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+CHUNK_MIN_TOKENS = 64
+
+def chunk_lesson_content(header, content):
+    """
+    Cắt nội dung bài học thành các chunk sao cho header + chunk
+    nằm trong giới hạn token của model (không bị truncate âm thầm).
+    """
+    # Chỉ cần tokenizer: process không encode (vd: process cha của reindex) không phải load model
+    tokenizer, max_seq_length = get_tokenizer(EMBED_MODEL_NAME)
+    # Trừ 2 token đặc biệt (<s>, </s>) và phần header
+    limit = max_seq_length - 2 - count_tokens(tokenizer, header)
+    if CHUNK_MAX_TOKENS:
+        limit = min(limit, CHUNK_MAX_TOKENS)
+    limit = max(limit, CHUNK_MIN_TOKENS)
+    return chunk_by_tokens(tokenizer, content, limit, min(CHUNK_OVERLAP_TOKENS, limit // 2))
+
+def content_hash(text, record):
+    """
+    Hash nội dung của record: text dùng để embed + metadata được lưu + tên model
+    + backend/quantize (torch ↔ ONNX int8 cho vector khác nhau).
+    Hash không đổi → không cần embed lại.
+    """
+    fields = [EMBED_MODEL_NAME, text, record["course_title"], record["lesson_title"], record["author"],
+              record["category"], record["content"], record["url"]]
+    variant = embedding_variant()
+    if variant != "torch":
+        # torch (mặc định) giữ payload cũ → dữ liệu đã có không phải embed lại
+        fields.append(variant)
+    payload = json.dumps(fields, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def course_text(title, author, category, description):
+    return f"Khóa học: {title}. Tác giả: {author}. Danh mục: {category}. Nội dung: {description}"
+
+def lesson_header(lesson_title, course_title, author):
+    return f"Bài học: {lesson_title}. Thuộc khóa học: {course_title}. Tác giả: {author}. Nội dung: "
+
+def record_text(record):
+    """
+    Dựng lại text đã dùng để embed từ 1 record đã lưu (dùng khi reindex từ store).
+    """
+    if record["type"] == "course":
+        return course_text(record["course_title"], record["author"], record["category"], record["content"])
+    return lesson_header(record["lesson_title"], record["course_title"], record["author"]) + record["content"]
+
+def build_records(courses):
+    """
+    Tạo record (chưa có embedding) và text cần embed tương ứng.
+    """
     records = []
+    texts = []
     for course in courses:
         # Khóa học
-        course_text = f"Khóa học: {course['title']}. Tác giả: {course['author']}. Danh mục: {course['category']}. Nội dung: {course['description']}"
+        texts.append(course_text(course["title"], course["author"], course["category"], course["description"]))
         records.append({
-            "id": str(uuid.uuid4()),
-            "embedding": embed_text(course_text),
+            "id": record_id(course["course_id"]),
+            "embedding": None,
             "type": "course",
+            "chunk_index": 0,
             "course_id": course["course_id"],
             "course_title": course["title"],
             "lesson_id": "",
@@ -106,92 +258,407 @@ def prepare_records(courses):
             "url": course["url"]
         })
 
-        # Các bài học
+        # Các bài học: mỗi chunk (theo token) là 1 record riêng, liên kết qua lesson_id
         for lesson in course["lessons"]:
-            lesson_text = f"Bài học: {lesson['title']}. Thuộc khóa học: {course['title']}. Tác giả: {course['author']}. Nội dung: {lesson['content']}"
-            records.append({
-                "id": str(uuid.uuid4()),
-                "embedding": embed_text(lesson_text),
-                "type": "lesson",
-                "course_id": course["course_id"],
-                "course_title": course["title"],
-                "lesson_id": lesson["lesson_id"],
-                "lesson_title": lesson["title"],
-                "author": course["author"],
-                "category": course["category"],
-                "content": lesson["content"],
-                "url": course["url"]
-            })
+            header = lesson_header(lesson["title"], course["title"], course["author"])
+            for chunk_index, chunk in enumerate(chunk_lesson_content(header, lesson["content"])):
+                texts.append(header + chunk)
+                records.append({
+                    "id": record_id(course["course_id"], lesson["lesson_id"], chunk_index),
+                    "embedding": None,
+                    "type": "lesson",
+                    "chunk_index": chunk_index,
+                    "course_id": course["course_id"],
+                    "course_title": course["title"],
+                    "lesson_id": lesson["lesson_id"],
+                    "lesson_title": lesson["title"],
+                    "author": course["author"],
+                    "category": course["category"],
+                    "content": chunk,
+                    "url": course["url"]
+                })
+
+    for record, text in zip(records, texts):
+        record["content_hash"] = content_hash(text, record)
+    return records, texts
+
+def prepare_records(courses, batch_size=EMBED_BATCH_SIZE):
+    records, texts = build_records(courses)
+
+    # Embed toàn bộ text theo batch rồi gán lại vào từng record
+    for record, vector in zip(records, embed_texts(texts, batch_size=batch_size)):
+        record["embedding"] = vector
     return records
 
 
-# 6️⃣ Insert vào Milvus
-def insert_data(collection, records):
-    data = [
-        [r["id"] for r in records],
-        [r["embedding"] for r in records],
-        [r["type"] for r in records],
-        [r["course_id"] for r in records],
-        [r["course_title"] for r in records],
-        [r["lesson_id"] for r in records],
-        [r["lesson_title"] for r in records],
-        [r["author"] for r in records],
-        [r["category"] for r in records],
-        [r["content"] for r in records],
-        [r["url"] for r in records],
-    ]
-    collection.insert(data)
-    collection.flush()
-    print(f"✅ Đã insert {len(records)} records vào Milvus")
-
-
-# =====================
-# QUERY RAG — optimized
-# =====================
-def query_rag_v1(collection, query, filter_expr=None, limit=5):
-    """
-    Tìm kiếm ngữ nghĩa (semantic search) trên Milvus.
-    Trả về danh sách dict dễ dùng cho API.
-    """
-    q_emb = embed_text(query)
-
-    results = collection.search(
-        data=[q_emb],
-        anns_field="embedding",
-        param={"metric_type": "IP", "params": {"nprobe": 8}},
-        limit=limit,
-        expr=filter_expr,
-        output_fields=["type", "course_title", "lesson_title", "author", "url", "content"]
-    )
-
-    hits = []
-    print(f"\n🔍 Query: {query}\n")
-    for hit in results[0]:
-        item = {
-            "score": hit.score,
-            "type": hit.entity.get("type"),
-            "course_title": hit.entity.get("course_title"),
-            "lesson_title": hit.entity.get("lesson_title"),
-            "author": hit.entity.get("author"),
-            "url": hit.entity.get("url"),
-            "content": hit.entity.get("content"),
-        }
-        hits.append(item)
-
-        # Log ngắn gọn
-        print(f"[{item['type'].upper()}] {item['course_title']} → {item['lesson_title']}")
-        print(f"Tác giả: {item['author']} | URL: {item['url']}")
-        print(f"Nội dung: {item['content'][:100]}...\n")
-
-    print(f"✅ Tổng số kết quả: {len(hits)}\n")
+# Hybrid search: BM25 trong process (theo từng collection) + vector, gộp bằng RRF
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true", "yes")
+RRF_K = int(os.getenv("RRF_K", "60"))
+LEXICAL_FIELDS = ["id", "type", "course_title", "lesson_title", "author", "content"]
+_lexical_indexes = {}
+# Index đang dựng lại (theo collection): insert/xóa trong lúc dựng được ghi vào cả index này
+_lexical_building = {}
+_lexical_lock = threading.Lock()
+
+def get_lexical_index(collection):
+    return _lexical_indexes.setdefault(collection.name, BM25Index())
+
+def update_lexical_index(collection, records=(), deleted_ids=()):
+    if not HYBRID_SEARCH:
+        return
+    with _lexical_lock:
+        indexes = [get_lexical_index(collection)]
+        if collection.name in _lexical_building:
+            indexes.append(_lexical_building[collection.name])
+    for index in indexes:
+        if records:
+            index.add(records)
+        if deleted_ids:
+            index.remove(deleted_ids)
+
+def rebuild_lexical_index(collection, batch_size=1000):
+    """
+    Dựng lại inverted index từ dữ liệu đang có trong store (lúc startup / khi alias chuyển).
+    Dựng index mới rồi mới thay, search trong lúc dựng vẫn dùng index cũ;
+    insert/xóa trong lúc dựng được ghi vào cả 2 index nên không bị mất.
+    """
+    if not HYBRID_SEARCH:
+        return 0
+    index = BM25Index()
+    with _lexical_lock:
+        _lexical_building[collection.name] = index
+    try:
+        for batch in collection.iter_rows(output_fields=LEXICAL_FIELDS, batch_size=batch_size):
+            index.add(batch)
+        with _lexical_lock:
+            _lexical_indexes[collection.name] = index
+    finally:
+        with _lexical_lock:
+            _lexical_building.pop(collection.name, None)
+    logger.info(f"✅ Lexical index: {len(index)} records")
+    return len(index)
+
+def start_lexical_rebuild(collection):
+    """
+    Dựng lại index BM25 trên thread nền: service phục vụ (vector search) ngay,
+    hybrid search có kết quả BM25 khi dựng xong.
+    """
+    def run():
+        try:
+            rebuild_lexical_index(collection)
+        except Exception as e:
+            logger.warning(f"⚠️ Dựng lexical index thất bại: {e}")
+
+    thread = threading.Thread(target=run, name="lexical-build", daemon=True)
+    thread.start()
+    return thread
+
+def drop_lexical_index(collection):
+    # Collection không còn phục vụ (đã chuyển alias) → giải phóng index BM25
+    _lexical_indexes.pop(collection.name, None)
+
+# 6️⃣ Insert vào store (Milvus / memory)
+def _data_changed(collection, records=(), deleted_ids=()):
+    # Đồng bộ index BM25 + tăng version để cache /search, /ask không trả kết quả cũ
+    if not records and not deleted_ids:
+        return
+    update_lexical_index(collection, records, deleted_ids)
+    response_cache.bump_version()
+    # Câu trả lời semantic cache dựa trên record vừa đổi/xóa → bỏ
+    semantic_cache.invalidate([r["id"] for r in records] + list(deleted_ids))
+
+def insert_data(collection, records, flush=True):
+    collection.insert(records)
+    _data_changed(collection, records)
+    if flush:
+        collection.flush()
+    logger.info(f"✅ Đã insert {len(records)} records vào {collection.name}")
+
+def upsert_data(collection, records, flush=True):
+    # Giống insert_data nhưng ghi đè record cùng ID
+    collection.upsert(records)
+    _data_changed(collection, records)
+    if flush:
+        collection.flush()
+    logger.info(f"✅ Đã upsert {len(records)} records vào {collection.name}")
+
+def delete_records(collection, ids):
+    if ids:
+        collection.delete(ids)
+        _data_changed(collection, deleted_ids=ids)
+        logger.info(f"🗑️ Đã xóa {len(ids)} records khỏi {collection.name}")
+
+
+def fetch_existing_hashes(collection, course_ids, batch_size=1000):
+    """
+    Lấy {id: (content_hash, course_id)} của các record hiện có thuộc các course_id.
+    Collection cũ chưa có content_hash → hash = None (coi như đã thay đổi).
+    """
+    has_hash = "content_hash" in collection.field_names()
+    fields = ["id", "course_id"] + (["content_hash"] if has_hash else [])
+    existing = {}
+    for batch in collection.iter_rows(course_ids=course_ids, output_fields=fields, batch_size=batch_size):
+        for row in batch:
+            existing[row["id"]] = (row.get("content_hash") if has_hash else None, row.get("course_id"))
+    return existing
+
+
+def migrate_to_type_partitions(collection, batch_size=1000):
+    # Chỉ áp dụng cho Milvus; store memory không có partition _default
+    if not isinstance(collection, MilvusVectorStore):
+        logger.warning("⚠️ Store không phải Milvus, không cần migrate partition.")
+        return 0
+    return collection.migrate_to_type_partitions(batch_size=batch_size)
+
+
+def plan_course_sync(collection, courses):
+    """
+    So sánh khóa học gửi lên với dữ liệu đã lưu:
+    - records/texts: các record mới hoặc có nội dung thay đổi (cần embed + upsert)
+    - stale_ids: record cũ không còn trong khóa học (bài học bị xóa)
+    """
+    records, texts = build_records(courses)
+    existing = fetch_existing_hashes(collection, {c["course_id"] for c in courses})
+    return diff_course_sync(records, texts, existing)
+
+async def plan_course_sync_async(collection, courses):
+    """
+    Bản async của plan_course_sync: chunk + tokenize (CPU, có thể load model lần đầu)
+    chạy trên pool embedding, chỉ phần lấy hash từ Milvus chạy trên pool Milvus
+    → search không phải xếp hàng sau tokenize.
+    """
+    records, texts = await run_embedding(build_records, courses)
+    existing = await run_milvus(fetch_existing_hashes, collection, {c["course_id"] for c in courses})
+    return diff_course_sync(records, texts, existing)
+
+def diff_course_sync(records, texts, existing):
+    # existing: {id: (content_hash, course_id)} đã lưu của các khóa học
+    changed, changed_texts = [], []
+    for record, text in zip(records, texts):
+        if existing.get(record["id"], (None,))[0] != record["content_hash"]:
+            changed.append(record)
+            changed_texts.append(text)
+
+    new_ids = {r["id"] for r in records}
+    stale_ids = [i for i in existing if i not in new_ids]
+
+    per_course = {}
+    for record in records:
+        stats = per_course.setdefault(record["course_id"], {"chunks_count": 0, "upserted": 0})
+        stats["chunks_count"] += 1
+    for record in changed:
+        per_course[record["course_id"]]["upserted"] += 1
+
+    # Record cũ cần xóa theo từng khóa học (bulk chỉ xóa khi upsert của khóa đó thành công)
+    stale_by_course = {}
+    for rid in stale_ids:
+        stale_by_course.setdefault(existing[rid][1], []).append(rid)
+
+    return {
+        "records": changed,
+        "texts": changed_texts,
+        "unchanged": len(records) - len(changed),
+        "stale_ids": stale_ids,
+        "stale_by_course": stale_by_course,
+        "per_course": per_course,
+    }
+
+def embed_plan(plan, batch_size=EMBED_BATCH_SIZE):
+    # Chỉ embed các record đã thay đổi
+    for record, vector in zip(plan["records"], embed_texts(plan["texts"], batch_size=batch_size)):
+        record["embedding"] = vector
+    return plan
+
+def apply_course_sync(collection, plan, flush=True):
+    upsert_data(collection, plan["records"], flush=False)
+    delete_records(collection, plan["stale_ids"])
+    if flush:
+        collection.flush()
+    return {
+        "upserted": len(plan["records"]),
+        "unchanged": plan["unchanged"],
+        "deleted": len(plan["stale_ids"]),
+    }
+
+def sync_courses(collection, courses, flush=True):
+    """
+    Insert lại khóa học: chỉ embed + upsert record thay đổi, xóa bài học đã bị bỏ.
+    """
+    plan = plan_course_sync(collection, courses)
+    embed_plan(plan)
+    return apply_course_sync(collection, plan, flush=flush)
+
+
+# Field trả về khi search (collection cũ thiếu field nào thì bỏ field đó)
+SEARCH_OUTPUT_FIELDS = [
+    "type", "course_title", "lesson_id", "lesson_title", "chunk_index",
+    "author", "category", "url", "content"
+]
+
+
+def resolve_output_fields(fields=None):
+    """
+    Chuẩn hóa danh sách field client yêu cầu (None → SEARCH_OUTPUT_FIELDS).
+    Field không hỗ trợ → ValueError.
+    """
+    if fields is None:
+        return list(SEARCH_OUTPUT_FIELDS)
+    unknown = [f for f in fields if f not in SEARCH_OUTPUT_FIELDS]
+    if unknown:
+        raise ValueError(f"Field không hỗ trợ: {unknown}. Chọn trong: {SEARCH_OUTPUT_FIELDS}")
+    return [f for f in SEARCH_OUTPUT_FIELDS if f in fields]
+
+
+def search_ids(collection, q_emb, search_type="course", filter_expr=None, limit=5):
+    """
+    Pha 1: ANN search chỉ lấy (id, score), không kéo field nào về.
+    """
+    results = collection.search([q_emb], search_type, limit, filter_expr=filter_expr, output_fields=[])
+    return [(entity["id"], entity["score"]) for entity in results[0]]
+
+
+def fetch_hits(collection, scored_ids, output_fields=None):
+    """
+    Pha 2: query theo primary key, chỉ lấy các field cần cho các hit được dùng.
+    Giữ nguyên thứ tự + score của scored_ids; output_fields=[] → không query.
+    Id vừa bị xóa giữa 2 pha sẽ bị bỏ qua.
+    """
+    output_fields = SEARCH_OUTPUT_FIELDS if output_fields is None else output_fields
+    if not output_fields:
+        return [_to_hit({"id": doc_id}, score, output_fields) for doc_id, score in scored_ids]
+
+    rows = {}
+    if scored_ids:
+        rows = {row["id"]: row for row in collection.get([doc_id for doc_id, _ in scored_ids], output_fields)}
+    return [_to_hit(rows[doc_id], score, output_fields) for doc_id, score in scored_ids if doc_id in rows]
+
+
+def search_by_vector(collection, q_emb, search_type="course", filter_expr=None, limit=5, output_fields=None):
+    """
+    Phần search của query_rag: search 1 vector trong partition/mask của search_type,
+    rồi lấy field theo id (2 pha). Tách riêng để có thể chạy trên pool Milvus.
+    """
+    scored_ids = search_ids(collection, q_emb, search_type=search_type, filter_expr=filter_expr, limit=limit)
+    hits = fetch_hits(collection, scored_ids, output_fields)
+    _log_hits(hits)
     return hits
 
 
-def query_rag(collection, query, filter_expr=None, limit=5, input_search_type="course"):
+def _to_hit(entity, score, output_fields=None):
+    output_fields = SEARCH_OUTPUT_FIELDS if output_fields is None else output_fields
+    hit = {"id": entity["id"], "score": round(score, 4)}
+    for field in output_fields:
+        hit[field] = entity.get(field)
+    return hit
+
+
+def _log_hits(hits):
+    # Không format gì khi DEBUG tắt (production)
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    for item in hits:
+        logger.debug(f"[{(item.get('type') or '?').upper()}] {item.get('course_title')} → {item.get('lesson_title') or 'N/A'}")
+        logger.debug(f"Tác giả: {item.get('author')} | URL: {item.get('url')}")
+        if item.get("content"):
+            logger.debug(f"Nội dung: {item['content'][:120]}...")
+
+    logger.debug(f"✅ Tổng kết quả: {len(hits)}")
+
+
+def lexical_fast_path(collection, query, search_type, limit, output_fields=None):
+    """
+    Query trùng khớp hoàn toàn với title/author (sau chuẩn hóa tiếng Việt)
+    → trả kết quả luôn, không cần embedding + ANN. Score = 1.0.
+    """
+    ids = get_lexical_index(collection).exact_matches(query, search_type)
+    if not ids:
+        return []
+    hits = fetch_hits(collection, [(doc_id, 1.0) for doc_id in ids[:limit]], output_fields)
+    SEARCH_HITS.labels(search_type).observe(len(hits))
+    logger.debug(f"⚡ Lexical fast path: {len(hits)} kết quả khớp chính xác")
+    return hits
+
+
+def _rrf_ids(collection, query, vector_ids, search_type, limit):
+    """
+    RRF giữa (id, score) của vector search và BM25. Hit chỉ có từ BM25 có score None.
+    Trả về list (id, score, rrf_score).
+    """
+    lexical = get_lexical_index(collection).search(query, search_type, limit)
+    if not lexical:
+        return [(doc_id, score, None) for doc_id, score in vector_ids]
+
+    fused = reciprocal_rank_fusion([[doc_id for doc_id, _ in vector_ids], [doc_id for doc_id, _ in lexical]], k=RRF_K)[:limit]
+    scores = dict(vector_ids)
+    return [(doc_id, scores.get(doc_id), rrf_score) for doc_id, rrf_score in fused]
+
+
+def _fill_cosine_scores(collection, fused_lists, q_embs):
+    """
+    Tính score cosine cho hit chỉ có từ BM25 (score None), 1 lần get embedding cho mọi query,
+    để ngưỡng score phía sau (rag_service) vẫn áp dụng được. Id không còn tồn tại bị bỏ.
     """
-    Truy vấn semantic search trên Milvus.
+    missing = list(dict.fromkeys(doc_id for fused in fused_lists for doc_id, score, _ in fused if score is None))
+    embeddings = {}
+    if missing:
+        embeddings = {row["id"]: np.asarray(row["embedding"], dtype=np.float32)
+                      for row in collection.get(missing, ["embedding"])}
+
+    filled = []
+    for fused, q_emb in zip(fused_lists, q_embs):
+        q = np.asarray(q_emb, dtype=np.float32)
+        items = []
+        for doc_id, score, rrf_score in fused:
+            if score is None:
+                if doc_id not in embeddings:
+                    continue
+                score = float(np.dot(q, embeddings[doc_id]))
+            items.append((doc_id, score, rrf_score))
+        filled.append(items)
+    return filled
+
+
+def fuse_with_lexical(collection, query, q_emb, vector_ids, search_type, limit):
+    """
+    Gộp (id, score) của vector search với hit BM25 bằng reciprocal-rank fusion.
+    Hit chỉ có từ BM25 được tính lại score cosine (chỉ lấy embedding).
+    Trả về list (id, score, rrf_score).
+    """
+    fused = _rrf_ids(collection, query, vector_ids, search_type, limit)
+    return _fill_cosine_scores(collection, [fused], [q_emb])[0]
+
+
+def _search_and_fetch(collection, query, q_emb, search_type, filter_expr, limit, output_fields, min_score):
+    """
+    Pha 1 (ANN + BM25 chỉ trên id/score) → lọc min_score → pha 2 lấy field cho hit còn lại.
+    """
+    hybrid = HYBRID_SEARCH and not filter_expr
+    scored_ids = search_ids(collection, q_emb, search_type=search_type, filter_expr=filter_expr, limit=limit)
+    if hybrid:
+        fused = fuse_with_lexical(collection, query, q_emb, scored_ids, search_type, limit)
+    else:
+        fused = [(doc_id, score, None) for doc_id, score in scored_ids]
+    if min_score is not None:
+        fused = [item for item in fused if item[1] > min_score]
+
+    hits = fetch_hits(collection, [(doc_id, score) for doc_id, score, _ in fused], output_fields)
+    rrf_scores = {doc_id: rrf_score for doc_id, _, rrf_score in fused if rrf_score is not None}
+    for hit in hits:
+        if hit["id"] in rrf_scores:
+            hit["rrf_score"] = round(rrf_scores[hit["id"]], 5)
+    SEARCH_HITS.labels(search_type).observe(len(hits))
+    _log_hits(hits)
+    return hits
+
+
+def query_rag(collection, query, filter_expr=None, limit=5, input_search_type="course",
+              output_fields=None, min_score=None):
+    """
+    Truy vấn semantic search trên store (Milvus / memory).
     - Nếu query mang tính tổng quan -> tìm 'course'
     - Nếu query mang tính chi tiết về bài học -> tìm 'lesson'
+    - output_fields: field trả về cho mỗi hit (None → SEARCH_OUTPUT_FIELDS, [] → chỉ id + score)
+    - min_score: bỏ hit có score <= min_score trước khi lấy field
     """
 
     query_lower = query.lower()
@@ -204,49 +671,148 @@ def query_rag(collection, query, filter_expr=None, limit=5, input_search_type="c
     #     search_type = "course"
 
     search_type = input_search_type
+    hybrid = HYBRID_SEARCH and not filter_expr
 
-    q_emb = embed_text(query)
-
-    expr = f"type == '{search_type}'"
-    if filter_expr:
-        expr += f" and {filter_expr}"
-
-    results = collection.search(
-        data=[q_emb],
-        anns_field="embedding",
-        param={"metric_type": "IP", "params": {"nprobe": 8}},
-        limit=limit,
-        expr=expr,
-        output_fields=[
-            "type", "course_title", "lesson_title",
-            "author", "category", "url", "content"
-        ]
-    )
-
-    hits = []
-    print(f"\n🔍 Query: {query}  →  Tìm trong: {search_type.upper()}\n")
-
-    for hit in results[0]:
-        entity = hit.entity
-        item = {
-            "score": round(hit.score, 4),
-            "type": entity.get("type"),
-            "course_title": entity.get("course_title"),
-            "lesson_title": entity.get("lesson_title"),
-            "author": entity.get("author"),
-            "category": entity.get("category"),
-            "url": entity.get("url"),
-            "content": entity.get("content"),
-        }
-        hits.append(item)
-
-        label = item["lesson_title"] if item["type"] == "lesson" else item["course_title"]
-        print(f"[{item['type'].upper()}] {item['course_title']} → {item['lesson_title'] or 'N/A'}")
-        print(f"Tác giả: {item['author']} | URL: {item['url']}")
-        print(f"Nội dung: {item['content'][:120]}...\n")
-
-    print(f"✅ Tổng kết quả: {len(hits)}\n")
-    return hits
+    logger.debug(f"🔍 Query: {query}  →  Tìm trong: {search_type.upper()}")
+    if hybrid:
+        with stage_timer("lexical"):
+            hits = lexical_fast_path(collection, query, search_type, limit, output_fields)
+        if hits:
+            return hits
+
+    with stage_timer("embedding"):
+        q_emb = embed_query(query)
+
+    with stage_timer("search"):
+        return _search_and_fetch(collection, query, q_emb, search_type, filter_expr, limit, output_fields, min_score)
+
+
+async def query_rag_async(collection, query, filter_expr=None, limit=5, input_search_type="course",
+                          output_fields=None, min_score=None):
+    """
+    Bản async của query_rag: embedding chạy trên pool embedding,
+    search chạy trên pool Milvus.
+    """
+    hybrid = HYBRID_SEARCH and not filter_expr
+
+    logger.debug(f"🔍 Query: {query}  →  Tìm trong: {input_search_type.upper()}")
+    if hybrid:
+        with stage_timer("lexical"):
+            hits = await run_milvus(lexical_fast_path, collection, query, input_search_type, limit, output_fields)
+        if hits:
+            return hits
+
+    with stage_timer("embedding"):
+        q_emb = await embed_query_async(query)
+
+    with stage_timer("search"):
+        return await run_milvus(
+            _search_and_fetch, collection, query, q_emb,
+            input_search_type, filter_expr, limit, output_fields, min_score
+        )
+
+
+# Số query tối đa trong 1 request batch search
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "64"))
+
+
+def _batch_fast_path(collection, requests):
+    """
+    Fast path khớp chính xác title/author cho từng query của batch (chỉ id, chưa lấy field).
+    Trả về {vị trí query: [(id, 1.0, None), ...]}.
+    """
+    if not HYBRID_SEARCH:
+        return {}
+    index = get_lexical_index(collection)
+    matched = {}
+    for i, r in enumerate(requests):
+        ids = index.exact_matches(r["query"], r["type"])
+        if ids:
+            matched[i] = [(doc_id, 1.0, None) for doc_id in ids[:r["top_k"]]]
+    return matched
+
+
+def _batch_search_and_fetch(collection, requests, q_embs, matched, output_fields=None, min_score=None):
+    """
+    Search batch trên store:
+    - 1 lần search nhiều vector cho mỗi type (limit = top_k lớn nhất), rồi cắt theo top_k từng query
+    - RRF với BM25 + score cosine cho hit chỉ từ BM25 (1 lần get embedding)
+    - 1 lần get field cho toàn bộ hit của batch
+    q_embs: {vị trí query: embedding} cho các query không qua fast path.
+    """
+    by_type = {}
+    for i in q_embs:
+        by_type.setdefault(requests[i]["type"], []).append(i)
+
+    fused = dict(matched)
+    for search_type, idxs in by_type.items():
+        limit = max(requests[i]["top_k"] for i in idxs)
+        results = collection.search([q_embs[i] for i in idxs], search_type, limit, output_fields=[])
+        pending = []
+        for i, entities in zip(idxs, results):
+            vector_ids = [(e["id"], e["score"]) for e in entities[:requests[i]["top_k"]]]
+            if HYBRID_SEARCH:
+                pending.append((i, _rrf_ids(collection, requests[i]["query"], vector_ids, search_type, requests[i]["top_k"])))
+            else:
+                fused[i] = [(doc_id, score, None) for doc_id, score in vector_ids]
+        if pending:
+            filled = _fill_cosine_scores(collection, [f for _, f in pending], [q_embs[i] for i, _ in pending])
+            for (i, _), items in zip(pending, filled):
+                fused[i] = items
+
+    if min_score is not None:
+        fused = {i: [item for item in items if item[1] > min_score] for i, items in fused.items()}
+
+    # Pha 2: lấy field 1 lần cho mọi id của batch, rồi chia lại theo query
+    all_ids = list(dict.fromkeys(doc_id for items in fused.values() for doc_id, _, _ in items))
+    rows = {h["id"]: h for h in fetch_hits(collection, [(doc_id, 0.0) for doc_id in all_ids], output_fields)}
+
+    batch_hits = []
+    for i in range(len(requests)):
+        hits = []
+        for doc_id, score, rrf_score in fused.get(i, []):
+            if doc_id not in rows:
+                continue
+            hit = {**rows[doc_id], "score": round(score, 4)}
+            if rrf_score is not None:
+                hit["rrf_score"] = round(rrf_score, 5)
+            hits.append(hit)
+        batch_hits.append(hits)
+    for i, hits in enumerate(batch_hits):
+        SEARCH_HITS.labels(requests[i]["type"]).observe(len(hits))
+    logger.debug(f"🔍 Batch search: {len(requests)} query | {len(matched)} fast path | {len(by_type)} lần search")
+    return batch_hits
+
+
+def query_rag_batch(collection, requests, output_fields=None, min_score=None):
+    """
+    Batch search: requests là list dict {"query", "top_k", "type"}.
+    Encode mọi query trong 1 lần forward, search nhiều vector theo từng type.
+    Trả về list hit theo đúng thứ tự requests.
+    """
+    with stage_timer("lexical"):
+        matched = _batch_fast_path(collection, requests)
+    pending = [i for i in range(len(requests)) if i not in matched]
+    with stage_timer("embedding"):
+        vectors = embed_queries([requests[i]["query"] for i in pending])
+    with stage_timer("search"):
+        return _batch_search_and_fetch(collection, requests, dict(zip(pending, vectors)), matched, output_fields, min_score)
+
+
+async def query_rag_batch_async(collection, requests, output_fields=None, min_score=None):
+    """
+    Bản async của query_rag_batch: encode trên pool embedding, search trên pool Milvus.
+    """
+    with stage_timer("lexical"):
+        matched = _batch_fast_path(collection, requests)
+    pending = [i for i in range(len(requests)) if i not in matched]
+    with stage_timer("embedding"):
+        vectors = await run_embedding(embed_queries, [requests[i]["query"] for i in pending]) if pending else []
+    with stage_timer("search"):
+        return await run_milvus(
+            _batch_search_and_fetch, collection, requests,
+            dict(zip(pending, vectors)), matched, output_fields, min_score
+        )
 
 
 ## V3
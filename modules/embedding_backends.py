@@ -0,0 +1,74 @@
+# embedding_backends.py
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# sentence_transformers (kéo theo torch) chỉ import trong hàm load: module này còn được import
+# bởi content_hash / reindex_pool ở process không load model (vd: process cha của reindex)
+
+# Backend chạy model embedding:
+# - "torch": PyTorch (mặc định)
+# - "onnx": ONNX Runtime (cần optimum[onnxruntime]), có thể quantize int8 động
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()
+EMBED_ONNX_QUANTIZE = os.getenv("EMBED_ONNX_QUANTIZE", "false").lower() in ("1", "true", "yes")
+# Cấu hình quantize theo CPU: arm64 | avx2 | avx512 | avx512_vnni
+EMBED_ONNX_QUANT_CONFIG = os.getenv("EMBED_ONNX_QUANT_CONFIG", "avx512_vnni")
+# Thư mục lưu model đã export sang ONNX (export 1 lần, các worker dùng lại)
+EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR", "./onnx_models")
+
+
+def _onnx_model_dir(model_name: str) -> str:
+    return os.path.join(EMBED_ONNX_DIR, model_name.replace("/", "__"))
+
+
+def _load_onnx(model_name: str, quantize: bool):
+    from sentence_transformers import SentenceTransformer
+
+    model_dir = _onnx_model_dir(model_name)
+
+    # Export graph ONNX lần đầu (fp32), lưu lại để lần sau load trực tiếp
+    if not os.path.exists(os.path.join(model_dir, "onnx", "model.onnx")):
+        print(f"⏳ Export {model_name} sang ONNX → {model_dir}")
+        SentenceTransformer(model_name, backend="onnx").save(model_dir)
+
+    if not quantize:
+        return SentenceTransformer(model_dir, backend="onnx")
+
+    # Quantize int8 động (dynamic quantization), lưu cạnh model fp32
+    file_name = f"onnx/model_qint8_{EMBED_ONNX_QUANT_CONFIG}.onnx"
+    if not os.path.exists(os.path.join(model_dir, file_name)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        print(f"⏳ Quantize int8 ({EMBED_ONNX_QUANT_CONFIG}) cho {model_name}")
+        fp32_model = SentenceTransformer(model_dir, backend="onnx")
+        export_dynamic_quantized_onnx_model(fp32_model, EMBED_ONNX_QUANT_CONFIG, model_dir)
+
+    return SentenceTransformer(model_dir, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def embedding_variant() -> str:
+    """
+    Định danh backend + quantize đang dùng (vd: "torch", "onnx", "onnx-qint8-avx512_vnni"):
+    vector của các biến thể khác nhau nên đưa vào content_hash để đổi backend thì embed lại.
+    """
+    if EMBED_BACKEND == "onnx" and EMBED_ONNX_QUANTIZE:
+        return f"onnx-qint8-{EMBED_ONNX_QUANT_CONFIG}"
+    return EMBED_BACKEND
+
+
+def load_sentence_model(model_name: str, backend: str = None, quantize: bool = None):
+    """
+    Load model embedding theo backend cấu hình.
+    Cả 2 backend đều trả về SentenceTransformer nên encode() dùng y hệt nhau.
+    """
+    backend = (backend or EMBED_BACKEND).lower()
+    quantize = EMBED_ONNX_QUANTIZE if quantize is None else quantize
+
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        return _load_onnx(model_name, quantize)
+    raise ValueError(f"EMBED_BACKEND không hợp lệ: {backend} (chỉ hỗ trợ 'torch' hoặc 'onnx')")
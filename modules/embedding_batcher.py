@@ -0,0 +1,114 @@
+# embedding_batcher.py
+import queue
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """
+    Gom các query embedding đến gần nhau thành 1 batch (dynamic micro-batching).
+    - Chờ tối đa max_wait_ms kể từ query đầu tiên, hoặc đến khi đủ max_batch_size.
+    - Chạy 1 lần encode cho cả batch: trên executor được truyền vào (vd: embed_executor,
+      để CPU encode nằm trong giới hạn EMBED_WORKERS), không có thì trên thread gom batch.
+    - Trả kết quả về từng request qua Future.
+    """
+
+    def __init__(self, encode_batch, max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 executor=None, max_in_flight: int = 1):
+        """
+        :param encode_batch: hàm nhận list[str], trả về list vector cùng thứ tự
+        :param executor: executor chạy encode (None → chạy trên thread gom batch)
+        :param max_in_flight: số batch encode cùng lúc trên executor; query đến trong lúc
+            đang encode được gom vào batch sau thay vì tách thành nhiều batch nhỏ
+        """
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.executor = executor
+        self._in_flight = threading.Semaphore(max_in_flight)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """
+        Đưa 1 text vào hàng đợi, trả về Future chứa vector.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text: str):
+        """
+        Bản blocking của submit(): chờ đến khi batch chứa text được encode xong.
+        Không gọi từ thread của chính executor encode (có thể chờ nhau khi pool đã kín).
+        """
+        return self.submit(text).result()
+
+    def _collect_batch(self):
+        # Chờ item đầu tiên, sau đó gom thêm trong cửa sổ max_wait
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Vòng lặp không được thoát: 1 batch lỗi chỉ làm lỗi các request trong batch đó
+        while True:
+            try:
+                if self.executor is None:
+                    self._process(self._collect_batch())
+                else:
+                    self._dispatch()
+            except Exception:
+                logger.exception("⚠️ Embedding batcher: lỗi khi xử lý batch")
+
+    def _dispatch(self):
+        # Chờ slot trước khi gom: trong lúc batch trước encode, hàng đợi tích thêm query
+        self._in_flight.acquire()
+        try:
+            task = self.executor.submit(self._process, self._collect_batch())
+        except BaseException:
+            self._in_flight.release()
+            raise
+        task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task):
+        self._in_flight.release()
+        if task.exception() is not None:
+            logger.error("⚠️ Embedding batcher: lỗi khi xử lý batch", exc_info=task.exception())
+
+    def _process(self, batch):
+        # Bỏ request đã bị hủy (client ngắt kết nối, timeout...) trước khi encode;
+        # future đã chuyển sang running thì không hủy được nữa → set_result an toàn
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            vectors = self.encode_batch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
@@ -0,0 +1,94 @@
+# embedding_cache.py
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# Ước lượng bộ nhớ mỗi entry ngoài vector: key (tuple + chuỗi query), header ndarray, node OrderedDict
+ENTRY_OVERHEAD_BYTES = 400
+
+
+def normalize_query(text: str) -> str:
+    """
+    Chuẩn hóa query để làm key cache: lowercase, bỏ khoảng trắng thừa.
+    """
+    return " ".join(text.lower().split())
+
+
+def size_for_budget(budget_mb: float, dim: int) -> int:
+    """
+    Số entry vừa với budget bộ nhớ (MB), vector lưu dạng float32.
+    """
+    return max(0, int(budget_mb * 1024 * 1024 // (dim * 4 + ENTRY_OVERHEAD_BYTES)))
+
+
+class EmbeddingLRUCache:
+    """
+    Cache LRU trong process cho embedding của query.
+    - Key: (tên model, query đã chuẩn hóa)
+    - Giới hạn theo số phần tử, phần tử ít dùng nhất bị loại trước.
+    - Vector lưu dạng np.float32 (~3 KB với dim 768, list Python tốn gấp ~8 lần);
+      chỉ đổi sang list ở chỗ cần (client Milvus).
+    - Thread-safe vì FastAPI chạy handler sync trên threadpool.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, model_name: str, text: str):
+        return (model_name, normalize_query(text))
+
+    def get(self, model_name: str, text: str):
+        key = self._key(model_name, text)
+        with self._lock:
+            vector = self._data.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, model_name: str, text: str, vector):
+        if self.max_size <= 0:
+            return
+        key = self._key(model_name, text)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._data[key] = vector
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, model_name: str, text: str, compute):
+        """
+        Trả về vector từ cache, nếu miss thì gọi compute(query đã chuẩn hóa) và lưu lại.
+        Embed đúng text dùng làm key → mọi biến thể hoa/thường, khoảng trắng ra cùng 1 vector,
+        không phụ thuộc biến thể nào tới trước.
+        """
+        vector = self.get(model_name, text)
+        if vector is None:
+            vector = compute(normalize_query(text))
+            self.put(model_name, text, vector)
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
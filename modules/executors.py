@@ -0,0 +1,32 @@
+# executors.py
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pool riêng cho việc tính embedding (CPU) và cho các call Milvus (blocking I/O),
+# để I/O chậm không chiếm hết thread của embedding và ngược lại.
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))
+MILVUS_WORKERS = int(os.getenv("MILVUS_WORKERS", "8"))
+
+embed_executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
+milvus_executor = ThreadPoolExecutor(max_workers=MILVUS_WORKERS, thread_name_prefix="milvus")
+
+
+async def run_embedding(fn, *args, **kwargs):
+    """
+    Chạy hàm CPU-bound (encode, prepare_records...) trên embed_executor.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(embed_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def run_milvus(fn, *args, **kwargs):
+    """
+    Chạy call Milvus blocking (search, insert, flush...) trên milvus_executor.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(milvus_executor, functools.partial(fn, *args, **kwargs))
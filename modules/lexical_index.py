@@ -0,0 +1,178 @@
+# lexical_index.py
+import os
+import re
+import math
+import heapq
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+_TOKEN = re.compile(r"\w+")
+
+# Trọng số theo field: lặp token của title/author để ưu tiên khớp tiêu đề
+FIELD_WEIGHTS = {"course_title": 3, "lesson_title": 3, "author": 2, "content": 1}
+# Field dùng cho fast path khớp chính xác
+EXACT_FIELDS = ["course_title", "lesson_title", "author"]
+
+
+# Dấu thanh/dấu mũ sau khi tách NFD (khối Combining Diacritical Marks)
+_MARKS = re.compile(r"[\u0300-\u036f]")
+# Term có mặt trong hơn tỉ lệ này số record (của type) bị bỏ khi query còn term khác hiếm hơn:
+# idf gần 0 nhưng posting dài nhất ("khóa", "học", "bài"...) → tốn thời gian mà không đổi thứ hạng
+BM25_MAX_DF_RATIO = float(os.getenv("BM25_MAX_DF_RATIO", "0.25"))
+
+
+def normalize_vietnamese(text: str) -> str:
+    """
+    Chuẩn hóa tiếng Việt để so khớp: lowercase, bỏ dấu, đ → d, gộp khoảng trắng.
+    "Nguyễn Minh" → "nguyen minh"
+    """
+    text = (text or "").lower().replace("đ", "d")
+    text = _MARKS.sub("", unicodedata.normalize("NFD", text))
+    return " ".join(_TOKEN.findall(text))
+
+
+def tokenize(text: str):
+    return normalize_vietnamese(text).split()
+
+
+def reciprocal_rank_fusion(rankings, k: int = 60):
+    """
+    Gộp nhiều danh sách id đã xếp hạng bằng RRF: score = Σ 1 / (k + rank).
+    Trả về list (id, score) giảm dần.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """
+    Inverted index BM25 trong process trên course_title, lesson_title, author, content.
+    Cập nhật theo record (add/remove) để đồng bộ với insert_data.
+    Posting và thống kê (số record, độ dài) tách theo type: query course không quét posting lesson.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(lambda: defaultdict(dict))   # type → term → {doc_id: tf}
+        self._doc_terms = {}                 # doc_id → {term: tf}
+        self._doc_len = {}
+        self._doc_type = {}
+        self._type_docs = defaultdict(int)   # type → số record
+        self._type_len = defaultdict(int)    # type → tổng độ dài
+        self._exact = defaultdict(set)       # (type, chuỗi đã chuẩn hóa) → {doc_id}
+        self._doc_exact = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def _remove_locked(self, doc_id):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        doc_type = self._doc_type.pop(doc_id, None)
+        type_postings = self._postings[doc_type]
+        for term in terms:
+            postings = type_postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del type_postings[term]
+        length = self._doc_len.pop(doc_id)
+        self._type_docs[doc_type] -= 1
+        self._type_len[doc_type] -= length
+        for key in self._doc_exact.pop(doc_id, []):
+            self._exact[key].discard(doc_id)
+            if not self._exact[key]:
+                del self._exact[key]
+
+    def add(self, records):
+        """
+        Thêm/cập nhật record (dict có id, type và các field text).
+        """
+        # Tokenize ngoài lock (phần tốn CPU), chỉ cập nhật cấu trúc trong lock
+        prepared = []
+        for r in records:
+            terms = Counter()
+            keys = set()
+            for field, weight in FIELD_WEIGHTS.items():
+                normalized = normalize_vietnamese(r.get(field))
+                if field in EXACT_FIELDS and normalized:
+                    keys.add((r.get("type"), normalized))
+                counts = Counter(normalized.split())
+                if weight != 1:
+                    counts = Counter({token: count * weight for token, count in counts.items()})
+                terms.update(counts)
+            prepared.append((r["id"], r.get("type"), dict(terms), keys))
+
+        with self._lock:
+            for doc_id, doc_type, terms, keys in prepared:
+                self._remove_locked(doc_id)
+                self._doc_terms[doc_id] = terms
+                type_postings = self._postings[doc_type]
+                for term, tf in terms.items():
+                    type_postings[term][doc_id] = tf
+                length = sum(terms.values())
+                self._doc_len[doc_id] = length
+                self._doc_type[doc_id] = doc_type
+                self._type_docs[doc_type] += 1
+                self._type_len[doc_type] += length
+                for key in keys:
+                    self._exact[key].add(doc_id)
+                self._doc_exact[doc_id] = keys
+
+    def remove(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                self._remove_locked(doc_id)
+
+    def clear(self):
+        with self._lock:
+            self.__init__(self.k1, self.b)
+
+    def search(self, query: str, search_type: str = None, limit: int = 10):
+        """
+        Trả về list (doc_id, score BM25) của search_type, giảm dần.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            types = [search_type] if search_type else list(self._type_docs)
+            scores = {}
+            for doc_type in types:
+                self._score_type(doc_type, terms, scores)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def _score_type(self, doc_type, terms, scores):
+        n_docs = self._type_docs.get(doc_type, 0)
+        if not n_docs:
+            return
+        type_postings = self._postings[doc_type]
+        postings = [(term, type_postings[term]) for term in terms if term in type_postings]
+        if not postings:
+            return
+        # Bỏ term quá phổ biến nếu còn term khác; toàn term phổ biến thì giữ term hiếm nhất
+        max_df = BM25_MAX_DF_RATIO * n_docs
+        selective = [(t, p) for t, p in postings if len(p) <= max_df]
+        postings = selective or [min(postings, key=lambda item: len(item[1]))]
+
+        k1, doc_len = self.k1, self._doc_len
+        c0 = k1 * (1 - self.b)
+        c1 = k1 * self.b * n_docs / self._type_len[doc_type]
+        for _, term_postings in postings:
+            df = len(term_postings)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5)) * (k1 + 1)
+            for doc_id, tf in term_postings.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf / (tf + c0 + c1 * doc_len[doc_id])
+
+    def exact_matches(self, query: str, search_type: str):
+        """
+        Id các record có title/author trùng khớp hoàn toàn với query (sau chuẩn hóa).
+        """
+        with self._lock:
+            return list(self._exact.get((search_type, normalize_vietnamese(query)), ()))
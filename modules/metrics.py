@@ -0,0 +1,111 @@
+# metrics.py
+# Metrics Prometheus cho hot path: thời gian từng stage, request/response, cache.
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Bucket (giây) đủ nhỏ cho lookup cache/search, đủ lớn cho gọi LLM
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+STAGE_LATENCY = Histogram(
+    "rag_stage_duration_seconds",
+    "Thời gian từng stage của pipeline RAG",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_LATENCY = Histogram(
+    "rag_http_request_duration_seconds",
+    "Thời gian xử lý HTTP request",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS = Counter(
+    "rag_http_requests_total",
+    "Số HTTP request theo route + status code",
+    ["method", "route", "status"],
+)
+REQUEST_SIZE = Histogram(
+    "rag_http_request_size_bytes",
+    "Kích thước body request (Content-Length)",
+    ["route"],
+    buckets=SIZE_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    "rag_http_response_size_bytes",
+    "Kích thước body response (bỏ qua response streaming)",
+    ["route"],
+    buckets=SIZE_BUCKETS,
+)
+SEARCH_HITS = Histogram(
+    "rag_search_hits",
+    "Số hit trả về mỗi lần search",
+    ["search_type"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50),
+)
+LLM_CALLS = Counter(
+    "rag_llm_calls_total",
+    "Số lần gọi LLM theo mục đích",
+    ["purpose"],
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Đo thời gian 1 stage (dùng được quanh cả await):
+        with stage_timer("embedding"):
+            q_emb = await embed_query_async(query)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - started)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float, request_size=None, response_size=None):
+    REQUEST_LATENCY.labels(method, route).observe(seconds)
+    REQUESTS.labels(method, route, str(status)).inc()
+    if request_size is not None:
+        REQUEST_SIZE.labels(route).observe(request_size)
+    if response_size is not None:
+        RESPONSE_SIZE.labels(route).observe(response_size)
+
+
+class CacheStatsCollector:
+    """
+    Xuất stats() của các cache (query embedding, response, semantic answer)
+    lúc Prometheus scrape, không phải cập nhật metric trên hot path.
+    """
+
+    def __init__(self, caches: dict):
+        self.caches = caches   # tên cache → hàm stats() trả về dict
+
+    def collect(self):
+        hits = CounterMetricFamily("rag_cache_hits", "Số lần cache hit", labels=["cache"])
+        misses = CounterMetricFamily("rag_cache_misses", "Số lần cache miss", labels=["cache"])
+        evictions = CounterMetricFamily("rag_cache_evictions", "Số entry bị đẩy ra do đầy", labels=["cache"])
+        hit_rate = GaugeMetricFamily("rag_cache_hit_ratio", "Tỉ lệ hit từ lúc khởi động", labels=["cache"])
+        size = GaugeMetricFamily("rag_cache_entries", "Số entry hiện có", labels=["cache"])
+        for name, stats_fn in self.caches.items():
+            stats = stats_fn()
+            hits.add_metric([name], stats.get("hits", 0))
+            misses.add_metric([name], stats.get("misses", 0))
+            evictions.add_metric([name], stats.get("evictions", 0))
+            hit_rate.add_metric([name], stats.get("hit_rate", 0.0))
+            size.add_metric([name], stats.get("size", 0))
+        return [hits, misses, evictions, hit_rate, size]
+
+
+_registered_collectors = []
+
+
+def register_cache_stats(caches: dict):
+    # Gọi 1 lần khi khởi động app
+    if _registered_collectors:
+        return
+    collector = CacheStatsCollector(caches)
+    REGISTRY.register(collector)
+    _registered_collectors.append(collector)
@@ -0,0 +1,25 @@
+# milvus_connection.py
+import os
+import threading
+from dotenv import load_dotenv
+from pymilvus import connections
+
+load_dotenv()
+
+# MILVUS_HOST/MILVUS_PORT là chuẩn; DB_HOST giữ lại cho các script cũ
+MILVUS_HOST = os.getenv("MILVUS_HOST") or os.getenv("DB_HOST") or "localhost"
+MILVUS_PORT = os.getenv("MILVUS_PORT", "19530")
+
+_lock = threading.Lock()
+
+
+def ensure_connection(alias: str = "default"):
+    """
+    Kết nối Milvus lazy: chỉ connect ở lần gọi đầu tiên, không kết nối lúc import.
+    """
+    if connections.has_connection(alias):
+        return
+    with _lock:
+        if not connections.has_connection(alias):
+            connections.connect(alias, host=MILVUS_HOST, port=MILVUS_PORT)
+            print(f"✅ Connected to Milvus {MILVUS_HOST}:{MILVUS_PORT}")
@@ -0,0 +1,48 @@
+# model_registry.py
+import threading
+from modules.embedding_backends import load_sentence_model
+
+# Model embedding dùng chung trong process, chỉ load ở lần dùng đầu tiên
+_models = {}
+# Tokenizer riêng (không load model) cho process chỉ cần chunk text, vd: process cha của reindex
+_tokenizers = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+def get_model(model_name: str):
+    """
+    Lấy model theo tên, load lazy (thread-safe, mỗi model chỉ load 1 lần).
+    """
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        lock = _locks.setdefault(model_name, threading.Lock())
+    with lock:
+        if model_name not in _models:
+            print(f"⏳ Load model {model_name}")
+            _models[model_name] = load_sentence_model(model_name)
+        return _models[model_name]
+
+
+def get_tokenizer(model_name: str):
+    """
+    (tokenizer, max_seq_length) để chunk theo token.
+    Chỉ load tokenizer (vài MB, không kéo theo torch/ONNX session và thread pool của model),
+    mọi process (service, process cha của reindex) dùng cùng 1 cách → chunk/ID/hash giống nhau.
+    """
+    with _registry_lock:
+        if model_name not in _tokenizers:
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            # model_max_length của một số tokenizer là giá trị "vô hạn" → dùng 512 như e5
+            max_len = tokenizer.model_max_length if tokenizer.model_max_length <= 8192 else 512
+            _tokenizers[model_name] = (tokenizer, max_len)
+        return _tokenizers[model_name]
+
+
+def loaded_models():
+    return list(_models)
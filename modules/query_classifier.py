@@ -0,0 +1,84 @@
+# query_classifier.py
+import threading
+import numpy as np
+
+# =====================================
+# 🧩 Tập câu hỏi mẫu đã gán nhãn
+# =====================================
+course_examples = [
+    "Khóa học này nói về gì?",
+    "Ai là giảng viên của khóa học?",
+    "Tôi nên học khóa nào về Python?",
+    "Khóa học nào giúp tôi nâng cao kỹ năng lập trình?",
+    "Có khóa học SEO nào không?",
+    "Khóa học Python cơ bản giá bao nhiêu?",
+    "Tìm khóa học về marketing",
+    "Khóa học của tác giả Nguyễn Minh",
+    "Gợi ý khóa học cho người mới bắt đầu",
+    "Khóa học nào phù hợp để học thiết kế web?",
+]
+
+lesson_examples = [
+    "Bài học đầu tiên dạy cái gì?",
+    "Trong chương 2 có hướng dẫn thực hành không?",
+    "Nội dung của bài học này là gì?",
+    "Bài 3 nói về cách cài đặt ra sao?",
+    "Bài học tối ưu onpage thuộc khóa nào?",
+    "Cách nghiên cứu từ khóa như thế nào?",
+    "Hướng dẫn khai báo biến trong Python",
+    "Ví dụ về xây dựng backlink",
+    "Phần nào nói về tối ưu thẻ meta?",
+    "Bài học nào giải thích kiểu dữ liệu?",
+]
+
+
+class QueryTypeClassifier:
+    """
+    Phân loại câu hỏi 'course' / 'lesson' bằng cosine similarity
+    giữa embedding query và centroid của các câu hỏi mẫu.
+    Centroid được tính lazy ở lần gọi đầu tiên.
+    """
+
+    def __init__(self, embed_texts, examples=None):
+        """
+        :param embed_texts: hàm nhận list[str], trả về list vector
+        :param examples: dict {label: [câu mẫu]}, mặc định course/lesson ở trên
+        """
+        self.embed_texts = embed_texts
+        self.examples = examples or {"course": course_examples, "lesson": lesson_examples}
+        self._labels = None
+        self._centroids = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _ensure_centroids(self):
+        if self._centroids is not None:
+            return
+        with self._lock:
+            if self._centroids is not None:
+                return
+            labels = list(self.examples)
+            centroids = []
+            for label in labels:
+                vectors = self._normalize(np.asarray(self.embed_texts(self.examples[label]), dtype=np.float32))
+                centroids.append(vectors.mean(axis=0))
+            self._centroids = self._normalize(np.stack(centroids))
+            self._labels = labels
+
+    def classify(self, q_emb):
+        """
+        Trả về (label, margin, scores):
+        - label: nhãn có similarity cao nhất
+        - margin: chênh lệch similarity giữa nhãn top-1 và top-2
+        """
+        self._ensure_centroids()
+        q = self._normalize(np.asarray(q_emb, dtype=np.float32))
+        sims = self._centroids @ q
+        order = np.argsort(-sims)
+        margin = float(sims[order[0]] - sims[order[1]]) if len(order) > 1 else 1.0
+        scores = {label: round(float(sim), 4) for label, sim in zip(self._labels, sims)}
+        return self._labels[order[0]], margin, scores
@@ -0,0 +1,298 @@
+# reindex_pool.py
+# Embed lại toàn bộ catalogue bằng pool process (mỗi process 1 model, số thread cố định),
+# vector được ghi thẳng vào shared memory rồi insert theo chunk.
+#
+# Module này được import trong process worker (spawn) trước khi load torch,
+# nên không import pipeline/model ở top-level.
+import os
+import json
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Mặc định: số worker + thread mỗi worker chia đều số core
+REINDEX_WORKERS = int(os.getenv("REINDEX_WORKERS", "0"))          # 0 = tự chọn
+REINDEX_THREADS = int(os.getenv("REINDEX_THREADS", "0"))          # 0 = core / worker
+REINDEX_CHUNK = int(os.getenv("REINDEX_CHUNK", "4096"))           # record mỗi lần insert
+REINDEX_BATCH = int(os.getenv("REINDEX_BATCH", "64"))             # text mỗi task gửi cho worker
+
+_THREAD_ENV = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+# Trạng thái trong từng process worker
+_worker = {"model": None, "buffers": {}}
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_workers(workers=None, threads=None):
+    """
+    Chia core cho worker: mặc định mỗi worker 4 thread (torch ít hiệu quả khi 1 process dùng quá nhiều core).
+    """
+    cores = len(available_cores())
+    threads = threads or REINDEX_THREADS or min(4, cores)
+    workers = workers or REINDEX_WORKERS or max(1, cores // threads)
+    return workers, threads
+
+
+def _init_worker(model_name, threads, pin_cpus, counter):
+    """
+    Khởi tạo worker: cố định số thread (trước khi import torch), pin vào nhóm core riêng, load model.
+    """
+    for name in _THREAD_ENV:
+        os.environ[name] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    if pin_cpus and hasattr(os, "sched_setaffinity"):
+        cores = available_cores()
+        start = (index * threads) % len(cores)
+        os.sched_setaffinity(0, [cores[(start + i) % len(cores)] for i in range(threads)])
+
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    from modules.model_registry import get_model
+
+    _worker["model"] = get_model(model_name)
+
+
+def _attach(name):
+    shm = _worker["buffers"].get(name)
+    if shm is None:
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13: bỏ đăng ký với resource_tracker, process cha mới là nơi unlink
+            from multiprocessing import resource_tracker
+
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, "shared_memory")
+        _worker["buffers"][name] = shm
+    return shm
+
+
+def _encode_into(shm_name, shape, offset, texts, batch_size):
+    """
+    Chạy trong worker: encode texts rồi ghi thẳng vào buffer shared memory tại offset.
+    """
+    shm = _attach(shm_name)
+    out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    out[offset:offset + len(texts)] = _worker["model"].encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    return len(texts)
+
+
+class SharedVectorBuffer:
+    """
+    Ma trận float32 (rows, dim) nằm trong shared memory: worker ghi, process cha đọc không cần copy.
+    """
+
+    def __init__(self, rows, dim):
+        self.shape = (rows, dim)
+        self.shm = shared_memory.SharedMemory(create=True, size=rows * dim * 4)
+        self.array = np.ndarray(self.shape, dtype=np.float32, buffer=self.shm.buf)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Còn view trỏ vào buffer (vd: lỗi giữa chừng), vẫn unlink để không rò shared memory
+            pass
+        self.shm.unlink()
+
+
+class EmbedPool:
+    """
+    Pool process embed (mỗi worker 1 model, số thread cố định, pin core).
+    Dùng lại được cho nhiều lần reindex (vd: build + các lượt catch-up) để model chỉ load 1 lần.
+    """
+
+    def __init__(self, workers=None, threads=None, pin_cpus=True):
+        from modules.course_rag_pipeline import EMBED_MODEL_NAME
+
+        self.workers, self.threads = plan_workers(workers, threads)
+        context = mp.get_context("spawn")
+        counter = context.Value("i", 0)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context,
+            initializer=_init_worker, initargs=(EMBED_MODEL_NAME, self.threads, pin_cpus, counter),
+        )
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_store_items(source, batch_size):
+    """
+    Đọc record từ store theo batch (query iterator), dựng lại text để embed.
+    """
+    from modules.course_rag_pipeline import record_text, content_hash
+    from modules.vector_stores import SCALAR_FIELDS
+
+    fields = [f for f in SCALAR_FIELDS if f in source.field_names()]
+    for batch in source.iter_rows(output_fields=fields, batch_size=batch_size):
+        for row in batch:
+            record = {f: row.get(f, "") for f in SCALAR_FIELDS}
+            record["id"] = row["id"]
+            text = record_text(record)
+            record["content_hash"] = content_hash(text, record)
+            yield record, text
+
+
+def iter_ndjson_items(path, courses_per_batch=16):
+    """
+    Đọc file NDJSON InsertPayload, chunk bài học giống /insert.
+    """
+    from modules.course_rag_pipeline import build_records
+
+    def flush(courses):
+        records, texts = build_records(courses)
+        return zip(records, texts)
+
+    courses = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            course = json.loads(line)
+            course.setdefault("category", None)
+            course.setdefault("description", None)
+            course.setdefault("url", None)
+            courses.append(course)
+            if len(courses) >= courses_per_batch:
+                yield from flush(courses)
+                courses = []
+    if courses:
+        yield from flush(courses)
+
+
+class _Progress:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.started = time.perf_counter()
+
+    def update(self, count):
+        self.done += count
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        line = f"⏳ {self.done}"
+        if self.total:
+            eta = (self.total - self.done) / rate if rate else 0.0
+            line += f"/{self.total} ({self.done / self.total:.1%}) | ETA {eta:.0f}s"
+        print(f"{line} | {rate:.1f} records/s")
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "records": self.done,
+            "seconds": round(elapsed, 2),
+            "records_per_second": round(self.done / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+def reindex(items, target, upsert=False, total=None, workers=None, threads=None,
+            chunk_size=REINDEX_CHUNK, batch_size=REINDEX_BATCH, pin_cpus=True, pool=None):
+    """
+    Embed lại và ghi toàn bộ record:
+    - items: iterable (record, text) — đọc dạng stream, không giữ hết trong RAM
+    - upsert: ghi đè record cùng ID (target.upsert) thay vì target.insert
+      Ghi thẳng vào store, không qua insert_data/upsert_data: process cha là CLI,
+      không có BM25/cache của service cần đồng bộ (service tự dựng lại khi chuyển alias)
+    - pool: EmbedPool dùng lại (không truyền → tạo pool riêng, đóng khi xong)
+    Mỗi chunk được chia batch cho pool worker, vector ghi vào 1 trong 2 buffer shared memory
+    (worker embed chunk sau trong lúc process cha insert chunk trước).
+    """
+    from modules.vector_stores import EMBED_DIM
+
+    own_pool = pool is None
+    if own_pool:
+        pool = EmbedPool(workers, threads, pin_cpus)
+    print(f"🚀 Reindex → {target.name}: {pool.workers} worker x {pool.threads} thread | chunk {chunk_size} | batch {batch_size}")
+
+    progress = _Progress(total)
+    buffers = [SharedVectorBuffer(chunk_size, EMBED_DIM) for _ in range(2)]
+
+    def finish(pending):
+        records, buffer, futures = pending
+        for future in futures:
+            future.result()
+        for i, record in enumerate(records):
+            record["embedding"] = buffer.array[i]
+        if upsert:
+            target.upsert(records)
+        else:
+            target.insert(records)
+        # Bỏ tham chiếu tới buffer để chunk sau ghi đè được (và close được khi xong)
+        for record in records:
+            record["embedding"] = None
+        progress.update(len(records))
+
+    try:
+        pending = None
+        for n, chunk in enumerate(_chunks(items, chunk_size)):
+            # Sắp theo độ dài text để mỗi batch ít padding
+            chunk.sort(key=lambda item: len(item[1]))
+            buffer = buffers[n % 2]
+            futures = [
+                pool.submit(_encode_into, buffer.name, buffer.shape, start,
+                            [text for _, text in chunk[start:start + batch_size]], batch_size)
+                for start in range(0, len(chunk), batch_size)
+            ]
+            if pending:
+                finish(pending)
+            pending = ([record for record, _ in chunk], buffer, futures)
+        if pending:
+            finish(pending)
+            pending = None
+        target.flush()
+    finally:
+        if own_pool:
+            pool.close()
+        for buffer in buffers:
+            buffer.close()
+
+    summary = progress.summary()
+    print(f"✅ Reindex xong {summary['records']} records trong {summary['seconds']}s "
+          f"({summary['records_per_second']} records/s)")
+    return summary
@@ -0,0 +1,102 @@
+# response_cache.py
+import os
+import time
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from modules.embedding_cache import normalize_query
+
+load_dotenv()
+
+
+class VersionedResponseCache:
+    """
+    Cache kết quả /search, /ask trong process.
+    - Key: (loại request, query đã chuẩn hóa, top_k, search type)
+    - Mỗi entry gắn version dữ liệu; insert/xóa dữ liệu sẽ tăng version
+      nên kết quả cũ không bao giờ được trả lại sau khi có dữ liệu mới.
+    - Hết hạn theo TTL và loại bỏ theo LRU khi vượt max_size.
+    """
+
+    def __init__(self, max_size: int = 2000, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(kind: str, query: str, top_k: int, search_type: str = "auto", fields=None):
+        return (kind, normalize_query(query), top_k, search_type, tuple(fields) if fields is not None else None)
+
+    def bump_version(self):
+        with self._lock:
+            self.version += 1
+            # Entry cũ không dùng được nữa, dọn luôn để giải phóng bộ nhớ
+            self._data.clear()
+            return self.version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            version, expires_at, value = entry
+            if version != self.version:
+                del self._data[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+            if time.monotonic() > expires_at:
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, version=None):
+        """
+        version: version dữ liệu lúc bắt đầu xử lý request; nếu dữ liệu đã đổi
+        trong lúc xử lý thì không lưu kết quả.
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            self._data[key] = (self.version, time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# Cache dùng chung cho /search và /ask
+response_cache = VersionedResponseCache(
+    max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "2000")),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "300")),
+)
@@ -0,0 +1,134 @@
+# semantic_cache.py
+import os
+import itertools
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class SemanticAnswerCache:
+    """
+    Cache câu trả lời /ask cho các câu hỏi gần giống nhau.
+    Mỗi entry: (embedding query, search type, top_k, task type, tập id context, kết quả).
+    - lookup: tìm entry có cosine >= threshold, cùng top_k và cùng intent (task type)
+      — "giá bao nhiêu?" và "ai dạy?" có thể rất gần nhau nhưng cần câu trả lời khác
+    - Người gọi phải kiểm tra tập context hiện tại vẫn trùng với context_ids
+      của entry trước khi dùng lại câu trả lời.
+    - invalidate: xóa entry dùng tới record vừa thay đổi/bị xóa.
+    """
+
+    def __init__(self, max_size: int = 1000, threshold: float = 0.95):
+        self.max_size = max_size
+        self.threshold = threshold
+        self._entries = OrderedDict()   # entry_id → dict
+        self._matrix = None             # cache ma trận embedding, dựng lại khi entries đổi
+        self._matrix_ids = []
+        self._next_id = itertools.count()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, q_emb, top_k: int, task_type: str):
+        """
+        Trả về entry gần nhất (cùng top_k, task_type) có similarity >= threshold, hoặc None.
+        """
+        q = self._normalize(q_emb)
+        with self._lock:
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._matrix_ids = list(self._entries)
+                self._matrix = np.stack([self._entries[i]["embedding"] for i in self._matrix_ids])
+            sims = self._matrix @ q
+            for idx in np.argsort(-sims):
+                if sims[idx] < self.threshold:
+                    break
+                entry = self._entries[self._matrix_ids[idx]]
+                if entry["top_k"] == top_k and entry["task_type"] == task_type:
+                    return entry
+            self.misses += 1
+            return None
+
+    def record_hit(self, entry):
+        with self._lock:
+            self.hits += 1
+            if entry["entry_id"] in self._entries:
+                self._entries.move_to_end(entry["entry_id"])
+
+    def record_rejected(self):
+        # Có entry đủ giống nhưng tập context đã khác → không dùng lại
+        with self._lock:
+            self.rejected += 1
+
+    def add(self, q_emb, search_type: str, top_k: int, task_type: str, context_ids, result):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            entry_id = next(self._next_id)
+            self._entries[entry_id] = {
+                "entry_id": entry_id,
+                "embedding": self._normalize(q_emb),
+                "search_type": search_type,
+                "top_k": top_k,
+                "task_type": task_type,
+                "context_ids": frozenset(context_ids),
+                "result": result,
+            }
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def invalidate(self, ids):
+        ids = set(ids)
+        if not ids:
+            return
+        with self._lock:
+            stale = [i for i, e in self._entries.items() if e["context_ids"] & ids]
+            for entry_id in stale:
+                del self._entries[entry_id]
+            if stale:
+                self.invalidations += len(stale)
+                self._matrix = None
+
+    def clear(self):
+        # Đổi cả collection (vd: chuyển alias sang version mới) → bỏ hết câu trả lời cũ
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses + self.rejected
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected": self.rejected,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "true").lower() in ("1", "true", "yes")
+
+semantic_cache = SemanticAnswerCache(
+    max_size=int(os.getenv("SEMANTIC_CACHE_SIZE", "1000")),
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+)
@@ -0,0 +1,28 @@
+# text_chunker.py
+
+
+def count_tokens(tokenizer, text: str) -> int:
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+def chunk_by_tokens(tokenizer, text: str, max_tokens: int, overlap_tokens: int = 0):
+    """
+    Cắt text thành các đoạn tối đa max_tokens token, chồng lấn overlap_tokens token.
+    Dùng offset_mapping của tokenizer (fast tokenizer) để cắt đúng trên text gốc.
+    Text ngắn hơn max_tokens → trả về [text].
+    """
+    if not text:
+        return [text]
+
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    if len(offsets) <= max_tokens:
+        return [text]
+
+    step = max(1, max_tokens - overlap_tokens)
+    chunks = []
+    for start in range(0, len(offsets), step):
+        end = min(start + max_tokens, len(offsets))
+        chunks.append(text[offsets[start][0]:offsets[end - 1][1]])
+        if end == len(offsets):
+            break
+    return chunks
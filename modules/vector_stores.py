@@ -0,0 +1,806 @@
+# vector_stores.py
+import os
+import re
+import json
+import threading
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Backend lưu vector:
+# - "milvus": Milvus standalone (mặc định)
+# - "memory": store trong process, ma trận memory-mapped + metadata dạng cột
+VECTOR_STORE = os.getenv("VECTOR_STORE", "milvus").lower()
+MEMORY_STORE_DIR = os.getenv("MEMORY_STORE_DIR", "./data/vector_store")
+MEMORY_STORE_DTYPE = os.getenv("MEMORY_STORE_DTYPE", "float32")  # float32 | float16
+
+EMBED_DIM = 768
+
+# Tham số index/search Milvus (chọn theo kết quả benchmarks/index_benchmark.py)
+MILVUS_INDEX_TYPE = os.getenv("MILVUS_INDEX_TYPE", "IVF_FLAT")
+MILVUS_INDEX_PARAMS = json.loads(os.getenv("MILVUS_INDEX_PARAMS", '{"nlist": 128}'))
+MILVUS_SEARCH_PARAMS = json.loads(os.getenv("MILVUS_SEARCH_PARAMS", '{"nprobe": 8}'))
+
+# Nén vector cho bước search thô, sau đó re-rank bằng vector float đầy đủ:
+# - "none": không nén (mặc định)
+# - "sq8": int8 (Milvus: index IVF_SQ8; memory: mã int8 + scale theo từng vector)
+# - "binary": 1 bit/chiều (Milvus: field embedding_bin + BIN_IVF_FLAT; memory: bit đã pack)
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+# Search thô lấy limit * RERANK_OVERSAMPLE ứng viên rồi mới re-rank
+RERANK_OVERSAMPLE = int(os.getenv("RERANK_OVERSAMPLE", "4"))
+BINARY_FIELD = "embedding_bin"
+# binary trên Milvus: search thô chỉ dùng embedding_bin, field float vẫn cần index để load collection
+# → index nằm trên đĩa (DiskANN) để RAM query node thật sự giảm; re-rank đọc vector float từ đĩa
+MILVUS_BINARY_FLOAT_INDEX = os.getenv("MILVUS_BINARY_FLOAT_INDEX", "DISKANN")
+
+# Mỗi loại record nằm trong 1 partition / 1 mask riêng
+RECORD_TYPES = ["course", "lesson"]
+
+# Các field scalar của 1 record (ngoài id và embedding)
+SCALAR_FIELDS = [
+    "type", "course_id", "course_title", "lesson_id", "lesson_title",
+    "author", "category", "content", "url", "content_hash", "chunk_index",
+]
+
+
+# Số bit 1 của mỗi giá trị byte (popcount cho khoảng cách Hamming)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def quantize_sq8(vectors):
+    """
+    Lượng tử hóa int8 đối xứng theo từng vector: v ≈ codes * scale.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(vectors):
+    # 1 bit/chiều (dấu của từng thành phần), pack 8 chiều vào 1 byte
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+    return np.packbits(vectors > 0, axis=1)
+
+
+def hamming_distances(codes, q_bits):
+    return _POPCOUNT[np.bitwise_xor(codes, q_bits)].sum(axis=1, dtype=np.int32)
+
+
+class VectorStore:
+    """
+    Interface chung cho nơi lưu record + vector của course_rag.
+    - search trả về list (theo từng vector query) các hit dạng dict:
+      {"id", "score", <output_fields>...}, score là inner product.
+      output_fields=None → mọi field scalar; output_fields=[] → chỉ id + score.
+    - iter_rows trả về từng batch dict, dùng cho các job đọc lại toàn bộ dữ liệu.
+    """
+
+    name = None
+
+    def field_names(self):
+        raise NotImplementedError
+
+    def insert(self, records):
+        raise NotImplementedError
+
+    def upsert(self, records):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def search(self, vectors, search_type, limit, filter_expr=None, output_fields=None):
+        raise NotImplementedError
+
+    def get(self, ids, output_fields=None):
+        """
+        Lấy record theo id (chỉ các field cần), trả về list dict có "id".
+        """
+        raise NotImplementedError
+
+    def iter_rows(self, course_ids=None, output_fields=None, batch_size=1000):
+        raise NotImplementedError
+
+    def rerank(self, queries, candidates, limit):
+        """
+        Tính lại score bằng vector float đầy đủ cho ứng viên của search thô (vector nén),
+        giữ top `limit` cho mỗi query. Lấy embedding 1 lần cho mọi ứng viên.
+        """
+        ids = list(dict.fromkeys(h["id"] for hits in candidates for h in hits))
+        embeddings = {row["id"]: np.asarray(row["embedding"], dtype=np.float32) for row in self.get(ids, ["embedding"])}
+        results = []
+        for q, hits in zip(queries, candidates):
+            q = np.asarray(q, dtype=np.float32)
+            rescored = [{**h, "score": float(np.dot(q, embeddings[h["id"]]))} for h in hits if h["id"] in embeddings]
+            rescored.sort(key=lambda h: h["score"], reverse=True)
+            results.append(rescored[:limit])
+        return results
+
+
+# =====================
+# Milvus
+# =====================
+class MilvusVectorStore(VectorStore):
+
+    def __init__(self, collection, quantization=VECTOR_QUANTIZATION):
+        self.collection = collection
+        self.name = collection.name
+        # Collection cũ còn record trong _default → search bằng filter type cho tới khi migrate
+        self.legacy_type_filter = False
+        self.quantization = quantization
+        self.rerank_oversample = RERANK_OVERSAMPLE
+
+    @classmethod
+    def open(cls, collection_name):
+        """
+        Tạo collection nếu chưa có, tạo partition theo type và load vào RAM.
+        """
+        from pymilvus import FieldSchema, CollectionSchema, DataType, Collection, utility
+        from modules.milvus_connection import ensure_connection
+
+        ensure_connection()
+        if utility.has_collection(collection_name):
+            print("Collection đã tồn tại, skip tạo.")
+            collection = Collection(collection_name)
+        else:
+            fields = [
+                FieldSchema(name="id", dtype=DataType.VARCHAR, is_primary=True, max_length=64),
+                FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=EMBED_DIM),
+                FieldSchema(name="type", dtype=DataType.VARCHAR, max_length=10),
+                FieldSchema(name="course_id", dtype=DataType.VARCHAR, max_length=64),
+                FieldSchema(name="course_title", dtype=DataType.VARCHAR, max_length=256),
+                FieldSchema(name="lesson_id", dtype=DataType.VARCHAR, max_length=64),
+                FieldSchema(name="lesson_title", dtype=DataType.VARCHAR, max_length=256),
+                FieldSchema(name="author", dtype=DataType.VARCHAR, max_length=128),
+                FieldSchema(name="category", dtype=DataType.VARCHAR, max_length=128),
+                FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=65535),
+                FieldSchema(name="url", dtype=DataType.VARCHAR, max_length=512),
+                FieldSchema(name="content_hash", dtype=DataType.VARCHAR, max_length=64),
+                FieldSchema(name="chunk_index", dtype=DataType.INT64),
+            ]
+            if VECTOR_QUANTIZATION == "binary":
+                fields.append(FieldSchema(name=BINARY_FIELD, dtype=DataType.BINARY_VECTOR, dim=EMBED_DIM))
+            schema = CollectionSchema(fields, description="Unified RAG schema for courses and lessons")
+            collection = Collection(name=collection_name, schema=schema)
+
+            # sq8: index IVF_SQ8 trên chính field float (search thô trên mã int8)
+            index_type = "IVF_SQ8" if VECTOR_QUANTIZATION == "sq8" else MILVUS_INDEX_TYPE
+            index_params = {"index_type": index_type, "metric_type": "IP", "params": MILVUS_INDEX_PARAMS}
+            if VECTOR_QUANTIZATION == "binary":
+                index_params = {"index_type": MILVUS_BINARY_FLOAT_INDEX, "metric_type": "IP", "params": {}}
+            collection.create_index(field_name="embedding", index_params=index_params)
+            if VECTOR_QUANTIZATION == "binary":
+                collection.create_index(field_name=BINARY_FIELD, index_params={
+                    "index_type": "BIN_IVF_FLAT", "metric_type": "HAMMING",
+                    "params": {"nlist": MILVUS_INDEX_PARAMS.get("nlist", 128)},
+                })
+            print("✅ Collection created:", collection_name)
+
+        store = cls(collection)
+        store.check_quantization()
+
+        # Partition theo type: course / lesson
+        store.ensure_type_partitions()
+
+        # 🔥 Load collection vào RAM để có thể search
+        try:
+            collection.load()
+            print("✅ Collection loaded vào RAM.")
+        except Exception as e:
+            print("⚠️ Load collection thất bại:", e)
+
+        store.detect_legacy_rows()
+        return store
+
+    @classmethod
+    def from_alias(cls, alias):
+        """
+        Mở store qua alias (collection đã build sẵn, không tạo mới):
+        mọi search/insert gửi tên alias, Milvus tự trỏ tới collection hiện tại.
+        Schema được đọc lúc mở → khi alias chuyển phải mở lại (collection_registry.watch_alias).
+        """
+        from pymilvus import Collection
+        from modules.milvus_connection import ensure_connection
+
+        ensure_connection()
+        store = cls(Collection(alias))
+        store.check_quantization()
+        store.detect_legacy_rows()
+        return store
+
+    def check_quantization(self):
+        # Collection tạo trước khi bật nén không có dữ liệu nén → search thường, không oversample
+        if self.quantization == "binary" and BINARY_FIELD not in self.field_names():
+            print(f"⚠️ Collection {self.name} không có field {BINARY_FIELD}, search không dùng binary.")
+            self.quantization = "none"
+        if self.quantization == "sq8" and self.index_type("embedding") != "IVF_SQ8":
+            print(f"⚠️ Collection {self.name} không dùng index IVF_SQ8, search không dùng sq8.")
+            self.quantization = "none"
+
+    def index_type(self, field_name):
+        for index in self.collection.indexes:
+            if index.field_name == field_name:
+                return index.params.get("index_type")
+        return None
+
+    def ensure_type_partitions(self):
+        for record_type in RECORD_TYPES:
+            if not self.collection.has_partition(record_type):
+                self.collection.create_partition(record_type)
+                print(f"✅ Partition created: {record_type}")
+
+    def detect_legacy_rows(self, warn=True):
+        """
+        Lọc theo field type khi partition _default còn dữ liệu cũ (chưa chạy migrate_partitions.py).
+        Service gọi lại định kỳ (collection_registry.watch_alias) để tắt lọc khi migrate xong,
+        không cần restart. Lỗi khi kiểm tra → giữ trạng thái hiện tại.
+        """
+        try:
+            legacy_rows = self.collection.query(
+                expr='id != ""', partition_names=["_default"], output_fields=["id"], limit=1
+            )
+        except Exception as e:
+            print("⚠️ Không kiểm tra được partition _default:", e)
+            return
+        self.legacy_type_filter = bool(legacy_rows)
+        if self.legacy_type_filter and warn:
+            print("⚠️ Còn dữ liệu trong partition _default, hãy chạy migrate_partitions.py.")
+
+    def field_names(self):
+        return [f.name for f in self.collection.schema.fields]
+
+    def _to_columns(self, records):
+        # Cột theo đúng thứ tự schema; collection cũ không có field mới (vd: content_hash) thì bỏ qua
+        columns = []
+        for name in self.field_names():
+            if name == BINARY_FIELD:
+                bits = quantize_binary([r["embedding"] for r in records])
+                columns.append([row.tobytes() for row in bits])
+            else:
+                columns.append([r.get(name, "") for r in records])
+        return columns
+
+    def _write(self, records, method):
+        # Mỗi type ghi vào partition tương ứng
+        for record_type in RECORD_TYPES:
+            typed = [r for r in records if r["type"] == record_type]
+            if typed:
+                method(self._to_columns(typed), partition_name=record_type)
+
+    def insert(self, records):
+        self._write(records, self.collection.insert)
+
+    def upsert(self, records):
+        self._write(records, self.collection.upsert)
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(f"id in {json.dumps(list(ids))}")
+
+    def flush(self):
+        self.collection.flush()
+
+    def count(self) -> int:
+        return self.collection.num_entities
+
+    def search(self, vectors, search_type, limit, filter_expr=None, output_fields=None):
+        # Search trực tiếp trong partition của type, không cần filter scalar
+        expr = filter_expr
+        partition_names = [search_type]
+        if self.legacy_type_filter:
+            expr = f"type == '{search_type}'"
+            if filter_expr:
+                expr += f" and {filter_expr}"
+            partition_names = None
+
+        available = self.field_names()
+        output_fields = [f for f in (SCALAR_FIELDS if output_fields is None else output_fields) if f in available]
+        # Vector query là np.float32 (cache embedding) → list ở biên client Milvus
+        data, anns_field, metric = [np.asarray(v, dtype=np.float32).tolist() for v in vectors], "embedding", "IP"
+        coarse_limit = limit
+        if self.quantization != "none":
+            # Search thô trên vector nén, lấy dư ứng viên để re-rank
+            coarse_limit = limit * self.rerank_oversample
+            if self.quantization == "binary":
+                data = [row.tobytes() for row in quantize_binary(vectors)]
+                anns_field, metric = BINARY_FIELD, "HAMMING"
+        results = self.collection.search(
+            data=data,
+            anns_field=anns_field,
+            param={"metric_type": metric, "params": MILVUS_SEARCH_PARAMS},
+            limit=coarse_limit,
+            expr=expr,
+            partition_names=partition_names,
+            output_fields=output_fields,
+        )
+        hits = [
+            [{"id": hit.id, "score": hit.score, **{f: hit.entity.get(f) for f in output_fields}} for hit in hits]
+            for hits in results
+        ]
+        if self.quantization != "none":
+            hits = self.rerank(vectors, hits, limit)
+        return hits
+
+    def get(self, ids, output_fields=None):
+        if not ids:
+            return []
+        available = self.field_names()
+        output_fields = [f for f in (SCALAR_FIELDS if output_fields is None else output_fields) if f in available]
+        return self.collection.query(expr=f"id in {json.dumps(list(ids))}", output_fields=output_fields)
+
+    def iter_rows(self, course_ids=None, output_fields=None, batch_size=1000, partition_names=None):
+        available = self.field_names()
+        output_fields = [f for f in (output_fields or available) if f in available]
+        if course_ids is not None:
+            expr = f"course_id in {json.dumps(list(course_ids), ensure_ascii=False)}"
+        else:
+            expr = 'id != ""'
+        iterator = self.collection.query_iterator(
+            batch_size=batch_size,
+            expr=expr,
+            output_fields=output_fields,
+            partition_names=partition_names,
+        )
+        while True:
+            batch = iterator.next()
+            if not batch:
+                iterator.close()
+                break
+            yield batch
+
+    def migrate_to_type_partitions(self, batch_size=1000):
+        """
+        Chuyển các record cũ trong partition _default sang partition course/lesson.
+        Đọc theo từng batch bằng query iterator (không load hết vào RAM),
+        insert vào partition mới rồi xóa khỏi _default.
+        """
+        self.ensure_type_partitions()
+        self.collection.load()
+
+        moved = 0
+        for batch in self.iter_rows(batch_size=batch_size, partition_names=["_default"]):
+            self.insert(batch)
+            ids = [r["id"] for r in batch]
+            self.collection.delete(f"id in {json.dumps(ids)}", partition_name="_default")
+            moved += len(batch)
+            print(f"🔁 Đã chuyển {moved} records")
+
+        self.collection.flush()
+        self.legacy_type_filter = False
+        print(f"✅ Migrate xong {moved} records sang partition theo type")
+        return moved
+
+
+# =====================
+# In-process (memory-mapped)
+# =====================
+_FILTER_TERM = re.compile(r"""^\s*(\w+)\s*==\s*(?:'([^']*)'|"([^"]*)")\s*$""")
+
+
+class MemoryVectorStore(VectorStore):
+    """
+    Store trong process cho catalogue vừa RAM, không cần Milvus:
+    - Vector: ma trận float32/float16 memory-mapped (vectors.bin)
+    - Metadata: lưu theo cột (meta.json) + log append-only các row ghi/xóa sau snapshot
+      (meta.<generation>.log), mask theo type
+    - Search: inner product chính xác bằng BLAS + top-k bằng argpartition
+    - quantization sq8/binary: search thô trên mã nén giữ trong RAM,
+      chỉ đọc vector đầy đủ (memmap) của ứng viên để re-rank
+    path=None → chỉ giữ trong RAM (test, benchmark).
+    """
+
+    # Số row xử lý mỗi lần khi tính score trên mã nén (giới hạn bộ nhớ tạm)
+    CODE_CHUNK_ROWS = 65536
+
+    def __init__(self, name, path=None, dim=EMBED_DIM, dtype=MEMORY_STORE_DTYPE, quantization=VECTOR_QUANTIZATION):
+        self.name = name
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.quantization = quantization
+        self.rerank_oversample = RERANK_OVERSAMPLE
+        self._lock = threading.RLock()
+        # flush chạy tuần tự; ghi file ngoài self._lock để không chặn search
+        self._flush_lock = threading.Lock()
+        self._journal = []            # row ghi/xóa chưa flush (chỉ khi có path)
+        self._journal_rows = 0        # số row trong log của generation hiện tại
+        self._snapshot_needed = False
+        self._generation = 0
+
+        self._size = 0
+        self._capacity = 0
+        self._vectors = np.zeros((0, dim), dtype=self.dtype)
+        self._alive = np.zeros(0, dtype=bool)
+        self._type_codes = np.zeros(0, dtype=np.int8)
+        self._ids = []
+        self._columns = {f: [] for f in SCALAR_FIELDS}
+        self._row_of = {}
+        # Mã nén (chỉ trong RAM, dựng lại từ vectors.bin khi load)
+        self._codes = self._empty_codes(0)
+        self._scales = np.zeros(0, dtype=np.float32)
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+            if os.path.exists(self._meta_path):
+                self._load()
+
+    @classmethod
+    def open(cls, name):
+        store = cls(name, path=os.path.join(MEMORY_STORE_DIR, name))
+        print(f"✅ Memory store loaded: {name} ({store.count()} records)")
+        return store
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.path, "vectors.bin")
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    def _log_path(self, generation):
+        return os.path.join(self.path, f"meta.{generation}.log")
+
+    # ---------- lưu / load ----------
+    def _load(self):
+        with open(self._meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        self._generation = meta.get("generation", 0)
+        self._ids = meta["ids"]
+        self._columns = {f: meta["columns"].get(f, [""] * meta["size"]) for f in SCALAR_FIELDS}
+        alive = list(meta["alive"])
+        self._journal_rows = self._replay_log(alive)
+        self._size = len(self._ids)
+        # vectors.bin có thể đã được nới rộng sau snapshot
+        file_rows = os.path.getsize(self._vectors_path) // (self.dim * self.dtype.itemsize)
+        self._capacity = max(meta["capacity"], file_rows)
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._alive[:self._size] = alive
+        self._type_codes = np.zeros(self._capacity, dtype=np.int8)
+        self._type_codes[:self._size] = [self._type_code(t) for t in self._columns["type"]]
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r+", shape=(self._capacity, self.dim))
+        self._row_of = {rid: row for row, rid in enumerate(self._ids) if self._alive[row]}
+        self._codes = self._empty_codes(self._capacity)
+        self._scales = np.zeros(self._capacity, dtype=np.float32)
+        for start in range(0, self._size, self.CODE_CHUNK_ROWS):
+            end = min(start + self.CODE_CHUNK_ROWS, self._size)
+            self._encode_rows(np.arange(start, end), self._vectors[start:end])
+
+    def _replay_log(self, alive):
+        """
+        Áp log của generation hiện tại lên snapshot vừa đọc, trả về số row trong log.
+        Dòng cuối ghi dở (crash giữa chừng) bị bỏ qua.
+        """
+        path = self._log_path(self._generation)
+        if not os.path.exists(path):
+            return 0
+        rows = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if "deleted" in entry:
+                    for row in entry["deleted"]:
+                        alive[row] = False
+                    continue
+                row = entry["row"]
+                if row == len(self._ids):
+                    self._ids.append(entry["id"])
+                    alive.append(True)
+                    for f_name in SCALAR_FIELDS:
+                        self._columns[f_name].append(entry["columns"].get(f_name, ""))
+                else:
+                    self._ids[row] = entry["id"]
+                    alive[row] = True
+                    for f_name in SCALAR_FIELDS:
+                        self._columns[f_name][row] = entry["columns"].get(f_name, "")
+                rows += 1
+        return rows
+
+    def flush(self):
+        """
+        Chụp phần cần ghi khi giữ lock (copy nông), ghi file sau khi nhả lock:
+        - bình thường chỉ append các row ghi/xóa mới vào log
+        - sau compact (row đổi vị trí) hoặc khi log dài hơn số row → ghi snapshot mới
+          (generation + 1, log cũ bị xóa)
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._compact_if_needed()
+                if not self.path:
+                    return
+                vectors = self._vectors
+                journal, self._journal = self._journal, []
+                snapshot = None
+                if (self._snapshot_needed or not os.path.exists(self._meta_path)
+                        or self._journal_rows + len(journal) > max(self._size, 1024)):
+                    self._generation += 1
+                    snapshot = {
+                        "dim": self.dim,
+                        "dtype": self.dtype.name,
+                        "generation": self._generation,
+                        "size": self._size,
+                        "capacity": self._capacity,
+                        "ids": list(self._ids),
+                        "alive": self._alive[:self._size].tolist(),
+                        "columns": {f: list(c) for f, c in self._columns.items()},
+                    }
+                    self._snapshot_needed = False
+                    self._journal_rows = 0
+                else:
+                    self._journal_rows += len(journal)
+
+            if isinstance(vectors, np.memmap):
+                vectors.flush()
+            if snapshot is not None:
+                tmp_path = self._meta_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(snapshot, f, ensure_ascii=False)
+                os.replace(tmp_path, self._meta_path)
+                previous_log = self._log_path(snapshot["generation"] - 1)
+                if os.path.exists(previous_log):
+                    os.remove(previous_log)
+            elif journal:
+                with open(self._log_path(self._generation), "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in journal)
+
+    def _ensure_capacity(self, needed):
+        if needed <= self._capacity:
+            return
+        capacity = max(needed, self._capacity * 2, 1024)
+        if self.path:
+            tmp_path = self._vectors_path + ".tmp"
+            vectors = np.memmap(tmp_path, dtype=self.dtype, mode="w+", shape=(capacity, self.dim))
+            vectors[:self._size] = self._vectors[:self._size]
+            vectors.flush()
+            del vectors
+            os.replace(tmp_path, self._vectors_path)
+            self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+        else:
+            vectors = np.zeros((capacity, self.dim), dtype=self.dtype)
+            vectors[:self._size] = self._vectors[:self._size]
+            self._vectors = vectors
+        self._alive = np.concatenate([self._alive, np.zeros(capacity - self._capacity, dtype=bool)])
+        self._type_codes = np.concatenate([self._type_codes, np.zeros(capacity - self._capacity, dtype=np.int8)])
+        self._codes = np.concatenate([self._codes, self._empty_codes(capacity - self._capacity)])
+        self._scales = np.concatenate([self._scales, np.zeros(capacity - self._capacity, dtype=np.float32)])
+        self._capacity = capacity
+
+    def _compact_if_needed(self):
+        # Nhiều row đã xóa → dồn lại để search không quét row chết
+        dead = self._size - len(self._row_of)
+        if dead < 1024 or dead * 2 < self._size:
+            return
+        keep = np.flatnonzero(self._alive[:self._size])
+        vectors = np.array(self._vectors[keep])
+        columns = {f: [self._columns[f][i] for i in keep] for f in SCALAR_FIELDS}
+        ids = [self._ids[i] for i in keep]
+        self._vectors[:len(keep)] = vectors
+        self._alive[:] = False
+        self._alive[:len(keep)] = True
+        self._type_codes[:len(keep)] = self._type_codes[keep]
+        self._codes[:len(keep)] = self._codes[keep]
+        self._scales[:len(keep)] = self._scales[keep]
+        self._columns = columns
+        self._ids = ids
+        self._size = len(keep)
+        self._row_of = {rid: row for row, rid in enumerate(ids)}
+        # Row đổi vị trí → log theo row cũ không còn đúng, flush ghi snapshot mới
+        self._journal = []
+        self._snapshot_needed = True
+
+    @staticmethod
+    def _type_code(record_type):
+        return RECORD_TYPES.index(record_type) + 1 if record_type in RECORD_TYPES else 0
+
+    # ---------- mã nén ----------
+    def _empty_codes(self, rows):
+        if self.quantization == "sq8":
+            return np.zeros((rows, self.dim), dtype=np.int8)
+        if self.quantization == "binary":
+            return np.zeros((rows, (self.dim + 7) // 8), dtype=np.uint8)
+        return np.zeros((rows, 0), dtype=np.uint8)
+
+    def _encode_rows(self, rows, vectors):
+        if self.quantization == "sq8":
+            self._codes[rows], self._scales[rows] = quantize_sq8(vectors)
+        elif self.quantization == "binary":
+            self._codes[rows] = quantize_binary(vectors)
+
+    def _coarse_scores(self, rows, queries):
+        """
+        Score xấp xỉ (càng lớn càng gần) của các row với từng query, tính trên mã nén.
+        """
+        scores = np.empty((len(rows), len(queries)), dtype=np.float32)
+        q_bits = quantize_binary(queries) if self.quantization == "binary" else None
+        for start in range(0, len(rows), self.CODE_CHUNK_ROWS):
+            chunk = rows[start:start + self.CODE_CHUNK_ROWS]
+            codes = self._codes[chunk]
+            if self.quantization == "sq8":
+                scores[start:start + len(chunk)] = (codes.astype(np.float32) @ queries.T) * self._scales[chunk, None]
+            else:
+                for qi in range(len(queries)):
+                    scores[start:start + len(chunk), qi] = -hamming_distances(codes, q_bits[qi])
+        return scores
+
+    def memory_usage(self) -> dict:
+        # Bộ nhớ của vector đầy đủ (memmap) và mã nén dùng cho search thô
+        with self._lock:
+            return {
+                "vectors_bytes": int(self._size * self.dim * self.dtype.itemsize),
+                "codes_bytes": int(self._codes[:self._size].nbytes + self._scales[:self._size].nbytes
+                                   if self.quantization == "sq8" else self._codes[:self._size].nbytes),
+            }
+
+    # ---------- ghi ----------
+    def field_names(self):
+        return ["id", "embedding"] + SCALAR_FIELDS
+
+    def upsert(self, records):
+        with self._lock:
+            new_rows = sum(1 for r in records if r["id"] not in self._row_of)
+            self._ensure_capacity(self._size + new_rows)
+            for r in records:
+                row = self._row_of.get(r["id"])
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._ids.append(r["id"])
+                    for f in SCALAR_FIELDS:
+                        self._columns[f].append(r.get(f, ""))
+                    self._row_of[r["id"]] = row
+                else:
+                    for f in SCALAR_FIELDS:
+                        self._columns[f][row] = r.get(f, "")
+                self._vectors[row] = np.asarray(r["embedding"], dtype=self.dtype)
+                self._encode_rows([row], [r["embedding"]])
+                self._alive[row] = True
+                self._type_codes[row] = self._type_code(r["type"])
+                if self.path:
+                    self._journal.append({
+                        "row": row, "id": r["id"], "columns": {f: r.get(f, "") for f in SCALAR_FIELDS},
+                    })
+
+    # ID trùng thì ghi đè, nên insert và upsert giống nhau
+    insert = upsert
+
+    def delete(self, ids):
+        with self._lock:
+            rows = []
+            for rid in ids:
+                row = self._row_of.pop(rid, None)
+                if row is not None:
+                    self._alive[row] = False
+                    rows.append(row)
+            if self.path and rows:
+                self._journal.append({"deleted": rows})
+
+    def count(self) -> int:
+        return len(self._row_of)
+
+    # ---------- đọc ----------
+    def _filter_mask(self, filter_expr, size):
+        """
+        Hỗ trợ filter đơn giản: field == 'value' [and field == 'value' ...]
+        """
+        mask = np.ones(size, dtype=bool)
+        if not filter_expr:
+            return mask
+        for term in re.split(r"\s+and\s+", filter_expr.strip()):
+            match = _FILTER_TERM.match(term)
+            if not match or match.group(1) not in self._columns:
+                raise ValueError(f"MemoryVectorStore không hỗ trợ filter: {filter_expr}")
+            field, value = match.group(1), match.group(2) if match.group(2) is not None else match.group(3)
+            column = self._columns[field]
+            mask &= np.fromiter((str(column[i]) == value for i in range(size)), dtype=bool, count=size)
+        return mask
+
+    def _row_dict(self, row, output_fields):
+        return {f: self._columns[f][row] for f in output_fields}
+
+    def search(self, vectors, search_type, limit, filter_expr=None, output_fields=None):
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        output_fields = [f for f in (SCALAR_FIELDS if output_fields is None else output_fields) if f in self._columns]
+
+        with self._lock:
+            size = self._size
+            matrix = self._vectors
+            mask = self._alive[:size] & (self._type_codes[:size] == self._type_code(search_type))
+            mask &= self._filter_mask(filter_expr, size)
+            rows = np.flatnonzero(mask)
+
+            if len(rows) == 0:
+                return [[] for _ in queries]
+
+            if self.quantization != "none":
+                scores = self._coarse_scores(rows, queries)
+            # Ít row (vd: course) → gom row rồi nhân; nhiều row → nhân cả ma trận rồi mask
+            elif len(rows) * 2 < size:
+                scores = np.asarray(matrix[rows], dtype=np.float32) @ queries.T
+            else:
+                scores = (np.asarray(matrix[:size], dtype=np.float32) @ queries.T)[rows]
+
+            k = min(limit, len(rows))
+            results = []
+            for qi in range(len(queries)):
+                col = scores[:, qi]
+                if self.quantization == "none":
+                    top = np.argpartition(-col, k - 1)[:k]
+                    top_scores = col[top]
+                else:
+                    # Re-rank: lấy k * oversample ứng viên từ mã nén, tính lại bằng vector đầy đủ
+                    k_coarse = min(k * self.rerank_oversample, len(rows))
+                    candidates = np.argpartition(-col, k_coarse - 1)[:k_coarse]
+                    exact = np.asarray(matrix[rows[candidates]], dtype=np.float32) @ queries[qi]
+                    best = np.argpartition(-exact, k - 1)[:k]
+                    top, top_scores = candidates[best], exact[best]
+                order = np.argsort(-top_scores)
+                results.append([
+                    {"id": self._ids[rows[i]], "score": float(s),
+                     **self._row_dict(rows[i], output_fields)}
+                    for i, s in zip(top[order], top_scores[order])
+                ])
+            return results
+
+    def get(self, ids, output_fields=None):
+        output_fields = SCALAR_FIELDS if output_fields is None else output_fields
+        scalar_fields = [f for f in output_fields if f in self._columns]
+        rows = []
+        with self._lock:
+            for rid in ids:
+                row = self._row_of.get(rid)
+                if row is None:
+                    continue
+                item = {"id": rid, **self._row_dict(row, scalar_fields)}
+                if "embedding" in output_fields:
+                    item["embedding"] = np.asarray(self._vectors[row], dtype=np.float32).tolist()
+                rows.append(item)
+        return rows
+
+    def iter_rows(self, course_ids=None, output_fields=None, batch_size=1000):
+        output_fields = output_fields or self.field_names()
+        scalar_fields = [f for f in output_fields if f in self._columns]
+        course_ids = set(course_ids) if course_ids is not None else None
+        # Snapshot theo id (row có thể đổi khi compact)
+        with self._lock:
+            ids = [
+                rid for rid, row in sorted(self._row_of.items(), key=lambda item: item[1])
+                if course_ids is None or self._columns["course_id"][row] in course_ids
+            ]
+        for start in range(0, len(ids), batch_size):
+            batch = []
+            with self._lock:
+                for rid in ids[start:start + batch_size]:
+                    row = self._row_of.get(rid)
+                    if row is None:
+                        continue
+                    item = {"id": rid, **self._row_dict(row, scalar_fields)}
+                    if "embedding" in output_fields:
+                        item["embedding"] = np.asarray(self._vectors[row], dtype=np.float32).tolist()
+                    batch.append(item)
+            if batch:
+                yield batch
+
+
+def open_vector_store(collection_name):
+    """
+    Mở store theo VECTOR_STORE (milvus | memory).
+    """
+    if VECTOR_STORE == "milvus":
+        return MilvusVectorStore.open(collection_name)
+    if VECTOR_STORE == "memory":
+        return MemoryVectorStore.open(collection_name)
+    raise ValueError(f"VECTOR_STORE không hợp lệ: {VECTOR_STORE} (chỉ hỗ trợ 'milvus' hoặc 'memory')")
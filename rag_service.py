@@ -1,19 +1,52 @@
-from pymilvus import Collection
 from embedding import get_embedding
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import os
+import json
+import time
+import asyncio
+import logging
+import threading
 from dotenv import load_dotenv
-from modules.course_rag_pipeline import query_rag  # ✅ import lại hàm
+from modules.course_rag_pipeline import (  # ✅ import lại hàm
+    query_rag_async, query_rag_batch_async, embed_query_async, embed_texts,
+    resolve_output_fields, MAX_BATCH_QUERIES,
+)
+from modules.executors import run_embedding, run_milvus
+from modules.collection_registry import get_collection, get_store
+from modules.query_classifier import QueryTypeClassifier
+from modules.response_cache import response_cache
+from modules.semantic_cache import semantic_cache, SEMANTIC_CACHE
+from modules.metrics import stage_timer, LLM_CALLS, STAGE_LATENCY
 
 #from special_contexts import special_contexts
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
+
+# OPENAI_BASE_URL cho phép trỏ sang server OpenAI-compatible khác (vd: fake server khi test)
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
+# Client async cho các endpoint v2 (/ask, /search) để không giữ thread khi chờ LLM
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
+
+# Chế độ tiền xử lý query cho /ask:
+# - "llm": luôn gọi gpt-4o-mini để chuẩn hóa + phân loại (mặc định)
+# - "local": phân loại bằng embedding, chỉ gọi LLM khi margin thấp
+QUERY_PREPROCESS_MODE = os.getenv("QUERY_PREPROCESS_MODE", "llm").lower()
+QUERY_CLASSIFIER_MIN_MARGIN = float(os.getenv("QUERY_CLASSIFIER_MIN_MARGIN", "0.02"))
+
+# Ngưỡng score tối thiểu của hit được dùng (lọc trước khi lấy field từ store)
+MIN_HIT_SCORE = 0.25
+# Field cần để dựng context cho LLM (/ask), không lấy chunk_index, category...
+CONTEXT_FIELDS = ["type", "course_title", "lesson_title", "author", "url", "content"]
+
+query_classifier = QueryTypeClassifier(embed_texts)
+_classifier_stats = {"local": 0, "llm_fallback": 0}
+_classifier_stats_lock = threading.Lock()
 
 def rag_answer_v1(query: str, top_k=3):
     # load collection
-    collection = Collection("course_chunks")
+    collection = get_collection("course_chunks")
     q_emb = get_embedding(query, is_query=True)
 
     # search in Milvus
@@ -62,40 +95,40 @@ Hãy trả lời ngắn gọn, chính xác, và chỉ dựa vào thông tin trê
         "answer": response.choices[0].message.content
     }
 
-def rag_answer_v2(query: str, top_k=10):
-    collection = Collection("course_rag")
+async def _retrieve(query: str, top_k: int, with_type: bool = False):
+    """
+    Tiền xử lý query + semantic search, chỉ giữ các hit có score > 0.25.
+    with_type=True → trả về (hits, search_type).
+    """
+    collection = await run_milvus(get_store)
 
-    preprocessed = preprocess_query_with_llm(query)
+    with stage_timer("preprocess"):
+        preprocessed = await preprocess_query(query)
 
     query_clean = preprocessed["query"]
     search_type = preprocessed["type"]
 
-    print(f"llmQuery: {query_clean} | Type: {search_type}")
+    logger.debug(f"llmQuery: {query_clean} | Type: {search_type}")
 
     # Semantic search
-    results = query_rag(collection, query_clean, limit=top_k, input_search_type=search_type)
+    results = await query_rag_async(
+        collection, query_clean, limit=top_k, input_search_type=search_type,
+        output_fields=CONTEXT_FIELDS, min_score=MIN_HIT_SCORE
+    )
 
-    results = [r for r in results if r.get("score", 0) > 0.25]
+    hits = [r for r in results if r.get("score", 0) > MIN_HIT_SCORE]
+    return (hits, search_type) if with_type else hits
 
-    # Fallback khi không tìm thấy gì
-    if not results:
-        fallback_prompt = f"""
+
+def _fallback_prompt(query: str) -> str:
+    return f"""
         Người dùng hỏi: "{query}".
         Tôi không tìm thấy thông tin nào trong cơ sở dữ liệu khóa học.
         Hãy trả lời lịch sự và gợi ý người dùng thử câu hỏi khác.
         """
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": fallback_prompt}]
-        )
-        return {
-            "query": query,
-            "contexts": [],
-            "answer": response.choices[0].message.content,
-            "found": False
-        }
 
-    # Chuẩn bị context
+
+def _build_contexts(results):
     contexts = []
     for hit in results:
         ctx = f"[{hit['type'].upper()}] {hit['course_title']}"
@@ -103,21 +136,23 @@ def rag_answer_v2(query: str, top_k=10):
             ctx += f" → {hit['lesson_title']}"
         ctx += f"\nTác giả: {hit['author']}\nURL: {hit['url']}\nNội dung: {hit['content']}"
         contexts.append(ctx)
+    return contexts
 
-    context_text = "\n\n".join(contexts)[:4000]
 
-    # 4️⃣ Nhận diện intent đơn giản
+def _detect_task_type(query: str) -> str:
     query_lower = query.lower()
     if "giá" in query_lower or "bao nhiêu" in query_lower:
-        task_type = "price"
+        return "price"
     elif "tác giả" in query_lower or "ai dạy" in query_lower:
-        task_type = "author"
+        return "author"
     elif "bài học" in query_lower or "nội dung" in query_lower:
-        task_type = "lessons"
-    else:
-        task_type = "general"
+        return "lessons"
+    return "general"
+
+
+def _build_answer_prompt(query: str, contexts, task_type: str) -> str:
+    context_text = "\n\n".join(contexts)[:4000]
 
-    # 5️⃣ Sinh prompt chính
     prompt = f"""
     Bạn là trợ lý AI của hệ thống khóa học.
     Người dùng hỏi: "{query}"
@@ -133,29 +168,226 @@ def rag_answer_v2(query: str, top_k=10):
         prompt += "\nNếu có tác giả, hãy nêu rõ ai là người dạy khóa học."
     elif task_type == "lessons":
         prompt += "\nNếu có danh sách bài học, hãy tóm tắt số lượng và tiêu đề các bài học chính."
+    return prompt
 
-    # 6️⃣ Gọi OpenAI để sinh câu trả lời
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}]
+
+async def rag_answer_v2(query: str, top_k=10):
+    # Cache theo version dữ liệu: /insert làm tăng version nên không trả kết quả cũ
+    key = response_cache.make_key("ask", query, top_k)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    version = response_cache.version
+    result = await _rag_answer(query, top_k)
+    response_cache.put(key, result, version=version)
+    return result
+
+
+async def _context_ids(query: str, top_k: int, search_type: str):
+    """
+    Tập id context để kiểm tra semantic cache: search thẳng bằng query gốc (chỉ lấy id).
+    Lúc lưu entry và lúc lookup đều tính bằng hàm này nên 2 tập so sánh được với nhau
+    (retrieval cho câu trả lời dùng query đã viết lại, mỗi lần có thể khác).
+    """
+    collection = await run_milvus(get_store)
+    results = await query_rag_async(
+        collection, query, limit=top_k, input_search_type=search_type,
+        output_fields=[], min_score=MIN_HIT_SCORE
     )
+    return frozenset(r["id"] for r in results if r.get("score", 0) > MIN_HIT_SCORE)
 
-    return {
+
+# Task nền của semantic cache (giữ tham chiếu để task không bị GC khi đang chạy)
+_background_tasks = set()
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def _cache_answer(context_ids, q_emb, search_type, top_k, task_type, result):
+    # Chạy nền sau khi đã trả lời: chờ tập id context (task chạy song song với generation) rồi lưu entry
+    try:
+        if isinstance(context_ids, asyncio.Task):
+            context_ids = await context_ids
+        semantic_cache.add(q_emb, search_type, top_k, task_type, context_ids, result)
+    except Exception as e:
+        logger.warning(f"⚠️ Không lưu được semantic cache: {e}")
+
+
+async def _semantic_cache_lookup(query: str, top_k: int, task_type: str):
+    """
+    Tìm câu trả lời đã sinh cho câu hỏi gần giống (cosine >= SEMANTIC_CACHE_THRESHOLD, cùng intent).
+    Chỉ dùng lại khi tập context hiện tại trùng với tập đã dùng để sinh câu trả lời.
+    Trả về (q_emb, result hoặc None, (search_type, context_ids) đã tính nếu có).
+    """
+    q_emb = await embed_query_async(query)
+    entry = semantic_cache.lookup(q_emb, top_k, task_type)
+    if entry is None:
+        return q_emb, None, None
+
+    context_ids = await _context_ids(query, top_k, entry["search_type"])
+    if context_ids != entry["context_ids"]:
+        semantic_cache.record_rejected()
+        return q_emb, None, (entry["search_type"], context_ids)
+
+    semantic_cache.record_hit(entry)
+    return q_emb, {**entry["result"], "query": query}, None
+
+
+async def _rag_answer(query: str, top_k=10):
+    # 4️⃣ Nhận diện intent đơn giản (cũng là một phần key của semantic cache)
+    task_type = _detect_task_type(query)
+
+    if SEMANTIC_CACHE:
+        with stage_timer("semantic_cache"):
+            q_emb, cached, checked = await _semantic_cache_lookup(query, top_k, task_type)
+        if cached is not None:
+            return cached
+
+    results, search_type = await _retrieve(query, top_k, with_type=True)
+
+    # Fallback khi không tìm thấy gì
+    if not results:
+        LLM_CALLS.labels("fallback").inc()
+        with stage_timer("generation"):
+            response = await async_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": _fallback_prompt(query)}]
+            )
+        return {
+            "query": query,
+            "contexts": [],
+            "answer": response.choices[0].message.content,
+            "found": False
+        }
+
+    context_ids = None
+    if SEMANTIC_CACHE:
+        # Tập id tính giống lúc lookup (query gốc); dùng lại nếu vừa tính khi entry gần giống bị từ chối,
+        # không thì tính song song với generation để không nằm trên đường chờ của request
+        if checked is not None and checked[0] == search_type:
+            context_ids = checked[1]
+        else:
+            context_ids = _spawn(_context_ids(query, top_k, search_type))
+
+    with stage_timer("context"):
+        # Chuẩn bị context
+        contexts = _build_contexts(results)
+
+        # 5️⃣ Sinh prompt chính
+        prompt = _build_answer_prompt(query, contexts, task_type)
+
+    # 6️⃣ Gọi OpenAI để sinh câu trả lời
+    LLM_CALLS.labels("answer").inc()
+    try:
+        with stage_timer("generation"):
+            response = await async_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}]
+            )
+    except BaseException:
+        if isinstance(context_ids, asyncio.Task):
+            context_ids.cancel()
+        raise
+
+    result = {
         "query": query,
         "contexts": contexts,
         "answer": response.choices[0].message.content,
         "found": True,
         "task_type": task_type
     }
+    if SEMANTIC_CACHE:
+        _spawn(_cache_answer(context_ids, q_emb, search_type, top_k, task_type, result))
+    return result
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def rag_answer_stream(query: str, top_k=10):
+    """
+    Bản streaming của rag_answer_v2, sinh các event Server-Sent Events:
+    - contexts: danh sách context tìm được (gửi ngay sau retrieval)
+    - token: từng đoạn câu trả lời từ LLM
+    - done: task_type, found và thời gian từng giai đoạn (ms)
+    - error: nếu có lỗi giữa chừng
+    """
+    started = time.perf_counter()
+    try:
+        results = await _retrieve(query, top_k)
+        retrieval_ms = (time.perf_counter() - started) * 1000
+
+        found = bool(results)
+        with stage_timer("context"):
+            contexts = _build_contexts(results) if found else []
+            task_type = _detect_task_type(query) if found else None
+            prompt = _build_answer_prompt(query, contexts, task_type) if found else _fallback_prompt(query)
+        yield _sse("contexts", {"query": query, "found": found, "contexts": contexts})
+
+        LLM_CALLS.labels("answer_stream" if found else "fallback").inc()
+        generation_started = time.perf_counter()
+        stream = await async_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            stream=True
+        )
+
+        first_token_ms = None
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if not content:
+                continue
+            if first_token_ms is None:
+                first_token_ms = (time.perf_counter() - started) * 1000
+                STAGE_LATENCY.labels("first_token").observe(time.perf_counter() - generation_started)
+            yield _sse("token", {"content": content})
+        STAGE_LATENCY.labels("generation").observe(time.perf_counter() - generation_started)
+
+        yield _sse("done", {
+            "found": found,
+            "task_type": task_type,
+            "timing": {
+                "retrieval_ms": round(retrieval_ms, 1),
+                "first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+                "total_ms": round((time.perf_counter() - started) * 1000, 1),
+            },
+        })
+    except Exception as e:
+        yield _sse("error", {"detail": str(e)})
+
+async def rag_search(query: str, top_k=10, fields=None):
+    # fields: danh sách field trả về cho mỗi hit (None → mặc định đầy đủ)
+    output_fields = resolve_output_fields(fields)
+    key = response_cache.make_key("search", query, top_k, "course", output_fields)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    version = response_cache.version
+    result = await _rag_search(query, top_k, output_fields)
+    response_cache.put(key, result, version=version)
+    return result
 
-def rag_search(query: str, top_k=10):
-    collection = Collection("course_rag")
+
+async def _rag_search(query: str, top_k=10, output_fields=None):
+    collection = await run_milvus(get_store)
 
     # Semantic search
     #lesson
-    results = query_rag(collection, query, limit=top_k)
+    results = await query_rag_async(
+        collection, query, limit=top_k, output_fields=output_fields, min_score=MIN_HIT_SCORE
+    )
 
-    results = [r for r in results if r.get("score", 0) > 0.25]
+    results = [r for r in results if r.get("score", 0) > MIN_HIT_SCORE]
 
     # Fallback khi không tìm thấy gì
     if not results:
@@ -172,7 +404,70 @@ def rag_search(query: str, top_k=10):
     }
 
 
-def preprocess_query_with_llm(query: str) -> dict:
+async def rag_search_batch(queries, fields=None):
+    """
+    Batch search cho nhiều query (mỗi query có top_k + type riêng).
+    Query đã có trong response cache trả về luôn, phần còn lại search chung 1 lần.
+    """
+    if len(queries) > MAX_BATCH_QUERIES:
+        raise ValueError(f"Tối đa {MAX_BATCH_QUERIES} query mỗi request")
+    output_fields = resolve_output_fields(fields)
+
+    results = [None] * len(queries)
+    keys = [response_cache.make_key("search", q["query"], q["top_k"], q["type"], output_fields) for q in queries]
+    for i, key in enumerate(keys):
+        results[i] = response_cache.get(key)
+
+    pending = [i for i, r in enumerate(results) if r is None]
+    if pending:
+        version = response_cache.version
+        collection = await run_milvus(get_store)
+        batch_hits = await query_rag_batch_async(
+            collection, [queries[i] for i in pending],
+            output_fields=output_fields, min_score=MIN_HIT_SCORE
+        )
+        for i, hits in zip(pending, batch_hits):
+            results[i] = {"query": queries[i]["query"], "results": hits, "found": bool(hits)}
+            response_cache.put(keys[i], results[i], version=version)
+    return results
+
+
+def classifier_stats() -> dict:
+    with _classifier_stats_lock:
+        total = _classifier_stats["local"] + _classifier_stats["llm_fallback"]
+        return {
+            "mode": QUERY_PREPROCESS_MODE,
+            "local": _classifier_stats["local"],
+            "llm_fallback": _classifier_stats["llm_fallback"],
+            "fallback_rate": round(_classifier_stats["llm_fallback"] / total, 4) if total else 0.0,
+        }
+
+
+async def preprocess_query(query: str) -> dict:
+    """
+    Phân loại query theo QUERY_PREPROCESS_MODE.
+    Ở chế độ 'local', dùng embedding của query (đã có trong cache) để phân loại;
+    nếu margin giữa 2 nhãn thấp hơn ngưỡng thì fallback sang LLM.
+    """
+    if QUERY_PREPROCESS_MODE != "local":
+        return await preprocess_query_with_llm(query)
+
+    q_emb = await embed_query_async(query)
+    label, margin, scores = await run_embedding(query_classifier.classify, q_emb)
+    if margin >= QUERY_CLASSIFIER_MIN_MARGIN:
+        with _classifier_stats_lock:
+            _classifier_stats["local"] += 1
+        return {"query": query, "type": label}
+
+    with _classifier_stats_lock:
+        _classifier_stats["llm_fallback"] += 1
+    stats = classifier_stats()
+    logger.info(f"🤖 Margin thấp ({margin:.3f}, {scores}) → fallback LLM | "
+                f"fallback {stats['llm_fallback']}/{stats['local'] + stats['llm_fallback']} ({stats['fallback_rate']:.1%})")
+    return await preprocess_query_with_llm(query)
+
+
+async def preprocess_query_with_llm(query: str) -> dict:
     """
     Chuẩn hóa query và phân loại type ('course' hoặc 'lesson') bằng LLM.
     Trả về dict: {"query": normalized_query, "type": "course"|"lesson"}
@@ -191,14 +486,14 @@ def preprocess_query_with_llm(query: str) -> dict:
     Câu hỏi: "{query}"
     """
 
-    response = client.chat.completions.create(
+    LLM_CALLS.labels("preprocess").inc()
+    response = await async_client.chat.completions.create(
         model="gpt-4o-mini",
         messages=[{"role": "user", "content": prompt}],
         temperature=0
     )
 
     try:
-        import json
         json_text = response.choices[0].message.content.strip()
         result = json.loads(json_text)
         # fallback kiểm tra type
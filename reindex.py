@@ -0,0 +1,49 @@
+# reindex.py
+# Embed lại toàn bộ catalogue bằng pool process (vd: sau khi đổi model embedding).
+#
+#   python reindex.py                                   # embed lại course_rag đang chạy tại chỗ (upsert)
+#   python reindex.py --target course_rag_test          # ghi sang collection/store khác (insert)
+#   (đổi model/index không downtime: dùng bluegreen.py build)
+#   python reindex.py --ndjson courses.ndjson           # nguồn là file NDJSON InsertPayload
+#   python reindex.py --workers 8 --threads 4 --chunk 4096 --batch 64
+#
+# Import nặng (pipeline, torch) để trong main(): process worker (spawn) import lại file này.
+import argparse
+
+
+def main():
+    from modules.reindex_pool import reindex, iter_store_items, iter_ndjson_items, REINDEX_CHUNK, REINDEX_BATCH
+
+    parser = argparse.ArgumentParser(description="Embed lại toàn bộ catalogue bằng pool process")
+    parser.add_argument("--source", help="Store nguồn (khi không dùng --ndjson), mặc định: collection đang chạy")
+    parser.add_argument("--ndjson", help="File NDJSON InsertPayload làm nguồn")
+    parser.add_argument("--target", help="Store đích, mặc định: collection đang chạy")
+    parser.add_argument("--workers", type=int, help="Số process embed (mặc định: core / threads)")
+    parser.add_argument("--threads", type=int, help="Số thread torch mỗi process (mặc định: 4)")
+    parser.add_argument("--chunk", type=int, default=REINDEX_CHUNK, help="Số record mỗi lần insert")
+    parser.add_argument("--batch", type=int, default=REINDEX_BATCH, help="Số text mỗi task của worker")
+    parser.add_argument("--no-pin", action="store_true", help="Không pin worker vào core riêng")
+    args = parser.parse_args()
+
+    from modules.vector_stores import open_vector_store
+    from modules.collection_versions import resolve_collection_name
+
+    live = resolve_collection_name()
+    args.source = args.source or live
+    args.target = args.target or live
+    target = open_vector_store(args.target)
+    if args.ndjson:
+        items, total = iter_ndjson_items(args.ndjson), None
+        upsert = True
+    else:
+        source = target if args.source == args.target else open_vector_store(args.source)
+        items, total = iter_store_items(source, args.chunk), source.count()
+        # Ghi đè tại chỗ phải upsert; store đích mới thì insert
+        upsert = source is target
+
+    reindex(items, target, upsert=upsert, total=total, workers=args.workers, threads=args.threads,
+            chunk_size=args.chunk, batch_size=args.batch, pin_cpus=not args.no_pin)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,7 @@
-from pymilvus import utility, FieldSchema, CollectionSchema, DataType, Collection, connections
-import os
-from dotenv import load_dotenv
+from pymilvus import utility, FieldSchema, CollectionSchema, DataType, Collection
+from modules.milvus_connection import ensure_connection
 
-load_dotenv()
-_DB_HOST = os.getenv("DB_HOST")
-connections.connect("default", host=_DB_HOST, port="19530")
+ensure_connection()
 
 # Xóa collection cũ
 if utility.has_collection("course_chunks"):
@@ -0,0 +1,73 @@
+import asyncio
+from models.requests.InsertPayload import InsertPayload
+from modules import bulk_ingest
+from modules.course_rag_pipeline import diff_course_sync
+
+
+class FakeCollection:
+    name = "fake"
+
+    def __init__(self, existing):
+        self.existing = existing    # {id: (content_hash, course_id)}
+        self.upserted = []
+        self.deleted = []
+
+
+def _payload(course_id, title, lesson_ids):
+    return InsertPayload(course_id=course_id, title=title, author="A", lessons=[
+        {"lesson_id": lid, "title": f"Bài {lid}", "content": f"Nội dung {lid}"} for lid in lesson_ids
+    ])
+
+
+def _records(course):
+    # 1 record course + 1 record/bài học, hash theo nội dung (thay cho build_records thật)
+    rows = [{"id": f"{course['course_id']}-course", "course_id": course["course_id"],
+             "content_hash": course["title"]}]
+    rows += [{"id": f"{course['course_id']}-{l['lesson_id']}", "course_id": course["course_id"],
+              "content_hash": l["content"]} for l in course["lessons"]]
+    return rows
+
+
+def test_duplicate_course_in_batch_last_line_wins(monkeypatch):
+    collection = FakeCollection({
+        "C1-course": ("Cũ", "C1"), "C1-L1": ("Nội dung L1", "C1"), "C1-L9": ("Nội dung L9", "C1"),
+    })
+
+    async def plan(coll, courses):
+        records = [r for c in courses for r in _records(c)]
+        existing = {i: v for i, v in coll.existing.items() if v[1] in {c["course_id"] for c in courses}}
+        return diff_course_sync(records, [r["id"] for r in records], existing)
+
+    async def run(fn, *args, **kwargs):
+        return fn(*args, **kwargs)
+
+    monkeypatch.setattr(bulk_ingest, "plan_course_sync_async", plan)
+    monkeypatch.setattr(bulk_ingest, "run_embedding", run)
+    monkeypatch.setattr(bulk_ingest, "run_milvus", run)
+    monkeypatch.setattr(bulk_ingest, "embed_plan", lambda p: None)
+    monkeypatch.setattr(bulk_ingest, "upsert_data",
+                        lambda coll, records, flush=False: coll.upserted.extend(records))
+    monkeypatch.setattr(bulk_ingest, "delete_records", lambda coll, ids: coll.deleted.extend(ids))
+
+    results = []
+    pending = bulk_ingest._PendingWrites(collection, results)
+    batch = [
+        (1, _payload("C1", "Bản 1", ["L1", "L2"])),
+        (2, _payload("C2", "Khác", ["L1"])),
+        (3, _payload("C1", "Bản 2", ["L1", "L3"])),
+    ]
+
+    async def ingest():
+        await bulk_ingest._ingest_batch(batch, pending)
+        await pending.flush()
+
+    asyncio.run(ingest())
+
+    ids = [r["id"] for r in collection.upserted]
+    assert len(ids) == len(set(ids))
+    assert {r["id"] for r in collection.upserted if r["course_id"] == "C1"} == {"C1-course", "C1-L3"}
+    # Bài L2 của dòng bị thay không được ghi, bài L9 cũ bị xóa
+    assert sorted(collection.deleted) == ["C1-L9"]
+    by_line = {r["line"]: r for r in results}
+    assert by_line[1]["status"] == "skipped"
+    assert by_line[2]["status"] == by_line[3]["status"] == "ok"
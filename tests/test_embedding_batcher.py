@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from modules.embedding_batcher import EmbeddingBatcher
+
+
+def test_cancelled_request_does_not_kill_batcher():
+    release = threading.Event()
+    started = threading.Event()
+
+    def encode_batch(texts):
+        started.set()
+        release.wait(timeout=5)
+        return [len(t) for t in texts]
+
+    batcher = EmbeddingBatcher(encode_batch, max_batch_size=8, max_wait_ms=1)
+
+    # Batch đầu chặn worker để request sau nằm trong hàng đợi rồi bị hủy
+    first = batcher.submit("a")
+    assert started.wait(timeout=5)
+    cancelled = batcher.submit("bb")
+    assert cancelled.cancel()
+    release.set()
+
+    assert first.result(timeout=5) == 1
+    assert batcher.submit("ccc").result(timeout=5) == 3
+
+
+def test_encoder_error_goes_to_futures_and_loop_continues():
+    calls = []
+
+    def encode_batch(texts):
+        calls.append(texts)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return [len(t) for t in texts]
+
+    batcher = EmbeddingBatcher(encode_batch, max_batch_size=8, max_wait_ms=1)
+    failed = batcher.submit("a")
+    try:
+        failed.result(timeout=5)
+        assert False, "expected RuntimeError"
+    except RuntimeError:
+        pass
+    assert batcher.submit("xy").result(timeout=5) == 2
+
+
+def test_encode_runs_on_executor_and_batches_while_busy():
+    release = threading.Event()
+    started = threading.Event()
+    calls = []
+
+    def encode_batch(texts):
+        calls.append((threading.current_thread().name, list(texts)))
+        started.set()
+        release.wait(timeout=5)
+        return [len(t) for t in texts]
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="embed") as executor:
+        batcher = EmbeddingBatcher(encode_batch, max_batch_size=8, max_wait_ms=1, executor=executor)
+        first = batcher.submit("a")
+        assert started.wait(timeout=5)
+        # Batch đầu đang encode → các query sau được gom chung 1 batch
+        rest = [batcher.submit(t) for t in ("bb", "ccc", "dddd")]
+        release.set()
+
+        assert first.result(timeout=5) == 1
+        assert [f.result(timeout=5) for f in rest] == [2, 3, 4]
+
+    assert all(name.startswith("embed") for name, _ in calls)
+    assert [texts for _, texts in calls] == [["a"], ["bb", "ccc", "dddd"]]
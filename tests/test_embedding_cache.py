@@ -0,0 +1,18 @@
+import numpy as np
+from modules.embedding_cache import EmbeddingLRUCache, size_for_budget
+
+
+def test_vectors_are_stored_as_float32_arrays():
+    cache = EmbeddingLRUCache(max_size=10)
+    cache.put("m", "  Khóa học SEO ", [0.5, -0.25, 1.0])
+
+    vector = cache.get("m", "khóa học seo")
+    assert isinstance(vector, np.ndarray)
+    assert vector.dtype == np.float32
+    assert vector.tolist() == [0.5, -0.25, 1.0]
+
+
+def test_size_for_budget():
+    # 1 MB, dim 768: ~3 KB/entry → vài trăm entry
+    assert 250 < size_for_budget(1, 768) < 350
+    assert size_for_budget(0, 768) == 0
@@ -0,0 +1,42 @@
+from modules.lexical_index import BM25Index, normalize_vietnamese
+
+
+def _record(doc_id, doc_type, title, content=""):
+    return {"id": doc_id, "type": doc_type, "course_title": title, "lesson_title": "", "author": "", "content": content}
+
+
+def test_normalize_vietnamese():
+    assert normalize_vietnamese("Nguyễn  Minh, Đà Nẵng") == "nguyen minh da nang"
+
+
+def test_search_is_per_type_and_ranked():
+    index = BM25Index()
+    index.add([
+        _record("c1", "course", "Khóa học SEO nâng cao"),
+        _record("c2", "course", "Lập trình Python"),
+        _record("l1", "lesson", "Khóa học SEO nâng cao", "tối ưu onpage"),
+    ])
+    hits = index.search("seo", "course", limit=5)
+    assert [doc_id for doc_id, _ in hits] == ["c1"]
+    assert index.search("onpage", "course") == []
+    assert [doc_id for doc_id, _ in index.search("onpage", "lesson")] == ["l1"]
+
+
+def test_update_and_remove():
+    index = BM25Index()
+    index.add([_record("c1", "course", "SEO")])
+    index.add([_record("c1", "course", "Python")])
+    assert index.search("seo", "course") == []
+    index.remove(["c1"])
+    assert len(index) == 0
+    assert index.search("python", "course") == []
+
+
+def test_common_terms_are_pruned_when_rarer_terms_exist():
+    index = BM25Index()
+    index.add([_record(f"c{i}", "course", "khóa học marketing") for i in range(20)])
+    index.add([_record("seo", "course", "khóa học seo")])
+    hits = index.search("khóa học seo", "course", limit=3)
+    assert [doc_id for doc_id, _ in hits] == ["seo"]
+    # Toàn term phổ biến: vẫn trả kết quả (giữ term hiếm nhất)
+    assert len(index.search("khóa học", "course", limit=3)) == 3
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+from modules.vector_stores import MemoryVectorStore
+
+
+def _record(rid, course_id, seed):
+    vector = np.random.default_rng(seed).standard_normal(8).astype(np.float32)
+    return {"id": rid, "type": "course", "course_id": course_id, "course_title": f"Khóa {rid}",
+            "embedding": vector / np.linalg.norm(vector)}
+
+
+def _open(path):
+    return MemoryVectorStore("t", path=str(path), dim=8, dtype="float32", quantization="none")
+
+
+def test_flush_appends_rows_and_reload_replays_log(tmp_path):
+    store = _open(tmp_path)
+    store.insert([_record("a", "C1", 1), _record("b", "C1", 2)])
+    store.flush()
+    meta_size = os.path.getsize(tmp_path / "meta.json")
+
+    # Flush sau chỉ ghi thêm vào log, không ghi lại meta.json
+    store.upsert([_record("c", "C2", 3), {**_record("a", "C9", 4)}])
+    store.delete(["b"])
+    store.flush()
+    assert os.path.getsize(tmp_path / "meta.json") == meta_size
+
+    reloaded = _open(tmp_path)
+    assert reloaded.count() == 2
+    rows = {r["id"]: r for r in reloaded.get(["a", "b", "c"], ["course_id"])}
+    assert set(rows) == {"a", "c"}
+    assert rows["a"]["course_id"] == "C9"
+    hits = reloaded.search([_record("c", "C2", 3)["embedding"]], "course", limit=1)
+    assert hits[0][0]["id"] == "c"
+
+
+def test_compaction_writes_new_snapshot(tmp_path):
+    store = _open(tmp_path)
+    store.insert([_record(str(i), "C1", i) for i in range(2100)])
+    store.flush()
+    store.delete([str(i) for i in range(1500)])
+    store.flush()
+
+    reloaded = _open(tmp_path)
+    assert reloaded.count() == 600
+    assert [r["id"] for r in reloaded.get(["1500", "2099"], ["course_id"])] == ["1500", "2099"]
+    assert not os.path.exists(tmp_path / "meta.1.log")